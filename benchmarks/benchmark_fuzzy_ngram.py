@@ -0,0 +1,76 @@
+"""Benchmarks the fuzzy_ngram matching against the fuzzy matching of fuzzymatcher, on synthetic records
+
+Run with: python benchmarks/benchmark_fuzzy_ngram.py [n_lis_rows]
+LIS has the TecDoc records with a typo in the model, type or engine code. Reports the time, and how many LIS
+records keep their original TecDoc record as a match.
+"""
+import logging
+import sys
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import match
+
+MAKES = ["mercedes-benz", "man", "daf", "scania"]
+CATEGORIES = ["truck", "bus"]
+CHARACTERS = list("abcdefghijklmnopqrstuvwxyz0123456789")
+
+
+def add_typo(values: pd.Series, rng: np.random.Generator) -> pd.Series:
+    positions = [rng.integers(0, len(value)) for value in values]
+    return pd.Series(
+        [value[:i] + rng.choice(CHARACTERS) + value[i + 1:] for value, i in zip(values, positions)],
+        index=values.index,
+    )
+
+
+def make_synthetic_frames(n_lis_rows: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    n_tecdoc_rows = n_lis_rows * 2
+    type_numbers = zip(rng.integers(10, 40, n_tecdoc_rows), rng.integers(100, 600, n_tecdoc_rows))
+    df_tecdoc = pd.DataFrame({
+        "make": rng.choice(MAKES, n_tecdoc_rows),
+        "model": [f"m{i}" for i in rng.integers(100, 999, n_tecdoc_rows)],
+        "type": [f"{i}.{j}" for i, j in type_numbers],
+        "category": rng.choice(CATEGORIES, n_tecdoc_rows),
+        "component_code": [f"d{i}" for i in rng.integers(1000, 9999, n_tecdoc_rows)],
+        "model_year_start": rng.integers(1990, 2020, n_tecdoc_rows),
+        "axle_configuration": rng.choice(["4x2", "6x2"], n_tecdoc_rows),
+    })
+    df_tecdoc["N-Type No."] = np.arange(n_tecdoc_rows)
+    df_tecdoc["in_tecdoc"] = True
+
+    df_lis = df_tecdoc.sample(n_lis_rows, random_state=seed).drop(columns=["in_tecdoc"]).reset_index(drop=True)
+    df_lis = df_lis.rename(columns={"N-Type No.": "original_n_type"})
+    for col in ["model", "type", "component_code"]:
+        has_typo = rng.random(n_lis_rows) < 0.3
+        df_lis.loc[has_typo, col] = add_typo(df_lis.loc[has_typo, col], rng)
+    df_lis["type_id"] = np.arange(n_lis_rows)
+    return df_lis, df_tecdoc
+
+
+def count_original_matches(df_lis_matched: pd.DataFrame) -> int:
+    is_original = df_lis_matched["N-Type No."] == df_lis_matched["original_n_type"]
+    return df_lis_matched.loc[is_original, "type_id"].nunique()
+
+
+def main(n_lis_rows: int) -> None:
+    df_lis, df_tecdoc = make_synthetic_frames(n_lis_rows)
+    print(f"{len(df_lis)} LIS rows, {len(df_tecdoc)} TecDoc rows")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for name, match_function in [("fuzzy", match.match_fuzzy), ("fuzzy_ngram", match.match_ngram)]:
+        start = time.perf_counter()
+        df_lis_matched = match_function(df_lis, df_tecdoc)
+        seconds = time.perf_counter() - start
+        print(
+            f"{name}: {seconds:.2f}s, {count_original_matches(df_lis_matched)}/{len(df_lis)} LIS records matched "
+            f"to their original TecDoc record"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
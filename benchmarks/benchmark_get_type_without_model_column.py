@@ -0,0 +1,56 @@
+"""Benchmarks clean.get_type_without_model_column against the original row-wise implementation
+
+Run with: python benchmarks/benchmark_get_type_without_model_column.py [n_rows]
+"""
+import sys
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import clean
+
+MODELS = ["actros", "atego", "axor", "tgx", "tgs", "tgl", "xf 105", "cf 85", "fh 12", "r"]
+SUBTYPES = ["1840 ls", "2541 l/ll", "18.440 bls", "26.480 ll", "ft", "420 la", "8.180", "1844, 1846 ls"]
+
+
+def get_type_without_model_column_rowwise(df: pd.DataFrame) -> pd.DataFrame:
+    """The original implementation"""
+    df = df.copy(deep=True)
+    df["type"] = df.apply(
+        lambda x: x["type"].replace(f"{x['model']} ", ""),
+        axis=1
+    )
+    return df
+
+
+def make_synthetic_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    models = rng.choice(MODELS, n_rows)
+    subtypes = rng.choice(SUBTYPES, n_rows)
+    # Most types start with their own model, some with another model, some without a model
+    type_models = np.where(rng.random(n_rows) < 0.8, models, rng.choice(MODELS, n_rows))
+    with_model = rng.random(n_rows) < 0.9
+    types = np.where(with_model, np.char.add(np.char.add(type_models, " "), subtypes), subtypes)
+    return pd.DataFrame({"model": models, "type": types}).astype("string")
+
+
+def time_function(function: Callable[[pd.DataFrame], pd.DataFrame], df: pd.DataFrame) -> Tuple[pd.DataFrame, float]:
+    start = time.perf_counter()
+    result = function(df)
+    return result, time.perf_counter() - start
+
+
+def main(n_rows: int) -> None:
+    df = make_synthetic_frame(n_rows)
+    df_rowwise, seconds_rowwise = time_function(get_type_without_model_column_rowwise, df)
+    df_vectorized, seconds_vectorized = time_function(clean.get_type_without_model_column, df)
+    pd.testing.assert_frame_equal(df_rowwise, df_vectorized)
+    print(f"{n_rows} rows, output identical")
+    print(f"row-wise apply: {seconds_rowwise:.3f}s")
+    print(f"vectorized:     {seconds_vectorized:.3f}s ({seconds_rowwise / seconds_vectorized:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
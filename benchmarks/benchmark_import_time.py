@@ -0,0 +1,66 @@
+"""Benchmarks the import time of the CLI and guards that heavy dependencies are imported lazily
+
+Run with: python benchmarks/benchmark_import_time.py
+Exits with status 1 if a heavy dependency is imported where it should not be.
+"""
+import subprocess
+import sys
+import time
+
+N_REPEATS = 5
+
+# module to import -> heavy modules that must not be imported by it
+LAZY_IMPORTS = {
+    "oly_matching.cli": ["pandas", "numpy", "fuzzymatcher", "oly_matching.main"],
+    "oly_matching.main": ["fuzzymatcher", "fuzzywuzzy"],
+}
+
+
+def get_imported_modules(module: str, heavy_modules: list) -> list:
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return [x for x in output.strip().split(",") if x]
+
+
+def get_cumulative_import_time(module: str) -> float:
+    """Returns the cumulative import time in seconds according to python -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    for line in stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        fields = [x.strip() for x in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    raise ValueError(f"Could not find import time of {module}")
+
+
+def get_wall_time(command: list) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    status = 0
+    for module, heavy_modules in LAZY_IMPORTS.items():
+        imported = get_imported_modules(module, heavy_modules)
+        if imported:
+            print(f"FAIL: importing {module} also imports {imported}")
+            status = 1
+        import_time = min(get_cumulative_import_time(module) for _ in range(N_REPEATS))
+        print(f"import {module}: {import_time * 1000:.1f} ms")
+
+    help_time = min(get_wall_time([sys.executable, "-m", "oly_matching.cli", "--help"]) for _ in range(N_REPEATS))
+    print(f"olyslager --help: {help_time * 1000:.1f} ms (wall clock, including interpreter startup)")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
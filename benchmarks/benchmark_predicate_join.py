@@ -0,0 +1,81 @@
+"""Benchmarks the exact matching with the year and axle predicates in the join against filtering after the join
+
+Run with: python benchmarks/benchmark_predicate_join.py [n_lis_rows]
+TecDoc has many N-types per key (every model year and axle configuration of a vehicle and engine code), which the
+original join materializes before the filters drop most of them.
+"""
+import logging
+import sys
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import match
+from oly_matching.index import TecDocIndex
+
+MAKES = ["mercedes-benz", "man", "daf", "scania"]
+CATEGORIES = ["truck", "bus", "tractor"]
+AXLE_CONFIGURATIONS = ["4x2", "6x2", "6x4", "8x4"]
+YEARS = np.arange(1995, 2021)
+
+
+def match_exactly_original(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, tecdoc_index: TecDocIndex) -> pd.DataFrame:
+    df_lis_matched = match.match_on_required_columns(df_lis, df_tecdoc, tecdoc_index)
+    df_lis_matched = match.keep_records_start_year_close(df_lis_matched)
+    df_lis_matched = match.keep_records_with_matching_axle_config(df_lis_matched)
+    df_lis_matched["in_tecdoc"] = df_lis_matched["in_tecdoc"].replace(to_replace=[None], value=False)
+    return df_lis_matched.reset_index(drop=True)
+
+
+def make_synthetic_frames(n_lis_rows: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Every vehicle and engine code has an N-type per model year and axle configuration"""
+    rng = np.random.default_rng(seed)
+    n_keys = max(n_lis_rows // 10, 1)
+    df_keys = pd.DataFrame({
+        "make": rng.choice(MAKES, n_keys),
+        "model": rng.integers(0, 50, n_keys).astype(str),
+        "type": rng.integers(0, 5000, n_keys).astype(str),
+        "category": rng.choice(CATEGORIES, n_keys),
+        "component_code": rng.integers(100_000, 1_000_000, n_keys).astype(str),
+    }).drop_duplicates().reset_index(drop=True)
+    df_variants = pd.MultiIndex.from_product(
+        [YEARS, AXLE_CONFIGURATIONS], names=["model_year_start", "axle_configuration"]
+    ).to_frame(index=False)
+    df_tecdoc = df_keys.merge(df_variants, how="cross")
+    df_tecdoc["N-Type No."] = np.arange(len(df_tecdoc))
+    df_tecdoc["in_tecdoc"] = True
+
+    df_lis = df_keys.sample(n_lis_rows, replace=True, random_state=seed).reset_index(drop=True)
+    df_lis["model_year_start"] = pd.array(rng.choice(YEARS, n_lis_rows), dtype="Int16")
+    df_lis["axle_configuration"] = rng.choice(AXLE_CONFIGURATIONS + [None], n_lis_rows)
+    df_lis["type_id"] = np.arange(n_lis_rows)
+    return df_lis, df_tecdoc
+
+
+def main(n_lis_rows: int) -> None:
+    df_lis, df_tecdoc = make_synthetic_frames(n_lis_rows)
+    print(f"{len(df_lis)} LIS rows, {len(df_tecdoc)} TecDoc rows")
+    logging.getLogger().setLevel(logging.WARNING)
+    tecdoc_index = TecDocIndex.build(df_tecdoc)
+
+    start = time.perf_counter()
+    result_original = match_exactly_original(df_lis, df_tecdoc, tecdoc_index)
+    seconds_original = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result_predicates = match.match_exactly(df_lis, df_tecdoc, tecdoc_index)
+    seconds_predicates = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result_original, result_predicates)
+    lis_rows, _ = tecdoc_index.probe(df_lis)
+    print(f"output identical ({len(result_predicates)} rows, the join without predicates has {len(lis_rows)} rows)")
+    print(
+        f"join then filter: {seconds_original:.3f}s, predicates in the join: {seconds_predicates:.3f}s "
+        f"({seconds_original / seconds_predicates:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
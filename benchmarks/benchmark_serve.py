@@ -0,0 +1,65 @@
+"""Measures the latency of the lookup service over HTTP: cold lookups, cached lookups and a batch
+
+Run with: python benchmarks/benchmark_serve.py <reference_folder> <lis_path> [n_lookups]
+The reference is built with 'olyslager build-reference'.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer
+from typing import List
+
+import numpy as np
+
+from oly_matching import load, main, serve
+
+
+def post(url: str, content: object) -> object:
+    headers = {"Content-Type": "application/json"}
+    request = urllib.request.Request(url, data=json.dumps(content).encode(), headers=headers)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def time_single_lookups(url: str, records: List[dict]) -> np.ndarray:
+    milliseconds = []
+    for record in records:
+        start = time.perf_counter()
+        post(url, record)
+        milliseconds.append((time.perf_counter() - start) * 1000)
+    return np.array(milliseconds)
+
+
+def main_benchmark(reference_folder: str, lis_path: str, n_lookups: int) -> None:
+    df_tecdoc, tecdoc_index = main.load_or_build_reference(reference_folder, tecdoc_path=None)
+    df_lis = load.load_lis(lis_path, cache_folder=None)
+    records = json.loads(df_lis.head(n_lookups).to_json(orient="records"))
+    # Like the service: the pipeline logs every step
+    logging.getLogger().setLevel(logging.WARNING)
+
+    service = serve.LookupService(df_tecdoc, tecdoc_index)
+    server = HTTPServer(("127.0.0.1", 0), serve.make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}{serve.LOOKUP_PATH}"
+
+    for name, milliseconds in [
+        ("cold single lookups", time_single_lookups(url, records)),
+        ("cached single lookups", time_single_lookups(url, records)),
+    ]:
+        p50, p99 = np.percentile(milliseconds, [50, 99])
+        print(f"{name}: {len(milliseconds)} lookups, p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+    service = serve.LookupService(df_tecdoc, tecdoc_index)
+    server.RequestHandlerClass = serve.make_handler(service)
+    start = time.perf_counter()
+    post(url, records)
+    milliseconds = (time.perf_counter() - start) * 1000
+    print(f"cold batch: {len(records)} records in {milliseconds:.0f} ms ({milliseconds / len(records):.2f} ms/record)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 200)
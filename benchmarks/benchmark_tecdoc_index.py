@@ -0,0 +1,92 @@
+"""Benchmarks the exact matching through a (memory-mapped) TecDocIndex against the original pd.merge
+
+Run with: python benchmarks/benchmark_tecdoc_index.py [n_lis_rows]
+"""
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import match
+from oly_matching.index import TecDocIndex
+
+MAKES = ["mercedes-benz", "man", "daf", "scania"]
+CATEGORIES = ["truck", "bus", "tractor"]
+
+
+def match_on_required_columns_original(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
+    df_lis = df_lis.copy(deep=True)
+    df_tecdoc = df_tecdoc.copy(deep=True)
+    df_lis["component_code_clean"] = df_lis["component_code"]
+    df_tecdoc["component_code_clean"] = df_tecdoc["component_code"]
+    df_lis_matched = pd.merge(
+        left=df_lis,
+        right=df_tecdoc,
+        how="left",
+        on=match.MATCHING_MERGE_EXACT,
+        suffixes=("_lis", "_tecdoc")
+    )
+    return df_lis_matched.drop(columns=["component_code_clean"])
+
+
+def make_synthetic_frames(n_lis_rows: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """TecDoc has 4 engine codes per vehicle, LIS has a random sample of them and as many unknown engine codes"""
+    rng = np.random.default_rng(seed)
+    n_vehicles = max(n_lis_rows // 4, 1)
+    df_vehicles = pd.DataFrame({
+        "make": rng.choice(MAKES, n_vehicles),
+        "model": rng.integers(0, 50, n_vehicles).astype(str),
+        "type": rng.integers(0, 5000, n_vehicles).astype(str),
+        "category": rng.choice(CATEGORIES, n_vehicles),
+    }).drop_duplicates().reset_index(drop=True)
+
+    df_tecdoc = df_vehicles.loc[df_vehicles.index.repeat(4)].reset_index(drop=True)
+    df_tecdoc["component_code"] = rng.integers(100_000, 1_000_000, len(df_tecdoc)).astype(str)
+    df_tecdoc["model_year_start"] = rng.integers(1990, 2020, len(df_tecdoc))
+    df_tecdoc["axle_configuration"] = rng.choice(["4x2", "6x2"], len(df_tecdoc))
+    df_tecdoc["N-Type No."] = np.arange(len(df_tecdoc))
+
+    df_lis = df_tecdoc.sample(n_lis_rows, replace=True, random_state=seed).reset_index(drop=True)
+    df_lis = df_lis.drop(columns=["N-Type No."])
+    is_unknown = rng.random(n_lis_rows) < 0.5
+    df_lis.loc[is_unknown, "component_code"] = rng.integers(100_000, 1_000_000, is_unknown.sum()).astype(str)
+    df_lis["type_id"] = np.arange(n_lis_rows)
+    return df_lis, df_tecdoc
+
+
+def main(n_lis_rows: int) -> None:
+    df_lis, df_tecdoc = make_synthetic_frames(n_lis_rows)
+    print(f"{len(df_lis)} LIS rows, {len(df_tecdoc)} TecDoc rows")
+
+    start = time.perf_counter()
+    result_original = match_on_required_columns_original(df_lis, df_tecdoc)
+    seconds_original = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tecdoc_index = TecDocIndex.build(df_tecdoc)
+    seconds_build = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as folder:
+        tecdoc_index.save(folder)
+        start = time.perf_counter()
+        tecdoc_index = TecDocIndex.load(folder)
+        seconds_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result_index = match.match_on_required_columns(df_lis, df_tecdoc, tecdoc_index)
+        seconds_probe = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result_original, result_index)
+    print(f"output identical ({len(result_index)} rows)")
+    print(f"pd.merge: {seconds_original:.3f}s")
+    print(
+        f"index: build {seconds_build:.3f}s, memory-mapped load {seconds_load:.3f}s, "
+        f"probe and join {seconds_probe:.3f}s ({seconds_original / seconds_probe:.1f}x faster than pd.merge)"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,135 @@
+"""Benchmarks the vectorized type expansion helpers against the original implementations with per-row lambdas
+
+Run with: python benchmarks/benchmark_type_expansion.py [n_rows]
+"""
+import sys
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import clean, extract
+
+# {0} and {1} are filled with random numbers, so the column has many distinct values like the real data
+TYPE_TEMPLATES = [
+    "{0} l/ll 6x2",
+    "{0} ls/lls",
+    "{0}, {1} ls",
+    "18.{0:.3}, 18.{1:.3} bls",
+    "28.{0:.3} fc, frc",
+    "19.{0:.3} fk,29.{1:.3} flk",
+    "24.{0:.3}, 24.{1:.3}",
+    "26.{0:.3} ll",
+    "ft",
+    "{0} la 4x2",
+]
+
+
+def expand_slash_separated_types_original(df: pd.DataFrame) -> pd.DataFrame:
+    split_type_series = df["type"].str.split("\s+")
+    df["base_type"] = split_type_series.apply(lambda x: x[0])
+    df["subtypes"] = split_type_series.apply(lambda x: x[1].split("/") if len(x) > 1 else [""])
+    df = df.explode(column="subtypes")
+    df["type"] = df["base_type"] + " " + df["subtypes"]
+    return df
+
+
+def expand_comma_separated_types_original(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy(deep=True)
+    base_types_regex = "^\d{4}(?:,\s\d{4})+|^\d{2}.\d{3}(?:,\s\d{2}.\d{3})+"
+    df["base_types"] = (
+        df["type"]
+        .str.findall(base_types_regex)
+        .apply(lambda x: x[0] if x else "")
+        .str.split(", ")
+    )
+    df["stripped_type"] = df["type"].str.replace(base_types_regex, "", regex=True)
+    df["stripped_type"] = clean.clean_whitespace(df["stripped_type"])
+    df["sub_type"] = (
+        df["stripped_type"]
+        .str.split(" ")
+        .apply(lambda x: x[0])
+        .str.extract("^(\w+)")
+        .fillna("")
+    )
+    df = df.explode(column="base_types")
+    df["type"] = df["base_types"] + " " + df["sub_type"]
+    return df
+
+
+def expand_type_column_format_1_original(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy(deep=True)
+    is_format = df["tecdoc_format"] == 1
+    df_1 = df[is_format]
+    df_rest = df[~is_format]
+
+    split_type = df_1["type"].str.split(" ")
+    df_1["base_type"] = split_type.apply(lambda x: x[0])
+    df_1["base_type"] = clean.strip_all_special_characters(df_1["base_type"])
+
+    df_1["rest"] = split_type.apply(lambda x: " ".join(x[1:]))
+    df_1["sub_types"] = split_type.apply(lambda x: " ".join(x[1:])).str.split(",")
+    df_1 = df_1.explode("sub_types")
+    df_1["sub_types"] = clean.clean_whitespace(df_1["sub_types"])
+    df_1["type"] = df_1["base_type"] + " " + df_1["sub_types"]
+
+    df = pd.concat([df_1, df_rest], axis=0)
+    return df
+
+
+def get_type_format_tecdoc_original(df: pd.DataFrame) -> pd.Series:
+    is_multiple_types = df["type"].str.contains(",")
+    split_type = df["type"].str.split(" ")
+    first_words = split_type.apply(lambda x: x[0])
+    other_words = split_type.apply(lambda x: " ".join(x[1:]))
+    other_words_no_digits = ~other_words.str.contains("[0-9]+")
+    df_words = pd.concat([df["type"], is_multiple_types, first_words, other_words, other_words_no_digits], axis=1)
+    df_words.columns = ["type", "is_multiple_types", "first_word", "other_words", "other_words_no_digits"]
+
+    format_series = pd.Series(index=df_words.index, name="tecdoc_format", dtype=int)
+    format_series[~df_words["is_multiple_types"]] = 0
+    format_series[df_words["is_multiple_types"] & df_words["other_words_no_digits"]] = 1
+    format_series[df_words["is_multiple_types"] & ~df_words["other_words_no_digits"]] = 2
+    return format_series
+
+
+def make_synthetic_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    templates = rng.choice(TYPE_TEMPLATES, n_rows)
+    numbers = rng.integers(1000, 10000, size=(n_rows, 2)).astype(str)
+    types = [template.format(*row_numbers) for template, row_numbers in zip(templates, numbers)]
+    return pd.DataFrame({"type": types, "tecdoc_format": 1})
+
+
+def time_function(function: Callable, df: pd.DataFrame) -> Tuple[object, float]:
+    df = df.copy()
+    start = time.perf_counter()
+    result = function(df)
+    return result, time.perf_counter() - start
+
+
+def main(n_rows: int) -> None:
+    df = make_synthetic_frame(n_rows)
+    helpers = [
+        ("expand_slash_separated_types", expand_slash_separated_types_original, clean.expand_slash_separated_types),
+        ("expand_comma_separated_types", expand_comma_separated_types_original, clean.expand_comma_separated_types),
+        ("_expand_type_column_format_1", expand_type_column_format_1_original, clean._expand_type_column_format_1),
+        ("get_type_format_tecdoc", get_type_format_tecdoc_original, extract.get_type_format_tecdoc),
+    ]
+    print(f"{n_rows} rows, {df['type'].nunique()} distinct types")
+    for name, original, vectorized in helpers:
+        result_original, seconds_original = time_function(original, df)
+        result_vectorized, seconds_vectorized = time_function(vectorized, df)
+        if isinstance(result_original, pd.Series):
+            pd.testing.assert_series_equal(result_original, result_vectorized)
+        else:
+            pd.testing.assert_frame_equal(result_original, result_vectorized)
+        print(
+            f"{name}: output identical, original {seconds_original:.3f}s, vectorized {seconds_vectorized:.3f}s "
+            f"({seconds_original / seconds_vectorized:.1f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,94 @@
+"""Benchmarks the wildcard prefix index against the original loop that strips one wildcard at a time
+
+Run with: python benchmarks/benchmark_wildcard_matching.py [n_lis_rows]
+"""
+import sys
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import match
+
+MAKES = ["mercedes-benz", "man", "daf", "scania"]
+CATEGORIES = ["truck", "bus", "tractor"]
+
+
+def match_on_required_columns_original(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
+    df_lis = df_lis.copy(deep=True)
+    df_tecdoc = df_tecdoc.copy(deep=True)
+
+    df_lis["component_code_clean"] = df_lis["component_code"]
+    df_tecdoc["component_code_clean"] = df_tecdoc["component_code"]
+
+    df_matched_list = []
+    while len(df_lis) > 0:
+        ends_with_x = df_lis["component_code_clean"].str[-1] == "x"
+        df_lis_i = df_lis[~ends_with_x]
+        df_matched_i = pd.merge(
+            left=df_lis_i,
+            right=df_tecdoc,
+            how="left",
+            on=match.MATCHING_MERGE_EXACT,
+            suffixes=("_lis", "_tecdoc")
+        )
+        df_matched_list.append(df_matched_i)
+
+        df_lis = df_lis[ends_with_x]
+        df_lis["component_code_clean"] = df_lis["component_code_clean"].str[:-1]
+        df_tecdoc["component_code_clean"] = df_tecdoc["component_code_clean"].str[:-1]
+
+    df_lis_matched = pd.concat(df_matched_list)
+    df_lis_matched = df_lis_matched.drop(columns=["component_code_clean"])
+    return df_lis_matched
+
+
+def make_synthetic_frames(n_lis_rows: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """TecDoc has 4 engine codes of 6 digits per vehicle, half of the Mercedes LIS codes end with 1 to 3 wildcards"""
+    rng = np.random.default_rng(seed)
+    n_vehicles = max(n_lis_rows // 4, 1)
+    df_vehicles = pd.DataFrame({
+        "make": rng.choice(MAKES, n_vehicles),
+        "model": rng.integers(0, 50, n_vehicles).astype(str),
+        "type": rng.integers(0, 5000, n_vehicles).astype(str),
+        "category": rng.choice(CATEGORIES, n_vehicles),
+    }).drop_duplicates().reset_index(drop=True)
+
+    df_tecdoc = df_vehicles.loc[df_vehicles.index.repeat(4)].reset_index(drop=True)
+    df_tecdoc["component_code"] = rng.integers(100_000, 1_000_000, len(df_tecdoc)).astype(str)
+    df_tecdoc["model_year_start"] = rng.integers(1990, 2020, len(df_tecdoc))
+    df_tecdoc["axle_configuration"] = rng.choice(["4x2", "6x2"], len(df_tecdoc))
+    df_tecdoc["N-Type No."] = np.arange(len(df_tecdoc))
+
+    df_lis = df_tecdoc.sample(n_lis_rows, replace=True, random_state=seed).reset_index(drop=True)
+    df_lis = df_lis.drop(columns=["N-Type No."])
+    n_wildcards = rng.choice([0, 0, 0, 1, 2, 3], n_lis_rows) * (df_lis["make"] == "mercedes-benz")
+    df_lis["component_code"] = [
+        code[:len(code) - n] + "x" * n for code, n in zip(df_lis["component_code"], n_wildcards)
+    ]
+    df_lis["type_id"] = np.arange(n_lis_rows)
+    return df_lis, df_tecdoc
+
+
+def time_function(function: Callable, df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> Tuple[pd.DataFrame, float]:
+    start = time.perf_counter()
+    result = function(df_lis, df_tecdoc)
+    return result, time.perf_counter() - start
+
+
+def main(n_lis_rows: int) -> None:
+    df_lis, df_tecdoc = make_synthetic_frames(n_lis_rows)
+    print(f"{len(df_lis)} LIS rows ({df_lis['component_code'].str.endswith('x').sum()} with wildcards), "
+          f"{len(df_tecdoc)} TecDoc rows")
+    result_original, seconds_original = time_function(match_on_required_columns_original, df_lis, df_tecdoc)
+    result_index, seconds_index = time_function(match.match_on_required_columns, df_lis, df_tecdoc)
+    pd.testing.assert_frame_equal(result_original.reset_index(drop=True), result_index.reset_index(drop=True))
+    print(
+        f"match_on_required_columns: output identical ({len(result_index)} rows), original {seconds_original:.3f}s, "
+        f"prefix index {seconds_index:.3f}s ({seconds_original / seconds_index:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
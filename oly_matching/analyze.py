@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from oly_matching import constants as c
 
@@ -7,7 +8,7 @@ def get_lis_id_with_n_types(df_matched: pd.DataFrame) -> pd.DataFrame:
     lis_id_with_n_types = (
         df_matched
         .groupby("type_id")
-        .apply(lambda x: x["N-Type No."].unique())
+        .apply(lambda x: np.unique(x["N-Type No."].astype(int)))
     )
     return lis_id_with_n_types
 
@@ -66,6 +67,21 @@ def get_links_and_original_data(df_matched: pd.DataFrame, df_lis_original: pd.Da
         how="left",
         suffixes=("_lis", "_tecdoc")
     )
+    # The same order whatever order the matching found the links in (e.g. incremental and full runs)
+    df_links = df_links.sort_values(["type_id", "N-Type No."], kind="stable").reset_index(drop=True)
     df_links = df_links[c.MATCHING_OUTPUT_COLUMNS]
     df_links = df_links.rename(columns={"axle_configuration": "axle_configuration_tecdoc"})
+    if "match_stage" in df_matched.columns:
+        df_links = add_match_stage(df_links, df_matched)
     return df_links
+
+
+def add_match_stage(df_links: pd.DataFrame, df_matched: pd.DataFrame) -> pd.DataFrame:
+    """Adds the stage of the cascade matching that produced every link (the first one, if several did)"""
+    match_stage = (
+        df_matched[df_matched["match_stage"].notnull()]
+        .groupby(["type_id", "N-Type No."], observed=True)["match_stage"]
+        .min()
+        .astype(str)
+    )
+    return df_links.join(match_stage, on=["type_id", "N-Type No."])
@@ -1,14 +1,142 @@
+import functools
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+import numpy as np
 import pandas as pd
 from oly_matching import constants as c
 from oly_matching import utils, extract
 
 ROMAN_NUMERALS = {"i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5}
 
+# Shared with the cleaning of single records in record.py
+BRACKETS_REGEX = "\((.*?)\)"
+SPECIAL_CHARACTERS_REGEX = r"[^\w\s]+"
+# LIS types with several base types, e.g. "1840, 1844 ls", or several subtypes, e.g. "2541 l/ll 6x2"
+BASE_TYPES_REGEX = "^\d{4}(?:,\s\d{4})+|^\d{2}.\d{3}(?:,\s\d{2}.\d{3})+"
+SUB_TYPE_REGEX = "^(\w+)"
+SLASH_SEPARATED_TYPE_REGEX = "(\w+\s?/)+"
+# The type of MAN TG models, e.g. "18.440"
+MAN_TG_TYPE_REGEX = "\d{2}.\d{3}"
+
+# brand -> function (lower case make -> is brand). The first matching brand wins and the partitions are
+# reassembled in this order, followed by all other records
+BRANDS = {
+    "man": lambda make: make == "man",
+    "mercedes": lambda make: make.str.contains("mercedes"),
+}
+OTHER_BRAND = "other"
+
+# With workers, the makes are divided over this many partitions per worker to balance the load
+PARTITIONS_PER_WORKER = 4
+
+# brand -> cleaning step -> rules, register rules with @brand_rule
+BRAND_RULES: Dict[str, Dict[str, List[Callable[[pd.DataFrame], pd.DataFrame]]]] = {}
+
+
+def brand_rule(brand: str, step: str) -> Callable:
+    """Registers the decorated function as a rule of the given cleaning step for the records of one brand
+
+    The rule gets the partition of the frame that only contains records of the brand.
+    """
+    def register(rule: Callable[[pd.DataFrame], pd.DataFrame]) -> Callable[[pd.DataFrame], pd.DataFrame]:
+        BRAND_RULES.setdefault(brand, {}).setdefault(step, []).append(rule)
+        return rule
+    return register
+
+
+def apply_brand_rules(df: pd.DataFrame, brand: str, step: str) -> pd.DataFrame:
+    for rule in BRAND_RULES.get(brand, {}).get(step, []):
+        df = rule(df)
+    return df
+
+
+def get_brand(make: pd.Series) -> pd.Series:
+    """Returns the brand (a key of BRANDS, or OTHER_BRAND) of every record"""
+    make = make.astype("string").str.lower()
+    brand = pd.Series(OTHER_BRAND, index=make.index, dtype=object)
+    is_assigned = pd.Series(False, index=make.index)
+    for brand_name, is_brand in BRANDS.items():
+        is_brand_record = is_brand(make).fillna(False).astype(bool) & ~is_assigned
+        brand[is_brand_record] = brand_name
+        is_assigned |= is_brand_record
+    return brand
+
+
+def apply_per_brand(df: pd.DataFrame, function: Callable[[pd.DataFrame, str], pd.DataFrame]) -> pd.DataFrame:
+    """Partitions the frame by brand once, runs function(partition, brand) and reassembles the partitions once"""
+    brands = get_brand(df["make"]).to_numpy()
+    partitions = []
+    for brand in list(BRANDS) + [OTHER_BRAND]:
+        positions = np.flatnonzero(brands == brand)
+        if len(positions) > 0:
+            partitions.append(function(df.take(positions), brand))
+    if not partitions:
+        return function(df, OTHER_BRAND)
+    return pd.concat(partitions, axis=0)
+
+
+def clean_per_make(
+    df: pd.DataFrame,
+    function: Callable[[pd.DataFrame, str], pd.DataFrame],
+    workers: int = 1,
+) -> pd.DataFrame:
+    """Runs function(partition, brand) per brand, divided over a pool of worker processes if workers > 1
+
+    Every cleaning step only looks at the values within a row, so records of different makes can be cleaned
+    independently. The makes are divided over partitions of roughly equal size, which are cleaned in parallel.
+    The cleaned rows are put in the order of the records they came from, so the result does not depend on the
+    number of workers.
+    """
+    labels = df.index
+    df = df.set_axis(pd.RangeIndex(len(df)), axis=0)
+    if workers > 1 and len(df) > 0:
+        partitions = _get_make_partitions(df, workers * PARTITIONS_PER_WORKER)
+        logging.info(f"Cleaning {len(partitions)} partitions of makes with {workers} workers...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(apply_per_brand, partition, function) for partition in partitions]
+            df = pd.concat([future.result() for future in futures], axis=0)
+    else:
+        df = apply_per_brand(df, function)
+    df = df.sort_index(kind="stable")
+    return df.set_axis(labels[df.index], axis=0)
+
+
+def _get_make_partitions(df: pd.DataFrame, n_partitions: int) -> List[pd.DataFrame]:
+    """Divides the records over at most n_partitions, all records of a make end up in the same partition"""
+    make_codes, _ = pd.factorize(df["make"])
+    make_sizes = np.bincount(make_codes + 1)
+    # Largest makes first, each to the partition with the fewest records so far
+    partition_of_make = np.zeros(len(make_sizes), dtype=int)
+    partition_sizes = np.zeros(min(n_partitions, len(make_sizes)), dtype=int)
+    for make_code in np.argsort(-make_sizes, kind="stable"):
+        partition = partition_sizes.argmin()
+        partition_of_make[make_code] = partition
+        partition_sizes[partition] += make_sizes[make_code]
+    partition_of_record = partition_of_make[make_codes + 1]
+    return [
+        df.take(np.flatnonzero(partition_of_record == partition))
+        for partition in range(len(partition_sizes))
+        if partition_sizes[partition] > 0
+    ]
+
+
+def per_brand(function: Callable[[pd.DataFrame, str], pd.DataFrame]) -> Callable:
+    """Decorator for cleaning steps with brand rules
+
+    If no brand is passed, the frame is partitioned by brand and the step runs once per partition.
+    """
+    @functools.wraps(function)
+    def wrapper(df: pd.DataFrame, brand: Optional[str] = None) -> pd.DataFrame:
+        if brand is None:
+            return apply_per_brand(df, function)
+        return function(df, brand)
+    return wrapper
+
 
 def keep_engine_records_lis(df: pd.DataFrame) -> pd.DataFrame:
     logging.info("Dropping all LIS records that are not related to the engine...")
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     ix_keep = df["component_group"] == "Engines"
     logging.info(f"Lis after dropping {len(df) - ix_keep.sum()} rows that are not 'Engines': {df.shape}")
     df = df.loc[ix_keep, :]
@@ -17,7 +145,7 @@ def keep_engine_records_lis(df: pd.DataFrame) -> pd.DataFrame:
 
 # TODO: change this function according to which records you want to match
 def filter_records(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     # ix_keep = (
     #     (df["make"].str.lower().str.contains("mercedes"))
     #     | (df["make"] == "MAN")
@@ -26,6 +154,7 @@ def filter_records(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@utils.per_unique_value
 def clean_whitespace(series: pd.Series) -> pd.Series:
     return (
         series
@@ -35,6 +164,7 @@ def clean_whitespace(series: pd.Series) -> pd.Series:
     )
 
 
+@utils.per_unique_value
 def clean_category_column_lis(series: pd.Series) -> pd.Series:
     return series.apply(clean_category_value_lis)
 
@@ -51,12 +181,13 @@ def clean_category_column_tecdoc(series: pd.Series) -> pd.Series:
 
 
 def convert_time_cols_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     for year_col in ("model_year_start", "model_year_end"):
         df[year_col] = df[year_col].dt.year
     return df
 
 
+@utils.per_unique_value
 def clean_make_column(make_series: pd.Series) -> pd.Series:
     """Removes everything between brackets, punctuation, and makes lowercase"""
     no_info_between_brackets = remove_substrings_with_accolades(make_series)
@@ -64,44 +195,45 @@ def clean_make_column(make_series: pd.Series) -> pd.Series:
     return clean_make_series
 
 
+@utils.per_unique_value
 def remove_substrings_with_accolades(series: pd.Series) -> pd.Series:
-    return series.str.replace("\((.*?)\)", "", regex=True)
+    return series.str.replace(BRACKETS_REGEX, "", regex=True)
 
 
+@utils.per_unique_value
 def remove_euro_code(series: pd.Series) -> pd.Series:
     clean_series = series.str.replace(c.EURO_CODE_REGEX, "", regex=True)
     clean_series = clean_whitespace(clean_series)
     return clean_series
 
 
-def clean_model_column_lis(df: pd.DataFrame) -> pd.DataFrame:
+@per_brand
+def clean_model_column_lis(df: pd.DataFrame, brand: Optional[str] = None) -> pd.DataFrame:
     """Cleans the make column
 
     Assumes column has been converted to lower string already
     """
-    df = df.copy(deep=True)
-    df = remove_vehicle_type_mercedes_lis(df)
+    df = utils.copy_input(df)
+    df = apply_brand_rules(df, brand, "model_lis")
     clean_series = remove_euro_code(df["model"])
     clean_series = clean_whitespace(clean_series)
     clean_series = clean_series.replace("tgl /4", "tgl")
     clean_series = remove_substrings_with_accolades(clean_series)
-    df["model"] = clean_series.copy(deep=True)
+    df["model"] = clean_series
     df = utils.explode_column(df, "model", ",")
     df = utils.explode_column(df, "model", "/")
     return df
 
 
+@brand_rule("mercedes", "model_lis")
 def remove_vehicle_type_mercedes_lis(df: pd.DataFrame) -> pd.DataFrame:
-    is_mercedes = df["make"].str.lower().str.contains("mercedes")
-    df_mercedes = df[is_mercedes]
-    df_rest = df[~is_mercedes]
-    df_mercedes["model"] = df_mercedes["model"].str.replace("|".join(c.VEHICLE_TYPES_LIS), "", regex=True)
-    df = pd.concat([df_mercedes, df_rest])
+    df["model"] = df["model"].str.replace("|".join(c.VEHICLE_TYPES_LIS), "", regex=True)
     return df
 
 
-def clean_model_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+@per_brand
+def clean_model_column_tecdoc(df: pd.DataFrame, brand: Optional[str] = None) -> pd.DataFrame:
+    df = utils.copy_input(df)
     df["model"] = (
         df["model"]
         .str.replace("mp2\s\/\smp3", "", regex=True)
@@ -113,23 +245,20 @@ def clean_model_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
         df["model"] = df["model"].str.replace(actros_number, actros_letter, regex=True)
     df = utils.explode_column(df, col="model", delimiter="/")
     df = utils.explode_column(df, col="model", delimiter=",")
-    df = _clean_model_column_tecdoc_man(df)
+    df = apply_brand_rules(df, brand, "model_tecdoc")
     df["model"] = clean_whitespace(df["model"])
     return df
 
 
+@brand_rule("man", "model_tecdoc")
 def _clean_model_column_tecdoc_man(df: pd.DataFrame) -> pd.DataFrame:
-    is_man_record = df["make"] == "man"
-    if is_man_record.sum() > 0:
-        df_man = df[is_man_record]
-        df_rest = df[~is_man_record]
-        df_man["model"] = remove_roman_numeral_from_end(df_man["model"])
-        is_m2000_row = df_man["model"].str.startswith("m 2000")
-        df_man.loc[is_m2000_row, "model"] = "m2000"
-        df = pd.concat([df_rest, df_man])
+    df["model"] = remove_roman_numeral_from_end(df["model"])
+    is_m2000_row = df["model"].str.startswith("m 2000").fillna(False).astype(bool)
+    df.loc[is_m2000_row, "model"] = "m2000"
     return df
 
 
+@utils.per_unique_value
 def remove_axle_config_from_string(series: pd.Series) -> pd.Series:
     return series.str.replace(c.AXLE_CONFIG_REGEX, "", regex=True)
 
@@ -139,16 +268,34 @@ def get_type_without_model_column(df: pd.DataFrame) -> pd.DataFrame:
 
     Both model and type column should be cleaned: lower string, removed axle config, no euro code
     """
-    df = df.copy(deep=True)
-    df["type"] = df.apply(
-        lambda x: x["type"].replace(f"{x['model']} ", ""),
-        axis=1
-    )
+    df = utils.copy_input(df)
+    df["type"] = remove_model_from_type(df["type"], df["model"])
     return df
 
 
-def clean_type_column_lis(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+def remove_model_from_type(type_series: pd.Series, model_series: pd.Series) -> pd.Series:
+    """Removes every occurrence of '{model} ' from type
+
+    There are few distinct (type, model) pairs compared to the number of rows, so we do the replacement once per
+    distinct pair and map the results back, instead of once per row.
+    """
+    df_pairs = pd.DataFrame({"type": type_series.to_numpy(), "model": model_series.to_numpy()})
+    pair_codes = df_pairs.groupby(["type", "model"], sort=False, dropna=False).ngroup().to_numpy()
+    _, ix_first = np.unique(pair_codes, return_index=True)
+    df_unique_pairs = df_pairs.iloc[ix_first]
+    types_without_model = np.array(
+        [
+            t if pd.isna(t) else t.replace(f"{m} ", "")
+            for t, m in zip(df_unique_pairs["type"], df_unique_pairs["model"])
+        ],
+        dtype=object,
+    )
+    return pd.Series(types_without_model[pair_codes], index=type_series.index, name=type_series.name)
+
+
+@per_brand
+def clean_type_column_lis(df: pd.DataFrame, brand: Optional[str] = None) -> pd.DataFrame:
+    df = utils.copy_input(df)
     df = get_type_without_model_column(df)
 
     type_series = df["type"]
@@ -158,14 +305,14 @@ def clean_type_column_lis(df: pd.DataFrame) -> pd.DataFrame:
     type_series = clean_whitespace(type_series)
     df["type"] = type_series.str.replace("\.\./", "", regex=True)
     df = expand_type_column_lis(df)
-    df = _clean_type_column_man(df)
+    df = apply_brand_rules(df, brand, "type_lis")
     df["type"] = strip_all_special_characters(df["type"])
     return df
 
 
 def expand_type_column_lis(df: pd.DataFrame) -> pd.DataFrame:
     """Currently built specifically for Mercedes-Benz and MAN"""
-    df = df.copy()
+    df = utils.copy_input(df)
 
     # Deal with comma separated types
     is_comma_separated = df["type"].str.contains(",")
@@ -174,7 +321,7 @@ def expand_type_column_lis(df: pd.DataFrame) -> pd.DataFrame:
 
     # Deal with slash separated types
     df_rest = df[~is_comma_separated]
-    is_slash_separated = df_rest["type"].str.contains("(\w+\s?/)+")
+    is_slash_separated = df_rest["type"].str.contains(SLASH_SEPARATED_TYPE_REGEX)
     df_slash = df_rest[is_slash_separated].copy(True)
     df_slash = expand_slash_separated_types(df_slash)
 
@@ -186,67 +333,67 @@ def expand_type_column_lis(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def expand_slash_separated_types(df: pd.DataFrame) -> pd.DataFrame:
-    split_type_series = df["type"].str.split("\s+").copy(True)
-    df["base_type"] = split_type_series.apply(lambda x: x[0])
-    df["subtypes"] = split_type_series.apply(_get_subtype)
+    """E.g. "2541 l/ll 6x2" -> "2541 l", "2541 ll": the second word holds the subtypes"""
+    words = _split_slash_separated_types(df["type"])
+    df["base_type"] = words["base_type"]
+    df["subtypes"] = words["subtypes"]
     df = df.explode(column="subtypes")
     df["type"] = df["base_type"] + " " + df["subtypes"]
     return df
 
 
-def _get_subtype(split_type: list) -> list:
-    if len(split_type) > 1:
-        return split_type[1].split("/")
-    else:
-        return [""]
+@utils.per_unique_value
+def _split_slash_separated_types(types: pd.Series) -> pd.DataFrame:
+    """The first word, and the list of subtypes in the second word"""
+    words = types.str.split("\s+", n=2)
+    return pd.DataFrame({
+        "base_type": words.str.get(0),
+        "subtypes": words.str.get(1).fillna("").str.split("/"),
+    })
 
 
 def expand_comma_separated_types(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    base_types_regex = "^\d{4}(?:,\s\d{4})+|^\d{2}.\d{3}(?:,\s\d{2}.\d{3})+"
-    df["base_types"] = (
-        df["type"].copy(deep=True)
-        .str.findall(base_types_regex)  # TODO: works only for mercedes and man
-        .apply(lambda x: x[0] if x else "")
-        .str.split(", ")
-    )
-    df["stripped_type"] = (
-        df["type"].copy(deep=True)
-        .str.replace(base_types_regex, "", regex=True)
-    )
-    df["stripped_type"] = clean_whitespace(df["stripped_type"])
-    df["sub_type"] = (
-        df["stripped_type"]
-        .copy(deep=True)
-        .str.split(" ")
-        .apply(lambda x: x[0])
-        .str.extract("^(\w+)")
-        .fillna("")
-    )
+    df = utils.copy_input(df)
+    parts = _split_comma_separated_types(df["type"])
+    for col in ("base_types", "stripped_type", "sub_type"):
+        df[col] = parts[col]
     df = df.explode(column="base_types")
     df["type"] = df["base_types"] + " " + df["sub_type"]
     return df
 
 
-def _clean_type_column_man(df: pd.DataFrame) -> pd.DataFrame:
-    is_tg_type = (
-        df["model"].str.startswith("tg")
-        & (df["make"] == "man")
+@utils.per_unique_value
+def _split_comma_separated_types(types: pd.Series) -> pd.DataFrame:
+    """The list of base types at the start, the rest of the type, and the subtype (first word of the rest)"""
+    base_types = (
+        types
+        .str.extract(f"({BASE_TYPES_REGEX})", expand=False)  # TODO: works only for mercedes and man
+        .fillna("")
+        .str.split(", ")
     )
+    stripped_types = clean_whitespace(types.str.replace(BASE_TYPES_REGEX, "", regex=True))
+    # The leading word characters of the first word
+    sub_types = stripped_types.str.extract(SUB_TYPE_REGEX, expand=False).fillna("")
+    return pd.DataFrame({"base_types": base_types, "stripped_type": stripped_types, "sub_type": sub_types})
+
+
+@brand_rule("man", "type_lis")
+def _clean_type_column_man(df: pd.DataFrame) -> pd.DataFrame:
+    is_tg_type = df["model"].str.startswith("tg")
     df_tg_ = df[is_tg_type]
     df_rest = df[~is_tg_type]
 
-    has_format = df_tg_["type"].str.contains("\d{2}.\d{3}")
+    has_format = df_tg_["type"].str.contains(MAN_TG_TYPE_REGEX)
     df_format = df_tg_[has_format]
     df_tgs_rest = df_tg_[~has_format]
-    df_format["type"] = df_format["type"].str.extract("(\d{2}.\d{3})").iloc[:, 0]
+    df_format["type"] = df_format["type"].str.extract(f"({MAN_TG_TYPE_REGEX})").iloc[:, 0]
 
     df = pd.concat([df_rest, df_tgs_rest, df_format], axis=0)
     return df
 
 
 def clean_type_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     df["type"] = remove_substrings_with_accolades(df["type"])
     df["type"] = df["type"].str.replace(",", ", ")
     df["type"] = clean_whitespace(df["type"])
@@ -257,7 +404,7 @@ def clean_type_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def expand_type_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     df = get_type_without_model_column(df)
     df = _expand_type_column_format_1(df)
     df = _expand_type_column_format_2(df)
@@ -265,17 +412,16 @@ def expand_type_column_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def _expand_type_column_format_1(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     is_format = df["tecdoc_format"] == 1
     df_1 = df[is_format]
     df_rest = df[~is_format]
 
-    split_type = df_1["type"].copy(deep=True).str.split(" ")
-    df_1["base_type"] = split_type.apply(lambda x: x[0])
-    df_1["base_type"] = strip_all_special_characters(df_1["base_type"])
+    words = _split_format_1_types(df_1["type"])
+    df_1["base_type"] = strip_all_special_characters(words["base_type"])
 
-    df_1["rest"] = split_type.apply(lambda x: " ".join(x[1:]))
-    df_1["sub_types"] = split_type.apply(lambda x: " ".join(x[1:])).str.split(",")
+    df_1["rest"] = words["rest"]
+    df_1["sub_types"] = words["sub_types"]
     df_1 = df_1.explode("sub_types")
     df_1["sub_types"] = clean_whitespace(df_1["sub_types"])
     df_1["type"] = df_1["base_type"] + " " + df_1["sub_types"]
@@ -284,8 +430,16 @@ def _expand_type_column_format_1(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@utils.per_unique_value
+def _split_format_1_types(types: pd.Series) -> pd.DataFrame:
+    """The first word, the other words, and the list of comma separated subtypes in the other words"""
+    words = types.str.split(" ", n=1)
+    other_words = words.str.get(1).fillna("")
+    return pd.DataFrame({"base_type": words.str.get(0), "rest": other_words, "sub_types": other_words.str.split(",")})
+
+
 def _expand_type_column_format_2(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     is_format = df["tecdoc_format"] == 2
     df_2 = df[is_format]
     df_rest = df[~is_format]
@@ -294,38 +448,31 @@ def _expand_type_column_format_2(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def clean_engine_code(df: pd.DataFrame) -> pd.DataFrame:
+@per_brand
+def clean_engine_code(df: pd.DataFrame, brand: Optional[str] = None) -> pd.DataFrame:
     """Cleans the engine code. Assumes the make column has already been cleaned"""
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     df["component_code"] = remove_euro_code(df["component_code"])
     df = utils.explode_column(df, "component_code")
-    df = _clean_mercedes_engine_code(df)
-    df = _clean_man_engine_code(df)
+    df = apply_brand_rules(df, brand, "engine_code")
     df["component_code"] = strip_all_special_characters(df["component_code"])
     return df
 
 
+@brand_rule("mercedes", "engine_code")
 def _clean_mercedes_engine_code(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    is_mercedes_record = df["make"].str.contains("mercedes")
-    df_mercedes = df[is_mercedes_record]
-    df_rest = df[~is_mercedes_record]
-    df_mercedes["component_code"] = extract.extract_mercedes_engine_code(df_mercedes["component_code"])
-    df = pd.concat([df_mercedes, df_rest], axis=0)
+    df["component_code"] = extract.extract_mercedes_engine_code(df["component_code"])
     return df
 
 
 # TODO: deal with component codes separated by / for MAN
+@brand_rule("man", "engine_code")
 def _clean_man_engine_code(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    is_man_record = df["make"] == "man"
-    df_man = df[is_man_record]
-    df_rest = df[~is_man_record]
-    df_man["component_code"] = extract.extract_man_engine_code(df_man["component_code"])
-    df = pd.concat([df_man, df_rest], axis=0)
+    df["component_code"] = extract.extract_man_engine_code(df["component_code"])
     return df
 
 
+@utils.per_unique_value
 def remove_roman_numeral_from_end(series: pd.Series) -> pd.Series:
     """See title. Only works for """
     roman_regex_group = "|".join(ROMAN_NUMERALS.keys())
@@ -333,51 +480,89 @@ def remove_roman_numeral_from_end(series: pd.Series) -> pd.Series:
     return series.str.replace(pattern, "", regex=True)
 
 
-def clean_string_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    for col in c.STR_COLS:
+def clean_string_columns(df: pd.DataFrame, columns: List[str] = c.STR_COLS) -> pd.DataFrame:
+    df = utils.copy_input(df)
+    for col in columns:
         try:
-            df[col] = (
-                df[col]
-                .astype("string")
-                .str.lower()
-            )
-            df[col] = clean_whitespace(df[col])
+            df[col] = _lower_and_clean_whitespace(df[col].astype("string"))
         except KeyError:
             logging.warning(f"Could not find {col} in dataframe, skipping that column")
     return df
 
 
-def clean_lis(df: pd.DataFrame) -> pd.DataFrame:
+@utils.per_unique_value
+def _lower_and_clean_whitespace(series: pd.Series) -> pd.Series:
+    return clean_whitespace(series.str.lower())
+
+
+def clean_lis(df: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """Cleans the LIS records. With workers > 1 the makes are cleaned in a pool of that many processes
+
+    The axle configurations (lists, see extract.extract_and_append_relevant_data_lis) and the engine codes are
+    cleaned as narrow variant tables, and only joined into the cleaned model and type variants at the end.
+    """
     logging.info("Cleaning LIS data such that it becomes compatible with TecDoc data...")
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
+    columns = list(df.columns)
+    labels = df.index
+    df = df.set_axis(pd.RangeIndex(len(df)), axis=0)
+
+    axle_configs = _lower_and_clean_whitespace(df.pop("axle_configuration").explode().astype("string"))
     df["category"] = clean_category_column_lis(df["category"])
-    df = clean_string_columns(df)
+    df = clean_string_columns(df, columns=[col for col in c.STR_COLS if col != "axle_configuration"])
     df["make"] = clean_make_column(df["make"])
-    df = clean_model_column_lis(df)
-    df = clean_type_column_lis(df)
-    df = clean_engine_code(df)
+    engine_codes = clean_per_make(df[["make", "component_code"]], clean_engine_code, workers)["component_code"]
+    df = clean_per_make(df.drop(columns="component_code"), _clean_brand_partition_lis, workers)
+    df = utils.join_variants(df, {"component_code": engine_codes, "axle_configuration": axle_configs}, "LIS")
+
+    utils.log_unique_value_stats()
     logging.info("LIS data cleaned successfully.")
+    columns += [col for col in df.columns if col not in columns]
+    return df[columns].set_axis(labels[df.index], axis=0)
+
+
+def _clean_brand_partition_lis(df: pd.DataFrame, brand: str) -> pd.DataFrame:
+    df = clean_model_column_lis(df, brand)
+    df = clean_type_column_lis(df, brand)
+    return df
+
+
+def _clean_brand_partition_tecdoc(df: pd.DataFrame, brand: str) -> pd.DataFrame:
+    df = clean_model_column_tecdoc(df, brand)
+    df = clean_type_column_tecdoc(df)
     return df
 
 
-def clean_tecdoc(df: pd.DataFrame) -> pd.DataFrame:
+def clean_tecdoc(df: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """Cleans the TecDoc records. With workers > 1 the makes are cleaned in a pool of that many processes
+
+    The engine codes are cleaned as a narrow variant table, and only joined into the cleaned model and type
+    variants at the end.
+    """
     logging.info("Cleaning TecDoc data such that it becomes compatible with LIS data...")
     df = convert_time_cols_tecdoc(df=df)
+    columns = list(df.columns)
+    labels = df.index
+    df = df.set_axis(pd.RangeIndex(len(df)), axis=0)
+
     df["category"] = clean_category_column_tecdoc(df["category"])
     df = clean_string_columns(df)
     df["make"] = clean_make_column(df["make"])
-    df = clean_model_column_tecdoc(df)
-    df = clean_type_column_tecdoc(df)
-    df = clean_engine_code(df)
+    engine_codes = clean_per_make(df[["make", "component_code"]], clean_engine_code, workers)["component_code"]
+    df = clean_per_make(df.drop(columns="component_code"), _clean_brand_partition_tecdoc, workers)
+    df = utils.join_variants(df, {"component_code": engine_codes}, "TecDoc")
+
+    utils.log_unique_value_stats()
     logging.info("TecDoc data cleaned successfully.")
-    return df
+    columns += [col for col in df.columns if col not in columns]
+    return df[columns].set_axis(labels[df.index], axis=0)
 
 
+@utils.per_unique_value
 def strip_all_special_characters(series: pd.Series) -> pd.Series:
     return (
         series
-        .str.replace(r"[^\w\s]+", "", regex=True)
+        .str.replace(SPECIAL_CHARACTERS_REGEX, "", regex=True)
         .str.replace("\s+", "", regex=True)
     )
     # return (
@@ -1,8 +1,18 @@
 import logging
+import sys
+
 import click
-from oly_matching.main import main
+from oly_matching import constants as c
 from oly_matching.pretty_logging import configure_logger
 
+# Shared by every command that matches
+year_tolerance_option = click.option(
+    "--year-tolerance",
+    default=c.YEAR_TOLERANCE,
+    type=click.IntRange(min=0),
+    help="A match's model years may be at most this many years apart"
+)
+
 
 @click.group()
 @click.version_option()
@@ -13,20 +23,312 @@ def cli() -> None:
 @cli.command()
 @click.option("--lis-path", default="./data/raw/lis.xlsx")
 @click.option("--tecdoc-path", default="./data/raw/tecdoc.xlsx")
+@click.option(
+    "--tecdoc-reference",
+    default=None,
+    help="Folder with a TecDoc reference built by 'olyslager build-reference'. If given, --tecdoc-path is ignored"
+)
+@click.option(
+    "--input-format",
+    default="auto",
+    type=click.Choice(c.INPUT_FORMATS),
+    help="Format of the LIS and TecDoc files. auto: detect from the file extension"
+)
 @click.option("--output-folder", default="./data/output")
-@click.option("--matching-method", default="exact", help="Choose from: exact, cut_strings, fuzzy")
-def match(lis_path: str, tecdoc_path: str, output_folder: str, matching_method: str) -> None:
+@click.option(
+    "--output-format",
+    default="xlsx",
+    type=click.Choice(c.OUTPUT_FORMATS),
+    help="Format of the result tables. Metrics are saved as json if not xlsx"
+)
+@click.option("--single-workbook", is_flag=True, help="Save all results as sheets of a single results.xlsx")
+@click.option("--matching-method", default="exact", help="Choose from: exact, cut_strings, fuzzy, fuzzy_ngram, cascade")
+@click.option(
+    "--ngram-top-k",
+    default=c.NGRAM_TOP_K,
+    type=click.IntRange(min=1),
+    help="fuzzy_ngram: keep at most this many of the most similar TecDoc records per LIS record"
+)
+@click.option(
+    "--ngram-threshold",
+    default=c.NGRAM_THRESHOLD,
+    type=click.FloatRange(min=0, max=1),
+    help="fuzzy_ngram: keep only TecDoc records with at least this cosine similarity"
+)
+@year_tolerance_option
+@click.option("--cache-folder", default="./data/cache", help="Where to cache the parsed excel files")
+@click.option(
+    "--cache-mode",
+    default="use",
+    type=click.Choice(c.CACHE_MODES),
+    help="use: read parsed files from cache if available, refresh: rebuild the cache, off: bypass the cache"
+)
+@click.option(
+    "--lis-chunksize",
+    default=None,
+    type=int,
+    help="Stream LIS in chunks of this many rows, keeping only engine records (lowers peak memory)"
+)
+@click.option(
+    "--copy-free",
+    is_flag=True,
+    help="Let the pipeline stages modify their input instead of copying it (lowers peak memory)"
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help=(
+        "Clean the records (partitioned by make) and fuzzy match the blocks of make and category in a pool of this "
+        "many processes. Does not change the results"
+    )
+)
+@click.option(
+    "--state-folder",
+    default=None,
+    help="Save the clean records, their hashes and the links of this run here, for a later --incremental run"
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help=(
+        "Only clean and match the LIS types and N-types that changed since the run saved in --state-folder "
+        "(exact and cut_strings only). Gives the same results as a full run, without the fan-out report"
+    )
+)
+def match(
+    lis_path: str,
+    tecdoc_path: str,
+    tecdoc_reference: str,
+    input_format: str,
+    output_folder: str,
+    output_format: str,
+    single_workbook: bool,
+    matching_method: str,
+    ngram_top_k: int,
+    ngram_threshold: float,
+    year_tolerance: int,
+    cache_folder: str,
+    cache_mode: str,
+    lis_chunksize: int,
+    copy_free: bool,
+    workers: int,
+    state_folder: str,
+    incremental: bool,
+) -> None:
     """Entrypoint for the matching process
 
-    Creates 4 files:
+    Creates 5 files (xlsx by default, see --output-format and --single-workbook):
     - matches_per_lis_id.xlsx: for each LIS type ID, state which N-types correspond to it (together with extra info)
     - links_with_original_data.xlsx: for every link between LIS and TecDoc, state what was the
                                      original information in LIS and TecDoc (used to validate matches by hand)
     - metrics: overall overview of matching performance
     - results_per_model.xlsx: overview of performance per model (useful for identifying algorithm improvements)
+    - fan_out.xlsx: how many records every variant table (engine codes, axle configurations) added while cleaning
+    """
+    # Imported here, so that pandas and the pipeline are only loaded when a command actually runs
+    from oly_matching.main import main
+
+    configure_logger(logging.INFO)
+    main(
+        lis_path=lis_path,
+        tecdoc_path=tecdoc_path,
+        output_folder=output_folder,
+        matching_method=matching_method,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        lis_chunksize=lis_chunksize,
+        input_format=input_format,
+        output_format=output_format,
+        single_workbook=single_workbook,
+        tecdoc_reference=tecdoc_reference,
+        copy_free=copy_free,
+        workers=workers,
+        ngram_top_k=ngram_top_k,
+        ngram_threshold=ngram_threshold,
+        year_tolerance=year_tolerance,
+        state_folder=state_folder,
+        incremental=incremental,
+    )
+
+
+@cli.command()
+@click.option("--tecdoc-path", default="./data/raw/tecdoc.xlsx")
+@click.option(
+    "--input-format",
+    default="auto",
+    type=click.Choice(c.INPUT_FORMATS),
+    help="Format of the TecDoc file. auto: detect from the file extension"
+)
+@click.option("--reference-folder", default="./data/reference", help="Where to save the TecDoc reference")
+@click.option("--cache-folder", default="./data/cache", help="Where to cache the parsed excel file")
+@click.option(
+    "--cache-mode",
+    default="use",
+    type=click.Choice(c.CACHE_MODES),
+    help="use: read parsed files from cache if available, refresh: rebuild the cache, off: bypass the cache"
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Clean the records in a pool of this many processes, partitioned by make. Does not change the results"
+)
+def build_reference(
+    tecdoc_path: str,
+    input_format: str,
+    reference_folder: str,
+    cache_folder: str,
+    cache_mode: str,
+    workers: int,
+) -> None:
+    """Cleans TecDoc once and saves it as a reference
+
+    Pass the reference folder to 'olyslager match --tecdoc-reference' to skip loading and cleaning TecDoc.
+    """
+    from oly_matching.main import build_reference as _build_reference
+
+    configure_logger(logging.INFO)
+    _build_reference(
+        tecdoc_path=tecdoc_path,
+        reference_folder=reference_folder,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        input_format=input_format,
+        workers=workers,
+    )
+
+
+@cli.command()
+@click.option(
+    "--tecdoc-reference",
+    default="./data/reference",
+    help="Folder of the TecDoc reference. Built from --tecdoc-path first if it does not exist"
+)
+@click.option("--tecdoc-path", default="./data/raw/tecdoc.xlsx")
+@click.option(
+    "--input-format",
+    default="auto",
+    type=click.Choice(c.INPUT_FORMATS),
+    help="Format of the TecDoc and --warm-lis-path files. auto: detect from the file extension"
+)
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", default=8000, type=int, help="Port to listen on")
+@click.option("--matching-method", default="exact", type=click.Choice(c.RECORD_MATCHING_METHODS))
+@year_tolerance_option
+@click.option(
+    "--cache-size",
+    default=10000,
+    type=click.IntRange(min=0),
+    help="Number of distinct LIS records whose N-types are kept in memory"
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Clean TecDoc in a pool of this many processes, if the reference has to be built"
+)
+@click.option(
+    "--warm-lis-path",
+    default=None,
+    help="LIS file whose records are matched at startup, so that their lookups are answered from the cache"
+)
+def serve(
+    tecdoc_reference: str,
+    tecdoc_path: str,
+    input_format: str,
+    host: str,
+    port: int,
+    matching_method: str,
+    year_tolerance: int,
+    cache_size: int,
+    workers: int,
+    warm_lis_path: str,
+) -> None:
+    """Serves lookups of raw LIS records over HTTP
+
+    Loads the TecDoc reference and its index once. POST a raw LIS record (json object with the LIS columns) to
+    /lookup to get its N-types, or a list of records to look up a batch.
     """
+    from oly_matching.serve import serve as _serve
+
     configure_logger(logging.INFO)
-    main(lis_path, tecdoc_path, output_folder, matching_method)
+    _serve(
+        reference_folder=tecdoc_reference,
+        tecdoc_path=tecdoc_path,
+        host=host,
+        port=port,
+        how=matching_method,
+        year_tolerance=year_tolerance,
+        cache_size=cache_size,
+        input_format=input_format,
+        workers=workers,
+        warm_lis_path=warm_lis_path,
+    )
+
+
+@cli.command()
+@click.option(
+    "--tecdoc-reference",
+    default="./data/reference",
+    help="Folder of the TecDoc reference. Built from --tecdoc-path first if it does not exist"
+)
+@click.option("--tecdoc-path", default="./data/raw/tecdoc.xlsx")
+@click.option(
+    "--input-format",
+    default="auto",
+    type=click.Choice(c.INPUT_FORMATS),
+    help="Format of the TecDoc file. auto: detect from the file extension"
+)
+@click.option("--matching-method", default="exact", type=click.Choice(c.RECORD_MATCHING_METHODS))
+@year_tolerance_option
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="Number of records that are matched at once. Smaller batches give the first links sooner"
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Clean TecDoc in a pool of this many processes, if the reference has to be built"
+)
+def lookup(
+    tecdoc_reference: str,
+    tecdoc_path: str,
+    input_format: str,
+    matching_method: str,
+    year_tolerance: int,
+    batch_size: int,
+    workers: int,
+) -> None:
+    """Matches raw LIS records from stdin and writes the links to stdout, as json lines
+
+    Every input line is a json object with the LIS columns, every output line a link {"type_id": ..., "n_type": ...}.
+    The records are matched in batches, so the input can be a stream of any size. Logs go to stderr.
+    """
+    # Before anything configures the logger: stdout is for the links
+    configure_logger(logging.INFO, stream=sys.stderr)
+    from oly_matching.lookup import lookup_stream
+    from oly_matching.main import load_or_build_reference
+
+    df_tecdoc, tecdoc_index = load_or_build_reference(
+        tecdoc_reference,
+        tecdoc_path,
+        cache_folder=None,
+        input_format=input_format,
+        workers=workers,
+    )
+    lookup_stream(
+        sys.stdin,
+        sys.stdout,
+        df_tecdoc,
+        tecdoc_index=tecdoc_index,
+        how=matching_method,
+        year_tolerance=year_tolerance,
+        batch_size=batch_size,
+    )
 
 
 if __name__ == "__main__":
@@ -41,6 +41,42 @@ LIS_COLUMNS += ["type_id"]
 TECDOC_COLUMNS = list(MATCHING_COLUMN_MAPPING.keys())
 TECDOC_COLUMNS += ["N-Type No."]
 
+# Loading and saving
+INPUT_FORMATS = ("auto", "xlsx", "csv", "parquet", "sqlite")
+OUTPUT_FORMATS = ("xlsx", "csv", "parquet")
+CACHE_MODES = ("use", "refresh", "off")
+# The matching methods that 'olyslager serve' and 'olyslager lookup' support for raw LIS records
+RECORD_MATCHING_METHODS = ("exact", "cut_strings")
+
+# Loading: only these columns are read from the raw files, with these dtypes
+LIS_LOAD_COLUMNS = LIS_COLUMNS + ["component_group"]  # component_group is needed to keep the engine records
+TECDOC_LOAD_COLUMNS = TECDOC_COLUMNS
+TECDOC_DATE_COLUMNS = ["Model Year from", "Model Year to"]
+LIS_SQLITE_TABLE = "lis"
+TECDOC_SQLITE_TABLE = "tecdoc"
+
+LIS_DTYPES = {
+    "make": "category",
+    "category": "category",
+    "component_group": "category",
+    "model": str,
+    "type": str,
+    "component_code": str,
+    "model_year_start": "Int16",
+    "model_year_end": "Int16",
+}
+# A raw LIS record that is matched on its own (see load.check_lis_record) needs these, the cleaning splits them
+LIS_REQUIRED_FIELDS = ["model", "type"]
+TECDOC_DTYPES = {
+    "Manufacturer": "category",
+    "LnkTargetType": "category",
+    "Model Series": str,
+    "Type": str,
+    "Engine Codes": str,
+    "Axle Configuration": str,
+    "N-Type No.": "int32",
+}
+
 # Cleaning
 STR_COLS = ['make', 'model', 'type', 'category', 'component_code', 'axle_configuration']
 
@@ -61,6 +97,8 @@ ALLOWED_COUNTRY_CODES = ["usa / can", "eu", "usa", "bra", "itl", "mb", "rk"]
 VEHICLE_TYPES_LIS = ["construction", "tractor", "chassis"]  # for cleaning model column, could be other columns too
 
 # Matching
+# A match's model years may be at most this many years apart
+YEAR_TOLERANCE = 2
 REQUIRED_MATCHING_COLS = ["make", "model", "type", "component_code"]
 MATCHING_OUTPUT_COLUMNS = [
     'type_id',
@@ -80,4 +118,8 @@ MATCHING_OUTPUT_COLUMNS = [
     'model_year_start_tecdoc',
     'model_year_end_lis',
     'model_year_end_tecdoc',
-]
\ No newline at end of file
+]
+
+# fuzzy_ngram keeps the NGRAM_TOP_K most similar TecDoc records per LIS record, with at least NGRAM_THRESHOLD
+NGRAM_TOP_K = 5
+NGRAM_THRESHOLD = 0.5
@@ -1,84 +1,182 @@
-from typing import Union
 import logging
+import re
+from typing import Callable, Dict, List, Pattern, Tuple, Union
+
+import numpy as np
 import pandas as pd
 from oly_matching import constants as c
+from oly_matching import utils
 
+# A match of a named group: (start, end, matched text)
+Match = Tuple[int, int, str]
 
-def append_axle_configs_lis(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    n_records = len(df)
-    logging.info(f"# records in LIS before appending axle config: {len(df)}")
-    df["axle_configuration"] = df["type"].str.findall(c.AXLE_CONFIG_REGEX)
-    df = df.explode(column="axle_configuration")
-    df["axle_configuration_model_lis"] = df["model"].str.extract(c.AXLE_CONFIG_REGEX)
-    logging.info(f"Added {len(df) - n_records} records, now LIS has {len(df)} records")
-    return df
 
+def _lookahead(name: str, regex: str) -> str:
+    """Optional lookahead group, so that one scan finds the matches of every group starting at every position"""
+    return f"(?=(?P<{name}>{regex})?)"
 
-def extract_country_from_make_lis(make_series: pd.Series) -> pd.Series:
-    """Returns if the make element contains a country from ALLOWED_COUNTRY_CODES
 
-    To see how we came up with this list, run:
-    >> between_brackets = make_series.str.findall("\((.*?)\)").explode()
-    >> between_brackets.value_counts()
-    You'll see the country codes there
-    """
-    return make_series.apply(lambda x: find_country(x))
+COUNTRY_REGEX = "|".join(re.escape(x) for x in c.ALLOWED_COUNTRY_CODES)
+VEHICLE_TYPE_REGEX = "|".join(re.escape(x) for x in c.VEHICLE_TYPES_LIS)
+MERCEDES_ENGINE_CODE_REGEX = "([\d|x|X]{3}\.[\d|x|X]{3})"
+MAN_ENGINE_CODE_REGEX = "(d\s?\d{4}\s?[a-z]+\s?\d+)"
 
 
-def find_country(x: str) -> Union[str, None]:
-    for country in c.ALLOWED_COUNTRY_CODES:
-        if country in x:
-            return country
-    return None
+def find_all(matches: List[Match]) -> List[str]:
+    """Same as re.findall: non-overlapping matches from left to right"""
+    found = []
+    end_previous = 0
+    for start, end, text in matches:
+        if start >= end_previous:
+            found.append(text)
+            end_previous = end
+    return found
+
 
+def find_first(matches: List[Match]) -> Union[str, None]:
+    """Same as re.search: the leftmost match"""
+    return matches[0][2] if matches else None
 
-def extract_euro_code(series: pd.Series) -> pd.Series:
-    euro_series = series.str.findall(c.EURO_CODE_REGEX)
-    is_null = euro_series.isnull()
-    euro_series[is_null] = euro_series[is_null].apply(lambda x: [])
-    euro_series = euro_series.apply(lambda x: None if not x else x[0])
-    return euro_series
 
+def find_country(matches: List[Match]) -> Union[str, None]:
+    """The first country of ALLOWED_COUNTRY_CODES that occurs anywhere in the string
+
+    The alternation in COUNTRY_REGEX prefers the first listed country at every position, so the best ranked
+    country in the string is always among the matches (also if it overlaps with another country).
+    """
+    countries = {text for _, _, text in matches}
+    for country in c.ALLOWED_COUNTRY_CODES:
+        if country in countries:
+            return country
+    return None
 
-def extract_vehicle_type_lis(model_series: pd.Series) -> pd.Series:
-    """Extracts the type of the vehicle (see constants VEHICLE_TYPES_LIS)
 
-    For model column, assumes lowercase"""
-    vehicle_type_list = []
-    for vehicle_type in c.VEHICLE_TYPES_LIS:
-        bool_series = model_series.str.contains(vehicle_type)
-        string_series = bool_series.replace({True: vehicle_type, False: ""})
-        vehicle_type_list.append(string_series)
-    df_vehicle_types = pd.concat(vehicle_type_list, axis=1)
-    vehicle_type_series = df_vehicle_types.apply(lambda x: ''.join(x), axis=1)
-    return vehicle_type_series
+def find_vehicle_types(matches: List[Match]) -> str:
+    """All VEHICLE_TYPES_LIS that occur in the string, concatenated in the order of VEHICLE_TYPES_LIS"""
+    vehicle_types = {text for _, _, text in matches}
+    return "".join(x for x in c.VEHICLE_TYPES_LIS if x in vehicle_types)
+
+
+# For every LIS column: one combined pattern, and per output column the group to use, how to select from its
+# matches, and the value for missing input
+EXTRACTIONS_LIS = {
+    "type": (
+        _lookahead("axle", c.AXLE_CONFIG_REGEX),
+        {"axle_configuration": ("axle", find_all, float("nan"))},
+    ),
+    "model": (
+        _lookahead("axle", c.AXLE_CONFIG_REGEX) + _lookahead("euro", c.EURO_CODE_REGEX)
+        + _lookahead("vehicle_type", VEHICLE_TYPE_REGEX),
+        {
+            "axle_configuration_model_lis": ("axle", find_first, float("nan")),
+            "euro_model_lis": ("euro", find_first, None),
+            "vehicle_type_lis": ("vehicle_type", find_vehicle_types, float("nan")),
+        },
+    ),
+    "component_code": (
+        _lookahead("euro", c.EURO_CODE_REGEX),
+        {"euro_component_code_lis": ("euro", find_first, None)},
+    ),
+    "make": (
+        _lookahead("country", COUNTRY_REGEX),
+        {"country_make_lis": ("country", find_country, None)},
+    ),
+    "category": (
+        _lookahead("country", COUNTRY_REGEX),
+        {"country_category_lis": ("country", find_country, None)},
+    ),
+}
+OUTPUT_COLUMNS_LIS = [
+    "axle_configuration",
+    "axle_configuration_model_lis",
+    "euro_model_lis",
+    "euro_component_code_lis",
+    "country_make_lis",
+    "country_category_lis",
+    "vehicle_type_lis",
+]
+
+
+def compile_combined_pattern(regex: str) -> Pattern:
+    """Compiles a concatenation of _lookahead groups, which only matches at positions where any group matches
+
+    Without the check, the pattern would match (empty) at every position of the string.
+    """
+    pattern = re.compile(regex)
+    any_group_matched = "(?!)"
+    for name in reversed(list(pattern.groupindex)):
+        any_group_matched = f"(?({name})|{any_group_matched})"
+    return re.compile(regex + any_group_matched)
+
+
+def scan(value: str, pattern: Pattern) -> Dict[str, List[Match]]:
+    """Scans the value once, returns the matches of every named group of the pattern, ordered by start"""
+    matches = {name: [] for name in pattern.groupindex}
+    for match in pattern.finditer(value):
+        for name in pattern.groupindex:
+            text = match.group(name)
+            if text is not None:
+                matches[name].append((match.start(name), match.end(name), text))
+    return matches
+
+
+def extract_from_column(
+    series: pd.Series,
+    regex: str,
+    outputs: Dict[str, Tuple[str, Callable[[List[Match]], object], object]],
+) -> pd.DataFrame:
+    """Scans every distinct value of the series once, and maps the extracted values back to all rows
+
+    Args:
+        series: column to extract from
+        regex: combined pattern of named groups
+        outputs: output column -> (group name, function selecting the output from the matches, value if missing)
+    """
+    pattern = compile_combined_pattern(regex)
+    codes, uniques = pd.factorize(series)
+    extracted = {col: [] for col in outputs}
+    for value in uniques:
+        # Like the pandas string methods, we treat values that are not strings as missing
+        if not isinstance(value, str):
+            for col, (_, _, missing_value) in outputs.items():
+                extracted[col].append(missing_value)
+            continue
+        matches = scan(value, pattern)
+        for col, (group, select, _) in outputs.items():
+            extracted[col].append(select(matches[group]))
+
+    # Missing values get code -1, which takes the value appended at the end
+    df_extracted = pd.DataFrame(index=series.index)
+    for col, (_, _, missing_value) in outputs.items():
+        values = pd.Series(extracted[col] + [missing_value], dtype=object)
+        df_extracted[col] = values.take(codes).to_numpy()
+    return df_extracted
 
 
 def extract_and_append_relevant_data_lis(df: pd.DataFrame) -> pd.DataFrame:
-    # Extract LIS information from columns that is needed for the merge, but don't modify the columns yet
+    """Extracts LIS information that is needed for the merge (or nice to have), but doesn't modify the columns yet
+
+    Every column is scanned once per distinct value with a combined pattern (see EXTRACTIONS_LIS). The
+    axle_configuration column holds the list of axle configurations found in the type, clean.clean_lis turns it
+    into a variant table.
+    """
     logging.info("Extracting and appending data to LIS...")
-    df = df.copy(deep=True)
-    df = append_axle_configs_lis(df)
-
-    # Extract extra information from LIS, not necessarily needed for merge but nice to have
-    for col in ("model", "component_code"):  # "type" for other brands than Mercedes
-        df[f"euro_{col}_lis"] = extract_euro_code(df[col])
-    for col in ("make", "category"):
-        df[f"country_{col}_lis"] = extract_country_from_make_lis(df[col])
-    df["vehicle_type_lis"] = extract_vehicle_type_lis(df["model"])
+    df = utils.copy_input(df)
+    extracted = [extract_from_column(df[col], regex, outputs) for col, (regex, outputs) in EXTRACTIONS_LIS.items()]
+    df_extracted = pd.concat(extracted, axis=1)
+    df = pd.concat([df, df_extracted[OUTPUT_COLUMNS_LIS]], axis=1)
     logging.info("Extraction of LIS data completed successfully.")
     return df
 
 
 def extract_mercedes_engine_code(series: pd.Series) -> pd.Series:
-    df_engine_codes = series.str.extract("([\d|x|X]{3}\.[\d|x|X]{3})")
+    df_engine_codes = series.str.extract(MERCEDES_ENGINE_CODE_REGEX)
     engine_series = df_engine_codes.iloc[:, 0].astype("string")
     return engine_series
 
 
 def extract_man_engine_code(series: pd.Series) -> pd.Series:
-    df_engine_codes = series.str.extract("(d\s?\d{4}\s?[a-z]+\s?\d+)")
+    df_engine_codes = series.str.extract(MAN_ENGINE_CODE_REGEX)
     engine_series = df_engine_codes.iloc[:, 0].astype("string")
     return engine_series
 
@@ -90,22 +188,13 @@ def get_type_format_tecdoc(df: pd.DataFrame) -> pd.Series:
         2) types are split as a whole by comma's,
             e.g "19.293 fk,29.239 flk" or "24.350, 24.360"
     """
-    is_multiple_types = df["type"].str.contains(",")
-    split_type = df["type"].str.split(" ")
-    first_words = split_type.apply(lambda x: x[0])
-    other_words = split_type.apply(lambda x: " ".join(x[1:]))
-    other_words_no_digits = ~other_words.str.contains("[0-9]+")
-    df_words = pd.concat([df["type"], is_multiple_types, first_words, other_words, other_words_no_digits], axis=1)
-    df_words.columns = ["type", "is_multiple_types", "first_word", "other_words", "other_words_no_digits"]
-
-    format_series = pd.Series(index=df_words.index, name="tecdoc_format", dtype=int)
-    format_series[~df_words["is_multiple_types"]] = 0
-    format_series[
-        df_words["is_multiple_types"]
-        & df_words["other_words_no_digits"]
-    ] = 1
-    format_series[
-        df_words["is_multiple_types"]
-        & ~df_words["other_words_no_digits"]
-    ] = 2
-    return format_series
+    return _get_type_format(df["type"]).rename("tecdoc_format")
+
+
+@utils.per_unique_value
+def _get_type_format(types: pd.Series) -> pd.Series:
+    is_multiple_types = types.str.contains(",").fillna(False).astype(bool)
+    other_words = types.str.split(" ", n=1).str.get(1)
+    other_words_have_digits = other_words.str.contains("[0-9]+").fillna(False).astype(bool)
+    format_codes = np.select([~is_multiple_types, ~other_words_have_digits], [0, 1], default=2)
+    return pd.Series(format_codes, index=types.index, dtype=float)
@@ -0,0 +1,394 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# The exact merge keys: the engine code is looked up within the group of the other keys
+GROUP_COLUMNS = ["make", "model", "type", "category"]
+CODE_COLUMN = "component_code"
+# The columns of the predicates that a match must pass, see TecDocIndex.probe
+YEAR_COLUMN = "model_year_start"
+AXLE_COLUMN = "axle_configuration"
+
+KEY_VALUES_FILE_NAME = "key_values.json"
+ARRAY_NAMES = ["group_ids", "code_ids", "group_keys", "sorted_keys", "sorted_rows", "axle_ids", "years"]
+
+# Combined codes are compressed before they would overflow int64
+MAX_COMBINED_SIZE = 2 ** 62
+
+
+class TecDocIndex:
+    """Index of the TecDoc records on the exact merge keys, for vectorized lookups of LIS records
+
+    Every key column is dictionary encoded (missing values have their own code, so they match each other like in
+    pd.merge). The codes of make, model, type and category are combined into a group id, and the group id and the
+    engine code into a single int64 key. The keys are sorted, so a batch of LIS records is looked up with two
+    binary searches. LIS engine codes ending with n 'x' wildcards are looked up in a prefix index on the engine
+    codes without their last n characters, built on first use. The axle configuration and model year of every
+    record are kept too, so that a probe can skip the records that fail the year and axle predicates.
+
+    Build it with TecDocIndex.build, save it with save and memory-map it in a later run with TecDocIndex.load.
+    The index refers to the TecDoc records by position, so it only fits the frame it was built from.
+    """
+
+    def __init__(self, key_values: Dict[str, pd.Index], arrays: Dict[str, np.ndarray], group_stages: List[np.ndarray]):
+        self.key_values = key_values
+        self.arrays = arrays
+        self.group_stages = group_stages
+        self._prefix_indexes = {}
+        self._predicate_indexes = {}
+        self._year_codes = None
+
+    @classmethod
+    def build(cls, df_tecdoc: pd.DataFrame) -> "TecDocIndex":
+        key_values = {}
+        codes = []
+        for col in GROUP_COLUMNS + [CODE_COLUMN]:
+            col_codes, values = pd.factorize(df_tecdoc[col])
+            key_values[col] = pd.Index(np.asarray(values, dtype=object), dtype=object)
+            codes.append(_with_missing_code(col_codes, key_values[col]))
+
+        group_combined, group_stages = _combine_codes(codes[:-1], [len(key_values[col]) + 1 for col in GROUP_COLUMNS])
+        group_keys = np.unique(group_combined)
+        group_ids = np.searchsorted(group_keys, group_combined)
+        code_ids = codes[-1]
+        sorted_keys, sorted_rows = _sort_keys(group_ids * (len(key_values[CODE_COLUMN]) + 1) + code_ids)
+        axle_ids, axle_values = pd.factorize(df_tecdoc[AXLE_COLUMN])
+        key_values[AXLE_COLUMN] = pd.Index(np.asarray(axle_values, dtype=object), dtype=object)
+        arrays = {
+            "group_ids": group_ids,
+            "code_ids": code_ids,
+            "group_keys": group_keys,
+            "sorted_keys": sorted_keys,
+            "sorted_rows": sorted_rows,
+            "axle_ids": _with_missing_code(axle_ids, key_values[AXLE_COLUMN]),
+            "years": pd.to_numeric(df_tecdoc[YEAR_COLUMN]).to_numpy(dtype=float, na_value=np.nan),
+        }
+        logging.info(f"Built TecDoc index with {len(df_tecdoc)} records in {len(group_keys)} groups")
+        return cls(key_values, arrays, group_stages)
+
+    def save(self, folder: str) -> None:
+        """Saves the distinct key values as json and every array as npy file, so that load can memory-map them"""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(folder / f"{name}.npy", array)
+        for i, stage in enumerate(self.group_stages):
+            np.save(folder / f"group_stage_{i}.npy", stage)
+        key_values = {col: values.tolist() for col, values in self.key_values.items()}
+        with open(folder / KEY_VALUES_FILE_NAME, "w") as f:
+            json.dump({"key_values": key_values, "n_group_stages": len(self.group_stages)}, f)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> "TecDocIndex":
+        """Loads an index saved with save. The arrays are memory-mapped (read-only) if mmap"""
+        folder = Path(folder)
+        mmap_mode = "r" if mmap else None
+        with open(folder / KEY_VALUES_FILE_NAME) as f:
+            content = json.load(f)
+        key_values = {col: pd.Index(values, dtype=object) for col, values in content["key_values"].items()}
+        arrays = {name: np.load(folder / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        group_stages = [
+            np.load(folder / f"group_stage_{i}.npy", mmap_mode=mmap_mode) for i in range(content["n_group_stages"])
+        ]
+        return cls(key_values, arrays, group_stages)
+
+    def probe(self, df_lis: pd.DataFrame, year_tolerance: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Looks up every LIS record, like a left join on the exact merge keys
+
+        Returns the LIS positions and the matching TecDoc positions (-1 if a LIS record has no match), one pair per
+        link. The LIS records without wildcards come first, then the others by their number of wildcards. A LIS
+        record's matches are in TecDoc order.
+
+        If year_tolerance is given, only the pairs that would pass match.keep_valid_matches are returned: the model
+        years are at most year_tolerance apart (or one is missing) and the axle configurations are equal (or the LIS
+        one is missing). The other pairs are never generated: the records of every key are also sorted by axle
+        configuration and model year, so that the valid ones are found with binary searches.
+        """
+        codes = [self._encode(df_lis[col], col) for col in GROUP_COLUMNS]
+        sizes = [len(self.key_values[col]) + 1 for col in GROUP_COLUMNS]
+        group_combined, _ = _combine_codes(codes, sizes, self.group_stages)
+        group_ids = _rank(group_combined, self.arrays["group_keys"])
+        if year_tolerance is not None:
+            axle_ids = self._encode(df_lis[AXLE_COLUMN], AXLE_COLUMN)
+            years = pd.to_numeric(df_lis[YEAR_COLUMN]).to_numpy(dtype=float, na_value=np.nan)
+
+        # The engine codes are handled per distinct value, the same values get the same number of wildcards
+        value_ids, engine_codes = pd.factorize(df_lis[CODE_COLUMN])
+        engine_codes = pd.Series(np.asarray(engine_codes, dtype=object), dtype=object)
+        value_ids = _with_missing_code(value_ids, engine_codes)
+        value_n_wildcards = count_wildcards(engine_codes).to_numpy()
+        n_wildcards = np.append(value_n_wildcards, 0)[value_ids]
+        lis_rows = []
+        tecdoc_rows = []
+        n_candidates = 0
+        for n in np.unique(n_wildcards):
+            positions = np.flatnonzero(n_wildcards == n)
+            if n == 0:
+                value_code_ids = self.key_values[CODE_COLUMN].get_indexer(engine_codes)
+                code_ids = np.append(value_code_ids, len(self.key_values[CODE_COLUMN]))[value_ids[positions]]
+                keys = _combine_group_and_code(group_ids[positions], code_ids, len(self.key_values[CODE_COLUMN]) + 1)
+            else:
+                prefix_values = self._get_prefix_index(n)[0]
+                prefix_ids = prefix_values.get_indexer(engine_codes.str.rstrip("x"))[value_ids[positions]]
+                keys = _combine_group_and_code(group_ids[positions], prefix_ids, len(prefix_values) + 1)
+            if year_tolerance is None:
+                probe_rows, matched_rows = _search(*self._get_sorted_keys(n), keys)
+            else:
+                probe_rows, matched_rows, n_key_matches = self._search_valid(
+                    n, keys, axle_ids[positions], years[positions], year_tolerance
+                )
+                n_candidates += n_key_matches
+            lis_rows.append(positions[probe_rows])
+            tecdoc_rows.append(matched_rows)
+        if not lis_rows:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        lis_rows, tecdoc_rows = np.concatenate(lis_rows), np.concatenate(tecdoc_rows)
+        if year_tolerance is not None:
+            n_matches = (tecdoc_rows >= 0).sum()
+            logging.info(
+                f"Skipped {n_candidates - n_matches}/{n_candidates} TecDoc records on the exact keys because model "
+                f"years more than {year_tolerance} apart or axle config not matching"
+            )
+        return lis_rows, tecdoc_rows
+
+    def _encode(self, values: pd.Series, col: str) -> np.ndarray:
+        """Codes of the values in the index, -1 for values that are not in TecDoc"""
+        value_ids, distinct_values = pd.factorize(values)
+        key_values = self.key_values[col]
+        distinct_codes = key_values.get_indexer(np.asarray(distinct_values, dtype=object))
+        # Missing values (value id -1) get the code of missing values, the last one
+        return np.append(distinct_codes, len(key_values))[value_ids]
+
+    def _get_prefix_index(self, n_wildcards: int) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+        """Distinct engine codes without their last n_wildcards characters, and the sorted keys on them"""
+        if n_wildcards not in self._prefix_indexes:
+            code_values = self.key_values[CODE_COLUMN]
+            value_prefix_ids, prefix_values = pd.factorize(pd.Series(code_values, dtype=object).str[:-n_wildcards])
+            value_prefix_ids = _with_missing_code(value_prefix_ids, prefix_values)
+            # Missing engine codes have no prefix
+            prefix_ids = np.append(value_prefix_ids, len(prefix_values))[self.arrays["code_ids"]]
+            keys = _combine_group_and_code(self.arrays["group_ids"], prefix_ids, len(prefix_values) + 1)
+            self._prefix_indexes[n_wildcards] = (pd.Index(prefix_values, dtype=object), *_sort_keys(keys))
+        return self._prefix_indexes[n_wildcards]
+
+    def _get_sorted_keys(self, n_wildcards: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The sorted keys that LIS engine codes with n_wildcards wildcards are looked up in, and their TecDoc rows"""
+        if n_wildcards == 0:
+            return self.arrays["sorted_keys"], self.arrays["sorted_rows"]
+        return self._get_prefix_index(n_wildcards)[1:]
+
+    def _get_predicate_index(self, n_wildcards: int, with_axle: bool) -> Tuple[np.ndarray, ...]:
+        """The sorted keys of _get_sorted_keys refined by axle configuration (if with_axle) and model year
+
+        Returns the distinct keys, their number of TecDoc records, the refined keys in sorted order and their TecDoc
+        rows. A refined key is (key rank, axle code, year code), combined into one int64. Year code 0 means a missing
+        model year, the years are whole years from the first model year (code 1) on. Built on first use.
+        """
+        if (n_wildcards, with_axle) not in self._predicate_indexes:
+            sorted_keys, sorted_rows = self._get_sorted_keys(n_wildcards)
+            is_first = np.ones(len(sorted_keys), dtype=bool)
+            is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+            key_sizes = np.diff(np.append(np.flatnonzero(is_first), len(sorted_keys)))
+            key_ranks = np.cumsum(is_first) - 1
+            axle_ids = self.arrays["axle_ids"][sorted_rows] if with_axle else 0
+            year_codes, _, n_year_codes = self._get_year_codes()
+            refined_keys = (key_ranks * self._n_axle_codes + axle_ids) * n_year_codes + year_codes[sorted_rows]
+            order = np.argsort(refined_keys, kind="stable")
+            self._predicate_indexes[n_wildcards, with_axle] = (
+                sorted_keys[is_first], key_sizes, refined_keys[order], np.asarray(sorted_rows)[order]
+            )
+        return self._predicate_indexes[n_wildcards, with_axle]
+
+    @property
+    def _n_axle_codes(self) -> int:
+        return len(self.key_values[AXLE_COLUMN]) + 1
+
+    def _get_year_codes(self) -> Tuple[np.ndarray, float, int]:
+        """The year code of every TecDoc record (0 if missing), the first model year and the number of year codes"""
+        if self._year_codes is None:
+            years = self.arrays["years"]
+            if np.isnan(years).all():
+                self._year_codes = np.zeros(len(years), dtype=np.int64), 0.0, 1
+            else:
+                first_year = np.nanmin(years)
+                year_codes = np.nan_to_num(years - first_year + 1, nan=0).astype(np.int64)
+                self._year_codes = year_codes, first_year, int(np.nanmax(years) - first_year) + 2
+        return self._year_codes
+
+    def _search_valid(
+        self,
+        n_wildcards: int,
+        keys: np.ndarray,
+        axle_ids: np.ndarray,
+        years: np.ndarray,
+        year_tolerance: int,
+    ) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Like _search, but only returns the matches that pass the year and axle predicates (see probe)
+
+        A probe without any valid match has a single -1 match if its key is not in TecDoc and its axle configuration
+        is missing (so the LIS record is kept without a match, like the filters after a left join keep it), else no
+        matches at all. Also returns the number of matches on the keys alone.
+        """
+        has_axle = axle_ids != len(self.key_values[AXLE_COLUMN])
+        probe_rows = []
+        tecdoc_rows = []
+        key_ranks = np.full(len(keys), -1, dtype=np.int64)
+        n_key_matches = 0
+        for with_axle in (False, True):
+            positions = np.flatnonzero(has_axle == with_axle)
+            distinct_keys, key_sizes, refined_keys, refined_rows = self._get_predicate_index(n_wildcards, with_axle)
+            ranks = _rank(keys[positions], distinct_keys)
+            key_ranks[positions] = ranks
+            n_key_matches += int(key_sizes[ranks[ranks >= 0]].sum())
+            axle_codes = axle_ids[positions] if with_axle else np.zeros(len(positions), dtype=np.int64)
+            starts, ends = self._get_valid_ranges(ranks, axle_codes, years[positions], year_tolerance, refined_keys)
+            range_rows, range_positions = _expand_ranges(starts, ends)
+            probe_rows.append(np.tile(positions, 2)[range_rows])
+            tecdoc_rows.append(refined_rows[range_positions])
+
+        # Probes that are kept without a match, as in a left join
+        is_kept_without_match = (key_ranks < 0) & ~has_axle
+        probe_rows.append(np.flatnonzero(is_kept_without_match))
+        tecdoc_rows.append(np.full(is_kept_without_match.sum(), -1, dtype=np.int64))
+        probe_rows, tecdoc_rows = np.concatenate(probe_rows), np.concatenate(tecdoc_rows)
+        order = np.lexsort((tecdoc_rows, probe_rows))
+        return probe_rows[order], tecdoc_rows[order], n_key_matches
+
+    def _get_valid_ranges(
+        self,
+        ranks: np.ndarray,
+        axle_codes: np.ndarray,
+        years: np.ndarray,
+        year_tolerance: int,
+        refined_keys: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Two ranges of refined keys per probe: the missing model years, and the years within the tolerance
+
+        Returns the starts and ends of the ranges in refined_keys, first of the missing years of every probe, then of
+        the years within the tolerance. Probes without a model year match all years in the first range.
+        """
+        _, first_year, n_year_codes = self._get_year_codes()
+        has_year = ~np.isnan(years)
+        missing_low = np.zeros(len(years), dtype=np.int64)
+        missing_high = np.where(has_year, 0, n_year_codes - 1)
+        # Years within the tolerance, clipped to the years in TecDoc (codes 1 up to n_year_codes - 1)
+        tolerance_low = np.maximum(np.ceil(years - year_tolerance - first_year + 1), 1)
+        tolerance_high = np.minimum(np.floor(years + year_tolerance - first_year + 1), n_year_codes - 1)
+        is_empty_tolerance = ~has_year | (tolerance_low > tolerance_high)
+        tolerance_low = np.where(is_empty_tolerance, 1, tolerance_low).astype(np.int64)
+        tolerance_high = np.where(is_empty_tolerance, 0, tolerance_high).astype(np.int64)
+
+        bases = np.tile((ranks * self._n_axle_codes + axle_codes) * n_year_codes, 2)
+        is_valid = np.tile((ranks >= 0) & (axle_codes >= 0), 2)
+        lows = bases + np.concatenate([missing_low, tolerance_low])
+        highs = bases + np.concatenate([missing_high, tolerance_high])
+        starts, ends = _search_ranges(refined_keys, lows, highs)
+        is_valid &= np.concatenate([np.ones(len(ranks), dtype=bool), ~is_empty_tolerance])
+        return np.where(is_valid, starts, 0), np.where(is_valid, ends, 0)
+
+
+def count_wildcards(engine_codes: pd.Series) -> pd.Series:
+    """The number of trailing 'x' wildcards of every engine code"""
+    # Called with the distinct engine codes, a plain loop is faster than the string methods for few values
+    n_wildcards = [len(code) - len(code.rstrip("x")) if isinstance(code, str) else 0 for code in engine_codes]
+    return pd.Series(n_wildcards, index=engine_codes.index, dtype=np.int64)
+
+
+def _with_missing_code(codes: np.ndarray, values: pd.Index) -> np.ndarray:
+    """Gives missing values (code -1 from pd.factorize) their own code, after the codes of the values"""
+    codes = np.asarray(codes, dtype=np.int64).copy()
+    codes[codes == -1] = len(values)
+    return codes
+
+
+def _combine_codes(
+    codes: List[np.ndarray],
+    sizes: List[int],
+    stages: Optional[List[np.ndarray]] = None
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Combines the codes of several columns into one int64 code per row, -1 where any code is -1
+
+    Whenever the combined codes could overflow, they are replaced by their rank among the combined codes seen at
+    build time (the stages). Pass the stages returned when building to combine the codes of probes the same way.
+    """
+    is_building = stages is None
+    stages = [] if is_building else stages
+    combined = codes[0].astype(np.int64)
+    is_valid = combined >= 0
+    size = sizes[0]
+    n_stages = 0
+    for col_codes, col_size in zip(codes[1:], sizes[1:]):
+        if size * col_size >= MAX_COMBINED_SIZE:
+            if is_building:
+                stages.append(np.unique(combined))
+            combined = _rank(combined, stages[n_stages])
+            is_valid &= combined >= 0
+            size = len(stages[n_stages])
+            n_stages += 1
+        combined = combined * col_size + col_codes
+        is_valid &= col_codes >= 0
+        size *= col_size
+    combined[~is_valid] = -1
+    return combined, stages
+
+
+def _combine_group_and_code(group_ids: np.ndarray, code_ids: np.ndarray, n_codes: int) -> np.ndarray:
+    keys = group_ids * n_codes + code_ids
+    keys[(group_ids < 0) | (code_ids < 0)] = -1
+    return keys
+
+
+def _rank(values: np.ndarray, sorted_values: np.ndarray) -> np.ndarray:
+    """Position of every value in sorted_values, -1 if it is not in there"""
+    if len(sorted_values) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.searchsorted(sorted_values, values)
+    positions = np.minimum(positions, len(sorted_values) - 1)
+    return np.where(sorted_values[positions] == values, positions, -1).astype(np.int64)
+
+
+def _sort_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The sorted keys, and the TecDoc positions in the same order (in TecDoc order for equal keys)"""
+    sorted_rows = np.argsort(keys, kind="stable")
+    return keys[sorted_rows], sorted_rows
+
+
+def _search_ranges(sorted_keys: np.ndarray, lows: np.ndarray, highs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The positions in sorted_keys of the keys from lows up to and including highs, as starts and ends"""
+    order = np.argsort(lows, kind="stable")
+    starts = np.empty(len(lows), dtype=np.int64)
+    ends = np.empty(len(highs), dtype=np.int64)
+    starts[order] = np.searchsorted(sorted_keys, lows[order], side="left")
+    ends[order] = np.searchsorted(sorted_keys, highs[order], side="right")
+    return starts, np.maximum(ends, starts)
+
+
+def _expand_ranges(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Every position from starts[i] up to ends[i], with its i"""
+    sizes = ends - starts
+    range_rows = np.repeat(np.arange(len(starts)), sizes)
+    offsets = np.arange(len(range_rows)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return range_rows, np.repeat(starts, sizes) + offsets
+
+
+def _search(sorted_keys: np.ndarray, sorted_rows: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Left join of the keys on the sorted keys. Returns the probe positions and TecDoc positions (-1: no match)"""
+    # Searching the keys in sorted order is much faster, as the consecutive searches hit the same memory
+    key_order = np.argsort(keys, kind="stable")
+    starts = np.empty(len(keys), dtype=np.int64)
+    ends = np.empty(len(keys), dtype=np.int64)
+    starts[key_order] = np.searchsorted(sorted_keys, keys[key_order], side="left")
+    ends[key_order] = np.searchsorted(sorted_keys, keys[key_order], side="right")
+    n_matches = ends - starts
+    n_matches[keys < 0] = 0
+    n_links = np.maximum(n_matches, 1)
+    probe_rows = np.repeat(np.arange(len(keys)), n_links)
+    offsets = np.arange(len(probe_rows)) - np.repeat(np.cumsum(n_links) - n_links, n_links)
+    is_match = np.repeat(n_matches > 0, n_links)
+    tecdoc_rows = np.full(len(probe_rows), -1, dtype=np.int64)
+    tecdoc_rows[is_match] = sorted_rows[(np.repeat(starts, n_links) + offsets)[is_match]]
+    return probe_rows, tecdoc_rows
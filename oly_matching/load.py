@@ -0,0 +1,465 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from oly_matching import constants as c
+
+INPUT_FORMAT_SUFFIXES = {
+    ".xlsx": "xlsx",
+    ".xlsm": "xlsx",
+    ".xls": "xlsx",
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+    ".db": "sqlite",
+}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def load_lis_and_tecdoc(
+    lis_path: str,
+    tecdoc_path: str,
+    cache_folder: Optional[str] = None,
+    cache_mode: str = "use",
+    lis_chunksize: Optional[int] = None,
+    input_format: str = "auto",
+    concurrent: bool = True,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Loads LIS and TecDoc, each in its own process if concurrent. Returns (df_lis, df_tecdoc)
+
+    Parsing holds the GIL, so the two independent loads only overlap when run in separate processes.
+    """
+    tecdoc_kwargs = dict(cache_folder=cache_folder, cache_mode=cache_mode, input_format=input_format)
+    lis_kwargs = dict(chunksize=lis_chunksize, **tecdoc_kwargs)
+    if concurrent:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            future_lis = executor.submit(_timed, load_lis, lis_path, **lis_kwargs)
+            future_tecdoc = executor.submit(_timed, load_tecdoc, tecdoc_path, **tecdoc_kwargs)
+            df_lis, seconds_lis = future_lis.result()
+            df_tecdoc, seconds_tecdoc = future_tecdoc.result()
+    else:
+        df_lis, seconds_lis = _timed(load_lis, lis_path, **lis_kwargs)
+        df_tecdoc, seconds_tecdoc = _timed(load_tecdoc, tecdoc_path, **tecdoc_kwargs)
+    logging.info(f"Loaded LIS from {lis_path} in {seconds_lis:.1f}s")
+    logging.info(f"Loaded TecDoc from {tecdoc_path} in {seconds_tecdoc:.1f}s")
+    return df_lis, df_tecdoc
+
+
+def _timed(function: Callable[..., pd.DataFrame], *args, **kwargs) -> Tuple[pd.DataFrame, float]:
+    start = time.perf_counter()
+    df = function(*args, **kwargs)
+    return df, time.perf_counter() - start
+
+
+def load_lis(
+    path: str,
+    cache_folder: Optional[str] = None,
+    cache_mode: str = "use",
+    chunksize: Optional[int] = None,
+    input_format: str = "auto",
+) -> pd.DataFrame:
+    """Loads only the LIS columns needed for matching, with compact dtypes
+
+    If chunksize is given, the file is streamed in chunks of rows and only the engine records are kept,
+    so that memory scales with the number of engine records instead of the full export. For sqlite,
+    the engine records are always selected in the query.
+    """
+    input_format = get_input_format(path, input_format)
+    if input_format == "sqlite":
+        return read_sqlite(
+            path,
+            table=c.LIS_SQLITE_TABLE,
+            columns=c.LIS_LOAD_COLUMNS,
+            dtype=c.LIS_DTYPES,
+            where={"component_group": "Engines"},
+        )
+    if input_format == "parquet":
+        return read_parquet(path, columns=c.LIS_LOAD_COLUMNS, dtype=c.LIS_DTYPES)
+    if chunksize is None:
+        return load_file(
+            path,
+            input_format=input_format,
+            cache_folder=cache_folder,
+            cache_mode=cache_mode,
+            usecols=c.LIS_LOAD_COLUMNS,
+            dtype=c.LIS_DTYPES,
+        )
+
+    stream_function = stream_excel if input_format == "xlsx" else stream_csv
+    return load_cached(
+        read_function=lambda: stream_function(
+            path,
+            usecols=c.LIS_LOAD_COLUMNS,
+            dtype=c.LIS_DTYPES,
+            keep_column="component_group",
+            keep_value="Engines",
+            chunksize=chunksize,
+        ),
+        path=path,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        options={
+            "input_format": input_format,
+            "usecols": c.LIS_LOAD_COLUMNS,
+            "dtype": c.LIS_DTYPES,
+            "component_group": "Engines",
+        },
+    )
+
+
+def check_lis_record(record: object) -> None:
+    """Raises a ValueError naming the fields of a raw LIS record that are missing or of the wrong type
+
+    Checks what load_lis_records and the cleaning need: a json object with the LIS_REQUIRED_FIELDS, text in the
+    text columns and whole numbers in the year columns.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"A LIS record must be a json object, got {record!r}"[:200])
+    problems = [f"{field} is missing" for field in c.LIS_REQUIRED_FIELDS if record.get(field) is None]
+    for field, dtype in c.LIS_DTYPES.items():
+        value = record.get(field)
+        if value is None:
+            continue
+        if dtype == "Int16":
+            if not _is_small_integer(value):
+                problems.append(f"{field} must be a year, got {value!r}")
+        elif not isinstance(value, str):
+            problems.append(f"{field} must be text, got {value!r}")
+    if problems:
+        raise ValueError(f"Invalid LIS record (type_id {record.get('type_id')!r}): {', '.join(problems)}")
+
+
+def _is_small_integer(value: object) -> bool:
+    """Whether the value fits an Int16 column"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return float(value).is_integer() and -2 ** 15 <= value < 2 ** 15
+
+
+def load_lis_records(records: List[dict]) -> pd.DataFrame:
+    """Converts raw LIS records (json objects with the LIS columns) to a frame like load_lis returns
+
+    Missing columns are missing values. Records without component_group are taken to be engine records.
+    """
+    df = pd.DataFrame.from_records(records, columns=c.LIS_LOAD_COLUMNS)
+    df["component_group"] = df["component_group"].fillna("Engines")
+    return apply_dtypes(df, c.LIS_DTYPES)
+
+
+def load_tecdoc(
+    path: str,
+    cache_folder: Optional[str] = None,
+    cache_mode: str = "use",
+    input_format: str = "auto",
+) -> pd.DataFrame:
+    """Loads only the TecDoc columns needed for matching, with compact dtypes"""
+    input_format = get_input_format(path, input_format)
+    if input_format == "sqlite":
+        return read_sqlite(
+            path,
+            table=c.TECDOC_SQLITE_TABLE,
+            columns=c.TECDOC_LOAD_COLUMNS,
+            dtype=c.TECDOC_DTYPES,
+            parse_dates=c.TECDOC_DATE_COLUMNS,
+        )
+    if input_format == "parquet":
+        return read_parquet(
+            path,
+            columns=c.TECDOC_LOAD_COLUMNS,
+            dtype=c.TECDOC_DTYPES,
+            parse_dates=c.TECDOC_DATE_COLUMNS,
+        )
+    return load_file(
+        path,
+        input_format=input_format,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        usecols=c.TECDOC_LOAD_COLUMNS,
+        dtype=c.TECDOC_DTYPES,
+        parse_dates=c.TECDOC_DATE_COLUMNS,
+    )
+
+
+def get_input_format(path: str, input_format: str = "auto") -> str:
+    """Returns input_format, or detects it from the file extension if input_format is 'auto'"""
+    if input_format not in c.INPUT_FORMATS:
+        raise ValueError(f"input_format = {input_format} is not supported! Choose from {c.INPUT_FORMATS}")
+    if input_format != "auto":
+        return input_format
+    suffix = Path(path).suffix.lower()
+    try:
+        return INPUT_FORMAT_SUFFIXES[suffix]
+    except KeyError:
+        raise ValueError(f"Cannot detect the input format of {path}, please pass the input format explicitly")
+
+
+def load_file(
+    path: str,
+    input_format: str = "xlsx",
+    cache_folder: Optional[str] = None,
+    cache_mode: str = "use",
+    **read_kwargs,
+) -> pd.DataFrame:
+    """Loads an excel or csv file, using the cache (see load_excel)"""
+    if input_format == "xlsx":
+        return load_excel(path, cache_folder=cache_folder, cache_mode=cache_mode, **read_kwargs)
+    return load_cached(
+        read_function=lambda: pd.read_csv(path, **read_kwargs),
+        path=path,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        options={"input_format": input_format, **read_kwargs},
+    )
+
+
+def read_parquet(
+    path: str,
+    columns: List[str],
+    dtype: Dict[str, object],
+    parse_dates: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    df = pd.read_parquet(path, columns=columns)
+    return apply_dtypes(df, dtype, parse_dates)
+
+
+def read_sqlite(
+    path: str,
+    table: str,
+    columns: List[str],
+    dtype: Dict[str, object],
+    where: Optional[Dict[str, object]] = None,
+    parse_dates: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Reads columns from a sqlite table. The column selection and the where filters are done by sqlite
+
+    Args:
+        path: path to the sqlite database
+        table: table to read from
+        columns: columns to select
+        dtype: dtypes applied to the result
+        where: only select rows where column == value for every column, value pair
+        parse_dates: columns to convert to datetime
+    """
+    query = f"SELECT {', '.join(_quote(col) for col in columns)} FROM {_quote(table)}"
+    where = where or {}
+    if where:
+        query += " WHERE " + " AND ".join(f"{_quote(col)} = ?" for col in where)
+    logging.info(f"Reading {path} with query: {query}")
+    with contextlib.closing(sqlite3.connect(path)) as connection:
+        df = pd.read_sql_query(query, connection, params=list(where.values()), parse_dates=parse_dates)
+    return apply_dtypes(df, dtype)
+
+
+def apply_dtypes(df: pd.DataFrame, dtype: Dict[str, object], parse_dates: Optional[List[str]] = None) -> pd.DataFrame:
+    """Converts the columns of a frame that was not read by the pandas text parser to the declared dtypes"""
+    for col, col_dtype in dtype.items():
+        if col_dtype is str:
+            # Like the text parser: keep missing values missing instead of turning them into "nan"
+            df[col] = df[col].where(df[col].isnull(), df[col].astype(str))
+        else:
+            df[col] = df[col].astype(col_dtype)
+    for col in parse_dates or []:
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def load_excel(path: str, cache_folder: Optional[str] = None, cache_mode: str = "use", **read_kwargs) -> pd.DataFrame:
+    """Loads an excel file, using a columnar (parquet) cache of the parsed frame if possible
+
+    The cache is keyed by the content hash of the file and the options passed to pd.read_excel, so a
+    new export (or different reader options) never hits a stale cache entry.
+
+    Args:
+        path: path to the excel file
+        cache_folder: where to store the parsed frames. No caching if None
+        cache_mode: 'use' (read from cache if available), 'refresh' (always parse and overwrite the cache),
+                    'off' (never read or write the cache)
+        **read_kwargs: passed on to pd.read_excel
+    """
+    return load_cached(
+        read_function=lambda: pd.read_excel(path, **read_kwargs),
+        path=path,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        options=read_kwargs,
+    )
+
+
+def load_cached(
+    read_function: Callable[[], pd.DataFrame],
+    path: str,
+    cache_folder: Optional[str],
+    cache_mode: str,
+    options: dict,
+) -> pd.DataFrame:
+    """Returns the cached result of read_function for the file at path, calls read_function on a cache miss
+
+    Args:
+        read_function: parses the file at path
+        path: path to the file being parsed
+        cache_folder: where to store the parsed frames. No caching if None
+        cache_mode: 'use', 'refresh' or 'off' (see load_excel)
+        options: everything that changes the output of read_function, part of the cache key
+    """
+    if cache_mode not in c.CACHE_MODES:
+        raise ValueError(f"cache_mode = {cache_mode} is not supported! Choose from {c.CACHE_MODES}")
+    if cache_folder is None or cache_mode == "off":
+        return read_function()
+
+    cache_path = get_cache_path(path, cache_folder, options)
+    if cache_mode == "use" and cache_path.exists():
+        logging.info(f"Reading parsed {path} from cache {cache_path}")
+        return pd.read_parquet(cache_path)
+
+    df = read_function()
+    write_cache(df, cache_path)
+    return df
+
+
+def stream_excel(
+    path: str,
+    usecols: List[str],
+    dtype: Dict[str, object],
+    keep_column: str,
+    keep_value: object,
+    chunksize: int = 10000,
+) -> pd.DataFrame:
+    """Reads the first sheet of an excel file in chunks of rows, keeping only rows where keep_column == keep_value
+
+    Rows are filtered and projected on usecols before they are parsed into a frame, so the full sheet is never
+    materialized. Cells are converted the same way pd.read_excel does, so the result is equal to reading the
+    full sheet and filtering afterwards (up to the index, which is reset).
+    """
+    from openpyxl import load_workbook
+
+    chunk_dtype, categorical_cols = _split_categorical_dtypes(dtype)
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows()
+        header = [_convert_cell(cell) for cell in next(rows)]
+        # Like pd.read_excel, the columns keep the order of the file
+        usecols = sorted(usecols, key=header.index)
+        ix_usecols = [header.index(col) for col in usecols]
+        ix_keep_column = header.index(keep_column)
+
+        n_rows = 0
+        chunk = []
+        df_chunks = []
+        for row in rows:
+            n_rows += 1
+            if ix_keep_column >= len(row) or _convert_cell(row[ix_keep_column]) != keep_value:
+                continue
+            chunk.append([_convert_cell(row[ix]) if ix < len(row) else "" for ix in ix_usecols])
+            if len(chunk) == chunksize:
+                df_chunks.append(_parse_chunk(chunk, usecols, chunk_dtype))
+                chunk = []
+        if chunk or not df_chunks:
+            df_chunks.append(_parse_chunk(chunk, usecols, chunk_dtype))
+    finally:
+        workbook.close()
+
+    df = pd.concat(df_chunks, ignore_index=True)
+    df[categorical_cols] = df[categorical_cols].astype("category")
+    logging.info(f"Streamed {path}: kept {len(df)}/{n_rows} rows where {keep_column} == {keep_value}")
+    return df
+
+
+def stream_csv(
+    path: str,
+    usecols: List[str],
+    dtype: Dict[str, object],
+    keep_column: str,
+    keep_value: object,
+    chunksize: int = 10000,
+) -> pd.DataFrame:
+    """Reads a csv file in chunks of rows, keeping only rows where keep_column == keep_value (see stream_excel)"""
+    chunk_dtype, categorical_cols = _split_categorical_dtypes(dtype)
+
+    n_rows = 0
+    df_chunks = []
+    for df_chunk in pd.read_csv(path, usecols=usecols, dtype=chunk_dtype, chunksize=chunksize):
+        n_rows += len(df_chunk)
+        df_chunks.append(df_chunk[df_chunk[keep_column] == keep_value])
+
+    df = pd.concat(df_chunks, ignore_index=True)
+    df[categorical_cols] = df[categorical_cols].astype("category")
+    logging.info(f"Streamed {path}: kept {len(df)}/{n_rows} rows where {keep_column} == {keep_value}")
+    return df
+
+
+def _split_categorical_dtypes(dtype: Dict[str, object]) -> Tuple[Dict[str, object], List[str]]:
+    """Categories can only be set once all chunks are known, so chunks are read with object instead"""
+    chunk_dtype = {col: (object if col_dtype == "category" else col_dtype) for col, col_dtype in dtype.items()}
+    categorical_cols = [col for col, col_dtype in dtype.items() if col_dtype == "category"]
+    return chunk_dtype, categorical_cols
+
+
+def _parse_chunk(chunk: List[list], columns: List[str], dtype: Dict[str, object]) -> pd.DataFrame:
+    """Uses the parser of pd.read_excel, so missing values and dtypes are handled identically"""
+    parser = pd.io.parsers.TextParser([columns] + chunk, header=0, dtype=dtype)
+    return parser.read()
+
+
+def _convert_cell(cell) -> object:
+    """Same conversion as pandas' openpyxl reader"""
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return float("nan")
+    elif cell.data_type == TYPE_NUMERIC and int(cell.value) == cell.value:
+        return int(cell.value)
+    return cell.value
+
+
+def get_cache_path(path: str, cache_folder: str, options: dict) -> Path:
+    cache_key = get_cache_key(path, options)
+    return Path(cache_folder) / f"{Path(path).stem}-{cache_key}.parquet"
+
+
+def get_cache_key(path: str, options: dict) -> str:
+    """Combines the content hash of the file with the reader options"""
+    hasher = hashlib.sha256()
+    hasher.update(get_file_hash(path).encode())
+    hasher.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()[:16]
+
+
+def get_file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_cache(df: pd.DataFrame, cache_path: Path) -> None:
+    """Writes the frame to the cache. Failing to cache is not fatal, we only lose the speed-up"""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    try:
+        df.to_parquet(tmp_path, index=False)
+    except (ImportError, ValueError, TypeError, NotImplementedError) as e:
+        logging.warning(f"Could not cache parsed frame to {cache_path}, continuing without cache: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Cached parsed frame to {cache_path}")
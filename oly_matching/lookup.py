@@ -0,0 +1,94 @@
+import itertools
+import json
+import logging
+from typing import Iterable, Iterator, List, TextIO, Tuple
+
+import pandas as pd
+
+from oly_matching import constants as c
+from oly_matching import load
+from oly_matching.index import TecDocIndex
+from oly_matching.record import RecordMatcher
+
+
+def lookup_stream(
+    lines: Iterable[str],
+    output: TextIO,
+    df_tecdoc: pd.DataFrame,
+    tecdoc_index: TecDocIndex = None,
+    how: str = "exact",
+    batch_size: int = 1000,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> None:
+    """Matches raw LIS records read as json lines in micro-batches, and writes every link as a json line
+
+    Only one batch of records is in memory at a time, and the links of a batch are written (and flushed) before
+    the next batch is read, so memory does not grow with the input and the output keeps flowing. A link is
+    {"type_id": ..., "n_type": ...}, distinct within a batch. Records without links write nothing. Invalid records
+    are skipped (see parse_records), and a batch that fails is logged and skipped, so the stream goes on.
+
+    Args:
+        lines: raw LIS records, a json object with the LIS columns per line
+        output: where to write the links
+        df_tecdoc: clean TecDoc records
+        tecdoc_index: index built from df_tecdoc, used by the exact matching
+        how: 'exact' or 'cut_strings'
+        batch_size: number of records that are matched at once
+        year_tolerance: the model years of a match are at most this many years apart
+    """
+    # Built once, for cut_strings this cuts TecDoc and builds the index of the cut records
+    matcher = RecordMatcher(df_tecdoc, tecdoc_index, how=how, year_tolerance=year_tolerance)
+
+    n_records = 0
+    n_links = 0
+    n_failed_records = 0
+    for batch_number, records in enumerate(iterate_batches(parse_records(lines), batch_size), start=1):
+        try:
+            links = matcher.match(records)
+        except Exception:
+            logging.exception(f"Skipping batch {batch_number} of {len(records)} records, matching it failed")
+            n_failed_records += len(records)
+            continue
+        write_links(links, output)
+        n_records += len(records)
+        n_links += len(links)
+    logging.info(
+        f"Looked up {n_records} LIS records, wrote {n_links} links. Skipped {n_failed_records} records of failed "
+        f"batches"
+    )
+
+
+def parse_records(lines: Iterable[str]) -> Iterator[dict]:
+    """Parses every non-empty line as a LIS record, skips (and logs) lines that are not a valid LIS record
+
+    A valid record is a json object with the fields that the matching needs, see load.check_lis_record.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logging.warning(f"Skipping line {line_number}, it is not json: {line.strip()[:100]}")
+            continue
+        try:
+            load.check_lis_record(record)
+        except ValueError as e:
+            logging.warning(f"Skipping line {line_number}: {e}")
+            continue
+        yield record
+
+
+def iterate_batches(records: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_links(links: List[Tuple[object, int]], output: TextIO) -> None:
+    """Writes every (type_id, N-Type No.) link as a json line"""
+    output.write("".join(json.dumps({"type_id": type_id, "n_type": n_type}) + "\n" for type_id, n_type in links))
+    output.flush()
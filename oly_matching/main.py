@@ -1,94 +1,304 @@
 import logging
+from typing import Callable, Dict, Tuple, Union
 
 import pandas as pd
 
 from oly_matching import constants as c
-from oly_matching import clean, extract, match, analyze, pretty_logging
+from oly_matching import clean, extract, match, analyze, load, reference, save, state, utils, pretty_logging
+from oly_matching.index import TecDocIndex
 
 pretty_logging.configure_logger(logging.INFO)
 
 
-def main(lis_path: str, tecdoc_path: str, output_folder: str, matching_method: str) -> None:
-    """Main script. Loads, cleans, matches, and analyzes lis and tecdoc data
-
-    Creates 4 files:
-    - matches_per_lis_id.xlsx: for each LIS type ID, state which N-types correspond to it (together with extra info)
-    - links_with_original_data.xlsx: for every link between LIS and TecDoc, state what was the
-                                     original information in LIS and TecDoc (used to validate matches by hand)
-    - metrics: overall overview of matching performance
-    - results_per_model.xlsx: overview of performance per model (useful for identifying algorithm improvements)
+def prepare_lis(df_lis: pd.DataFrame, workers: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Extracts and cleans the loaded LIS records for matching. Returns the clean and the original records"""
+    df_lis = select_lis_records(df_lis)
 
-    Args:
-        lis_path: path to LIS excel file
-        tecdoc_path: path to TecDoc excel file
-        output_folder: where to store the output files
-        matching_method: 'exact', 'cut_strings', 'fuzzy'
-    """
-    logging.info("Loading TecDoc records...")
-    df_tecdoc = pd.read_excel(
-        io=tecdoc_path,
-        parse_dates=[7, 8]
-    )
-    # df_tecdoc = pd.read_pickle("./data/raw/tecdoc.pkl")
-    logging.info(f"Loading TecDoc complete. Shape: {df_tecdoc.shape}")
+    # Save the original data to compare matches later
+    df_lis_original = df_lis.copy(deep=True)
+    return clean_lis_records(df_lis, workers=workers), df_lis_original
 
-    logging.info("Loading LIS records...")
-    df_lis = pd.read_excel(lis_path)
-    # df_lis = pd.read_pickle("./data/raw/lis.pkl")
-    logging.info(f"Loading LIS complete. Shape: {df_lis.shape}")
 
+def select_lis_records(df_lis: pd.DataFrame) -> pd.DataFrame:
+    """The loaded LIS records and columns that are matched, before any extraction or cleaning"""
     # We keep only the LIS rows related to the engine
     df_lis = clean.keep_engine_records_lis(df_lis)
 
     # We only keep the columns we care about
     df_lis = df_lis[c.LIS_COLUMNS]
+
+    # Take one of the largest brands
+    return clean.filter_records(df_lis)
+
+
+def clean_lis_records(df_lis: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """Extracts and cleans LIS records selected with select_lis_records. Every record is cleaned on its own"""
+    # Extract important LIS information and append as columns
+    df_lis = extract.extract_and_append_relevant_data_lis(df_lis)
+
+    # Clean the columns from LIS so that they have the same format as TecDoc
+    df_lis = clean.clean_lis(df_lis, workers=workers)
+
+    # If essential columns are missing, delete the record
+    logging.info("Dropping rows from LIS that are missing critical matching data...")
+    ix_keep = df_lis[c.REQUIRED_MATCHING_COLS].notnull().all(axis=1)
+    logging.info(f"Keeping {ix_keep.sum()}/{len(df_lis)} rows")
+    df_lis = df_lis[ix_keep]
+    df_lis = df_lis.reset_index(drop=True)
+    return df_lis
+
+
+def prepare_tecdoc(df_tecdoc: pd.DataFrame, workers: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Cleans the loaded TecDoc records for matching. Returns the clean and the original records"""
+    df_tecdoc = select_tecdoc_records(df_tecdoc)
+
+    # Save the original data to compare matches later
+    df_tecdoc_original = df_tecdoc.copy(deep=True)
+    return clean_tecdoc_records(df_tecdoc, workers=workers), df_tecdoc_original
+
+
+def select_tecdoc_records(df_tecdoc: pd.DataFrame) -> pd.DataFrame:
+    """The loaded TecDoc records and columns that are matched, renamed like LIS, before any cleaning"""
+    # We only keep the columns we care about
     df_tecdoc = df_tecdoc[c.TECDOC_COLUMNS]
 
     # Rename all tecdoc columns to correspond to LIS columns
     df_tecdoc = df_tecdoc.rename(columns=c.MATCHING_COLUMN_MAPPING)
 
     # Take one of the largest brands
-    df_lis = clean.filter_records(df_lis)
-    df_tecdoc = clean.filter_records(df_tecdoc)
+    return clean.filter_records(df_tecdoc)
 
-    # Save the original data to compare matches later
-    df_lis_original = df_lis.copy(deep=True)
-    df_tecdoc_original = df_tecdoc.copy(deep=True)
 
-    # Extract important LIS information and append as columns
-    df_lis = extract.extract_and_append_relevant_data_lis(df_lis)
-
-    # Clean the columns from LIS and TecDoc so that they have the same format
-    df_lis = clean.clean_lis(df_lis)
-    df_tecdoc = clean.clean_tecdoc(df_tecdoc)
+def clean_tecdoc_records(df_tecdoc: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """Cleans TecDoc records selected with select_tecdoc_records. Every record is cleaned on its own"""
+    # Clean the columns from TecDoc so that they have the same format as LIS
+    df_tecdoc = clean.clean_tecdoc(df_tecdoc, workers=workers)
 
-    # Matching
     # If essential columns are missing, delete the record
     logging.info("Dropping rows from TecDoc that are missing critical matching data...")
     ix_keep = df_tecdoc[c.REQUIRED_MATCHING_COLS].notnull().all(axis=1)
     logging.info(f"Keeping {ix_keep.sum()}/{len(df_tecdoc)} rows")
     df_tecdoc = df_tecdoc[ix_keep]
     df_tecdoc["in_tecdoc"] = True
+    df_tecdoc = df_tecdoc.reset_index(drop=True)
+    return df_tecdoc
 
-    logging.info("Dropping rows from LIS that are missing critical matching data...")
-    ix_keep = df_lis[c.REQUIRED_MATCHING_COLS].notnull().all(axis=1)
-    logging.info(f"Keeping {ix_keep.sum()}/{len(df_lis)} rows")
-    df_lis = df_lis[ix_keep]
 
-    df_lis = df_lis.reset_index(drop=True)
-    df_tecdoc = df_tecdoc.reset_index(drop=True)
+def build_reference(
+    tecdoc_path: str,
+    reference_folder: str,
+    cache_folder: str = None,
+    cache_mode: str = "use",
+    input_format: str = "auto",
+    workers: int = 1,
+) -> None:
+    """Loads and cleans TecDoc once, and saves the result as a reference for later matching runs
+
+    Args:
+        tecdoc_path: path to TecDoc file
+        reference_folder: where to save the reference (see reference.save_reference)
+        cache_folder: where to cache the parsed excel file. No caching if None
+        cache_mode: 'use', 'refresh' or 'off' (see load.load_excel)
+        input_format: 'auto' (detect from file extension), 'xlsx', 'csv', 'parquet' or 'sqlite'
+        workers: clean the makes in a pool of this many processes if > 1
+    """
+    logging.info("Loading TecDoc records...")
+    df_tecdoc = load.load_tecdoc(
+        tecdoc_path,
+        cache_folder=cache_folder,
+        cache_mode=cache_mode,
+        input_format=input_format
+    )
+    logging.info(f"Loading TecDoc complete. Shape: {df_tecdoc.shape}")
+    df_tecdoc, df_tecdoc_original = prepare_tecdoc(df_tecdoc, workers=workers)
+    reference.save_reference(
+        df_tecdoc,
+        df_tecdoc_original,
+        reference_folder=reference_folder,
+        source_hash=load.get_file_hash(tecdoc_path),
+    )
+
+
+def load_or_build_reference(
+    reference_folder: str,
+    tecdoc_path: str,
+    cache_folder: str = None,
+    cache_mode: str = "use",
+    input_format: str = "auto",
+    workers: int = 1,
+) -> Tuple[pd.DataFrame, TecDocIndex]:
+    """Loads the clean TecDoc records and their index from a reference, builds the reference first if it is missing
+
+    See build_reference for the arguments.
+    """
+    if not reference.reference_exists(reference_folder):
+        logging.info(f"No TecDoc reference in {reference_folder}, building it from {tecdoc_path}...")
+        build_reference(tecdoc_path, reference_folder, cache_folder, cache_mode, input_format, workers)
+    df_tecdoc, _ = reference.load_reference(reference_folder)
+    return df_tecdoc, reference.load_index(reference_folder)
+
+
+def match_lis_records(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    how: str = "exact",
+    tecdoc_index: TecDocIndex = None,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> pd.DataFrame:
+    """Prepares raw LIS records like prepare_lis and matches them to clean TecDoc records
+
+    Used for every lookup of 'olyslager serve' and batch of 'olyslager lookup', so only warnings are logged. Returns
+    the distinct links: the type_id of a LIS record and the N-Type No. of a TecDoc record. Records that are dropped
+    while preparing or that do not match have no links.
+
+    Args:
+        df_lis: raw LIS records (see load.load_lis_records)
+        df_tecdoc: clean TecDoc records
+        how: one of constants.RECORD_MATCHING_METHODS
+        tecdoc_index: index built from df_tecdoc. Only used by 'exact', cut_strings matches on cut records and
+                      builds its own
+        year_tolerance: the model years of a match are at most this many years apart
+    """
+    check_record_matching_method(how)
+    with utils.quiet_pipeline_logs():
+        df_lis, _ = prepare_lis(df_lis)
+        # Only the batch run reports the fan-out of the variant tables, don't let it grow
+        utils.pop_fan_out_report()
+        df_lis_matched = match.match_tecdoc_records_to_lis(
+            df_lis,
+            df_tecdoc,
+            how=how,
+            tecdoc_index=tecdoc_index if how == "exact" else None,
+            year_tolerance=year_tolerance,
+        )
+    return get_links(df_lis_matched)
+
+
+def check_record_matching_method(how: str) -> None:
+    """Raises a ValueError if raw LIS records can not be matched with this method (see match_lis_records)"""
+    if how not in c.RECORD_MATCHING_METHODS:
+        raise ValueError(f"how = {how} is not supported! Choose from {c.RECORD_MATCHING_METHODS}")
+
+
+def get_links(df_lis_matched: pd.DataFrame) -> pd.DataFrame:
+    """The distinct links of matched records: the type_id of a LIS record and the N-Type No. of a TecDoc record"""
+    df_links = df_lis_matched.loc[df_lis_matched["N-Type No."].notnull(), ["type_id", "N-Type No."]]
+    df_links = df_links.drop_duplicates().astype({"N-Type No.": int})
+    return df_links.reset_index(drop=True)
+
+
+def match_incrementally(
+    state_folder: str,
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    how: str = "exact",
+    year_tolerance: int = c.YEAR_TOLERANCE,
+    workers: int = 1,
+    df_tecdoc_original: pd.DataFrame = None,
+    tecdoc_index: TecDocIndex = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Matches the loaded records, only cleaning and matching the records that changed since the previous run
+
+    The records of every LIS type and N-type are compared to the previous run by their hash (see state.hash_records).
+    The new and changed ones are cleaned, and the previous clean records of the others are reused. The links of the
+    previous run that touch a changed or deleted record are dropped, the changed LIS records are matched against all
+    TecDoc records and the unchanged LIS records against the changed TecDoc records. As every link only depends on
+    the records it links, the result is the same as a full run. Saves the state for the next run.
+
+    Args:
+        state_folder: folder of the state of the previous run (see state.load_state), updated afterwards
+        df_lis: loaded LIS records
+        df_tecdoc: loaded TecDoc records, or the clean records of a TecDoc reference if df_tecdoc_original is given
+        how: 'exact' or 'cut_strings', must be the matching method of the previous run
+        year_tolerance: must be the year tolerance of the previous run
+        workers: clean the makes in a pool of this many processes if > 1
+        df_tecdoc_original: the original records of the TecDoc reference
+        tecdoc_index: the index of the TecDoc reference
+
+    Returns:
+        The links as matched records (type_id, N-Type No. and in_tecdoc), and the original LIS and TecDoc records
+    """
+    previous = state.load_state(state_folder)
+    df_lis_original = select_lis_records(df_lis)
+    lis_hashes = state.hash_records(df_lis_original, state.LIS_ID_COLUMN)
+    lis_changed, lis_deleted = state.get_changed_ids(previous.lis_hashes, lis_hashes)
+    df_lis = _update_clean_records(
+        previous.df_lis, df_lis_original, lis_changed, lis_deleted, clean_lis_records, state.LIS_ID_COLUMN, workers
+    )
+
+    if df_tecdoc_original is None:
+        df_tecdoc_original = select_tecdoc_records(df_tecdoc)
+        tecdoc_hashes = state.hash_records(df_tecdoc_original, state.TECDOC_ID_COLUMN)
+        tecdoc_changed, tecdoc_deleted = state.get_changed_ids(previous.tecdoc_hashes, tecdoc_hashes)
+        df_tecdoc = _update_clean_records(
+            previous.df_tecdoc,
+            df_tecdoc_original,
+            tecdoc_changed,
+            tecdoc_deleted,
+            clean_tecdoc_records,
+            state.TECDOC_ID_COLUMN,
+            workers,
+        )
+        tecdoc_index = None
+    else:
+        tecdoc_hashes = state.hash_records(df_tecdoc_original, state.TECDOC_ID_COLUMN)
+        tecdoc_changed, tecdoc_deleted = state.get_changed_ids(previous.tecdoc_hashes, tecdoc_hashes)
+    logging.info(
+        f"Since the previous run, {len(lis_changed)} LIS types are new or changed and {len(lis_deleted)} deleted, "
+        f"{len(tecdoc_changed)} N-types are new or changed and {len(tecdoc_deleted)} deleted"
+    )
+
+    lis_dirty, tecdoc_dirty = lis_changed.union(lis_deleted), tecdoc_changed.union(tecdoc_deleted)
+    links = [state.keep_unchanged_links(previous.df_links, lis_dirty, tecdoc_dirty)]
+    is_lis_changed = df_lis[state.LIS_ID_COLUMN].isin(lis_changed)
+    is_tecdoc_changed = df_tecdoc[state.TECDOC_ID_COLUMN].isin(tecdoc_changed)
+    if is_lis_changed.any():
+        df_lis_matched = match.match_tecdoc_records_to_lis(
+            df_lis[is_lis_changed], df_tecdoc, how=how, tecdoc_index=tecdoc_index, year_tolerance=year_tolerance
+        )
+        links.append(get_links(df_lis_matched))
+    if is_tecdoc_changed.any() and not is_lis_changed.all():
+        df_lis_matched = match.match_tecdoc_records_to_lis(
+            df_lis[~is_lis_changed], df_tecdoc[is_tecdoc_changed], how=how, year_tolerance=year_tolerance
+        )
+        links.append(get_links(df_lis_matched))
+    df_links = pd.concat(links).drop_duplicates().sort_values(["type_id", "N-Type No."]).reset_index(drop=True)
+
+    state.save_records(state_folder, df_lis, df_tecdoc, lis_hashes, tecdoc_hashes)
+    state.save_links(state_folder, df_links, how, year_tolerance)
+    return df_links.assign(in_tecdoc=True), df_lis_original, df_tecdoc_original
+
+
+def _update_clean_records(
+    df_previous: pd.DataFrame,
+    df_original: pd.DataFrame,
+    changed_ids: pd.Index,
+    deleted_ids: pd.Index,
+    clean_function: Callable[..., pd.DataFrame],
+    id_col: str,
+    workers: int,
+) -> pd.DataFrame:
+    """The previous clean records of the unchanged ids, and the records of the changed ids cleaned again"""
+    df_unchanged = df_previous[~df_previous[id_col].isin(changed_ids.union(deleted_ids))]
+    if len(changed_ids) == 0:
+        return df_unchanged.reset_index(drop=True)
+    df_changed = clean_function(df_original[df_original[id_col].isin(changed_ids)].copy(deep=True), workers=workers)
+    return pd.concat([df_unchanged, df_changed], ignore_index=True)
 
-    # Matching
-    df_lis_matched = match.match_tecdoc_records_to_lis(df_lis, df_tecdoc, how=matching_method)
 
-    # Saving output
+def get_results(
+    df_lis_matched: pd.DataFrame,
+    df_lis_original: pd.DataFrame,
+    df_tecdoc_original: pd.DataFrame,
+    df_fan_out: pd.DataFrame = None,
+) -> Dict[str, Union[pd.DataFrame, pd.Series]]:
+    """Analyzes the matches. Returns the results (see main) by name
+
+    The fan-out report of the variant tables (see utils.join_variants) is added to the results if given.
+    """
     # All details about the matches
     df_links = analyze.get_links_and_original_data(df_lis_matched, df_lis_original, df_tecdoc_original)
 
-    output_path = f"{output_folder}/links_with_original_data.xlsx"
-    df_links.to_excel(output_path, index=False)
-    logging.info(f"Saved links between LIS and N-type together with original LIS and TecDoc data to {output_path}.")
-
     # Results per LIS ID
     df_lis_original = clean.clean_string_columns(df_lis_original)
     df_lis_original = clean.clean_engine_code(df_lis_original)
@@ -110,14 +320,8 @@ def main(lis_path: str, tecdoc_path: str, output_folder: str, matching_method: s
     df_results["has_at_least_one_match"] = df_results["n_types"].notnull()
     df_results = df_results.reset_index()
 
-    output_path = f"{output_folder}/matches_per_lis_id.xlsx"
-    df_results.to_excel(output_path, index=False)
-    logging.info(f"Saved list of LIS ID's with N-type to {output_path}.")
-
     # Results per model
     df_results_per_model = analyze.get_performance_per_model(df_results)
-    output_path = f"{output_folder}/results_per_model.xlsx"
-    df_results_per_model.to_excel(output_path, index=False)
 
     # Metrics
     n_matches = df_results["n_types"].notnull().sum()
@@ -144,8 +348,168 @@ def main(lis_path: str, tecdoc_path: str, output_folder: str, matching_method: s
             "percentage_matched_with_engine_code": percentage_matched_with_engine_code
         },
         name="metrics",
+        dtype=object,  # keeps the counts integers
     )
-    output_path = f"{output_folder}/metrics.xlsx"
-    metrics.to_excel(output_path)
+
+    results = {
+        "links_with_original_data": df_links,
+        "matches_per_lis_id": df_results,
+        "results_per_model": df_results_per_model,
+        "metrics": metrics,
+    }
+    if df_fan_out is not None:
+        results["fan_out"] = df_fan_out
+    return results
+
+
+def main(
+    lis_path: str,
+    tecdoc_path: str,
+    output_folder: str,
+    matching_method: str,
+    cache_folder: str = None,
+    cache_mode: str = "use",
+    lis_chunksize: int = None,
+    input_format: str = "auto",
+    output_format: str = "xlsx",
+    single_workbook: bool = False,
+    tecdoc_reference: str = None,
+    copy_free: bool = False,
+    workers: int = 1,
+    ngram_top_k: int = c.NGRAM_TOP_K,
+    ngram_threshold: float = c.NGRAM_THRESHOLD,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+    state_folder: str = None,
+    incremental: bool = False,
+) -> None:
+    """Main script. Loads, cleans, matches, and analyzes lis and tecdoc data
+
+    Creates 5 files (xlsx by default, see output_format and single_workbook):
+    - matches_per_lis_id.xlsx: for each LIS type ID, state which N-types correspond to it (together with extra info)
+    - links_with_original_data.xlsx: for every link between LIS and TecDoc, state what was the
+                                     original information in LIS and TecDoc (used to validate matches by hand)
+    - metrics: overall overview of matching performance
+    - results_per_model.xlsx: overview of performance per model (useful for identifying algorithm improvements)
+    - fan_out.xlsx: how many records every variant table (engine codes, axle configurations) added while cleaning
+
+    Args:
+        lis_path: path to LIS excel file
+        tecdoc_path: path to TecDoc excel file
+        output_folder: where to store the output files
+        matching_method: 'exact', 'cut_strings', 'fuzzy', 'fuzzy_ngram', 'cascade'
+        cache_folder: where to cache the parsed excel files. No caching if None
+        cache_mode: 'use', 'refresh' or 'off' (see load.load_excel)
+        lis_chunksize: if given, stream LIS in chunks of this many rows and keep only the engine records
+        input_format: 'auto' (detect from file extension), 'xlsx', 'csv', 'parquet' or 'sqlite'
+        output_format: 'xlsx', 'csv' or 'parquet'. Metrics are saved as json if not 'xlsx'
+        single_workbook: save all results as sheets of a single results.xlsx instead
+        tecdoc_reference: folder of a reference built with build_reference. If given, TecDoc is not loaded from
+                          tecdoc_path and not cleaned again, and the exact matching memory-maps its index
+        copy_free: let the pipeline stages modify their input instead of copying it, lowers peak memory
+        workers: clean the makes, and fuzzy match the blocks of make and category, in a pool of this many
+                 processes if > 1. The result does not depend on it
+        ngram_top_k: fuzzy_ngram keeps at most this many of the most similar TecDoc records per LIS record
+        ngram_threshold: fuzzy_ngram keeps only TecDoc records with at least this cosine similarity
+        year_tolerance: the model years of a match are at most this many years apart (not for 'fuzzy')
+        state_folder: save the clean records, their hashes and the links of this run here, for an incremental run
+        incremental: only clean and match the records that changed since the run saved in state_folder (see
+                     match_incrementally). Does a full run if state_folder has no state of a run with the same
+                     matching method and year tolerance. The fan-out report is not created
+    """
+    if incremental and matching_method not in state.INCREMENTAL_MATCHING_METHODS:
+        raise ValueError(
+            f"Incremental matching supports the matching methods {state.INCREMENTAL_MATCHING_METHODS}, "
+            f"not '{matching_method}'"
+        )
+    if incremental and state_folder is None:
+        raise ValueError("Incremental matching needs the state_folder of the previous run")
+    if incremental and not state.state_matches(state_folder, matching_method, year_tolerance):
+        logging.warning(
+            f"{state_folder} has no state of a run with matching method '{matching_method}' and year tolerance "
+            f"{year_tolerance}. Doing a full run instead"
+        )
+        incremental = False
+
+    with utils.copy_free_pipeline(copy_free):
+        with utils.log_peak_memory("load"):
+            if tecdoc_reference is None:
+                logging.info("Loading LIS and TecDoc records concurrently...")
+                df_lis, df_tecdoc = load.load_lis_and_tecdoc(
+                    lis_path,
+                    tecdoc_path,
+                    cache_folder=cache_folder,
+                    cache_mode=cache_mode,
+                    lis_chunksize=lis_chunksize,
+                    input_format=input_format
+                )
+                logging.info(f"Loading complete. Shape LIS: {df_lis.shape}, shape TecDoc: {df_tecdoc.shape}")
+                df_tecdoc_original, tecdoc_index = None, None
+            else:
+                logging.info("Loading LIS records...")
+                df_lis = load.load_lis(
+                    lis_path,
+                    cache_folder=cache_folder,
+                    cache_mode=cache_mode,
+                    chunksize=lis_chunksize,
+                    input_format=input_format
+                )
+                logging.info(f"Loading LIS complete. Shape: {df_lis.shape}")
+                df_tecdoc, df_tecdoc_original = reference.load_reference(tecdoc_reference)
+                tecdoc_index = reference.load_index(tecdoc_reference)
+
+        if incremental:
+            with utils.log_peak_memory("incremental match"):
+                df_lis_matched, df_lis_original, df_tecdoc_original = match_incrementally(
+                    state_folder,
+                    df_lis,
+                    df_tecdoc,
+                    how=matching_method,
+                    year_tolerance=year_tolerance,
+                    workers=workers,
+                    df_tecdoc_original=df_tecdoc_original,
+                    tecdoc_index=tecdoc_index,
+                )
+            # Only covers the records that were cleaned again
+            utils.pop_fan_out_report()
+            df_fan_out = None
+        else:
+            if tecdoc_reference is None:
+                with utils.log_peak_memory("prepare TecDoc"):
+                    df_tecdoc, df_tecdoc_original = prepare_tecdoc(df_tecdoc, workers=workers)
+
+            with utils.log_peak_memory("prepare LIS"):
+                df_lis, df_lis_original = prepare_lis(df_lis, workers=workers)
+            df_fan_out = utils.pop_fan_out_report()
+
+            if state_folder is not None:
+                # Before matching, which may modify df_lis in a copy-free pipeline
+                state.save_records(
+                    state_folder,
+                    df_lis,
+                    df_tecdoc,
+                    state.hash_records(df_lis_original, state.LIS_ID_COLUMN),
+                    state.hash_records(df_tecdoc_original, state.TECDOC_ID_COLUMN),
+                )
+
+            with utils.log_peak_memory("match"):
+                df_lis_matched = match.match_tecdoc_records_to_lis(
+                    df_lis,
+                    df_tecdoc,
+                    how=matching_method,
+                    tecdoc_index=tecdoc_index,
+                    workers=workers,
+                    ngram_top_k=ngram_top_k,
+                    ngram_threshold=ngram_threshold,
+                    year_tolerance=year_tolerance,
+                )
+
+            if state_folder is not None:
+                state.save_links(state_folder, get_links(df_lis_matched), matching_method, year_tolerance)
+
+        with utils.log_peak_memory("analyze"):
+            results = get_results(df_lis_matched, df_lis_original, df_tecdoc_original, df_fan_out)
+
+        with utils.log_peak_memory("save"):
+            save.save_results(results, output_folder, output_format=output_format, single_workbook=single_workbook)
 
     logging.info("Full matching process completed successfully.")
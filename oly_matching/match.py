@@ -1,10 +1,19 @@
 import logging
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
 import pandas as pd
-import fuzzymatcher
+from oly_matching import constants as c
+from oly_matching import ngram, utils
+from oly_matching.index import TecDocIndex
 
 MATCHING_MERGE_EXACT = ["make", "model", "type", "category", "component_code_clean"]
 MATCHING_MERGE_FUZZY = ["make", "model", "type", "category", "component_code"]
+# Records only match within the same make and category, so the fuzzy matching is done per block of these
+FUZZY_BLOCK_COLUMNS = ["make", "category"]
 
 N_CHARACTERS_TO_KEEP = {
     "model": 6,
@@ -12,21 +21,44 @@ N_CHARACTERS_TO_KEEP = {
     "component_code": 6,
 }
 
+# The matching methods of the cascade, in order: every method only sees the LIS records the previous ones left
+CASCADE_STAGES = ["exact", "cut_strings", "fuzzy"]
+
 
-def match_tecdoc_records_to_lis(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, how: str = "exact") -> pd.DataFrame:
+def match_tecdoc_records_to_lis(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    how: str = "exact",
+    tecdoc_index: TecDocIndex = None,
+    workers: int = 1,
+    ngram_top_k: int = c.NGRAM_TOP_K,
+    ngram_threshold: float = c.NGRAM_THRESHOLD,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> pd.DataFrame:
     """Tries to match every record from lis against a record from tecdoc (left join)
 
-    Assumes df_lis and df_tecdoc are already clean!
+    Assumes df_lis and df_tecdoc are already clean! The exact matching looks the LIS records up in tecdoc_index,
+    if given (it must be built from df_tecdoc), or in an index built from df_tecdoc. The fuzzy matching matches
+    its blocks in a pool of worker processes if workers > 1. The fuzzy_ngram matching keeps the ngram_top_k most
+    similar TecDoc records with a similarity of at least ngram_threshold (see match_ngram). Except for the fuzzy
+    matching, the model years of a match are at most year_tolerance apart. The cascade matching runs the methods of
+    CASCADE_STAGES in turn on the records without a match (see match_cascade).
     """
     logging.info(f"Doing matching process using {how}...")
     if how == "exact":
-        df_lis_matched = match_exactly(df_lis, df_tecdoc)
+        df_lis_matched = match_exactly(df_lis, df_tecdoc, tecdoc_index, year_tolerance=year_tolerance)
     elif how == "cut_strings":
         df_lis = cut_strings(df_lis)
         df_tecdoc = cut_strings(df_tecdoc)
-        df_lis_matched = match_exactly(df_lis, df_tecdoc)
+        df_lis_matched = match_exactly(df_lis, df_tecdoc, year_tolerance=year_tolerance)
     elif how == "fuzzy":
-        df_lis_matched = match_fuzzy(df_lis, df_tecdoc)
+        df_lis_matched = match_fuzzy(df_lis, df_tecdoc, workers=workers)
+    elif how == "cascade":
+        df_lis_matched = match_cascade(df_lis, df_tecdoc, tecdoc_index, workers=workers, year_tolerance=year_tolerance)
+    elif how == "fuzzy_ngram":
+        df_lis_matched = match_ngram(
+            df_lis, df_tecdoc, top_k=ngram_top_k, threshold=ngram_threshold, year_tolerance=year_tolerance
+        )
     else:
         logging.error(f"how = {how} is not supported!")
         sys.exit(1)
@@ -34,55 +66,144 @@ def match_tecdoc_records_to_lis(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, h
     return df_lis_matched
 
 
+def match_cascade(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    tecdoc_index: TecDocIndex = None,
+    workers: int = 1,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> pd.DataFrame:
+    """Matches with every method of CASCADE_STAGES in turn, each only on the LIS records without a match so far
+
+    The cheap exact matching goes first, so the slower stages only see the records it leaves. The stage that matched a
+    record is in match_stage, ordered like CASCADE_STAGES (missing for the records that none of the stages matched).
+    Like the cut_strings matching, the records matched by that stage have their cut model, type and engine code. All
+    stages are brought into the columns of the exact matching (see _to_layout). The records keep the order of df_lis.
+    """
+    df_lis = df_lis.assign(cascade_row=np.arange(len(df_lis)))
+    df_stages = []
+    for stage in CASCADE_STAGES:
+        start = time.perf_counter()
+        if stage == "exact":
+            df_stage = match_exactly(df_lis, df_tecdoc, tecdoc_index, year_tolerance=year_tolerance)
+        elif stage == "cut_strings":
+            # Explicit copies: in the copy-free mode cut_strings cuts in place, the fuzzy stage needs the full strings
+            df_stage = match_exactly(
+                cut_strings(df_lis.copy()), cut_strings(df_tecdoc.copy()), year_tolerance=year_tolerance
+            )
+        else:
+            df_stage = match_fuzzy(df_lis, df_tecdoc, workers=workers)
+        is_match = df_stage["in_tecdoc"].fillna(False).astype(bool).to_numpy()
+        matched_rows = df_stage.loc[is_match, "cascade_row"].unique()
+        logging.info(
+            f"Cascade stage {stage}: matched {len(matched_rows)}/{len(df_lis)} LIS records in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        df_lis = df_lis[~df_lis["cascade_row"].isin(matched_rows)]
+        is_last_stage = stage == CASCADE_STAGES[-1] or len(df_lis) == 0
+        match_stage = pd.Categorical(np.where(is_match, stage, None), categories=CASCADE_STAGES, ordered=True)
+        df_stage = df_stage.assign(match_stage=match_stage)
+        # The records without a match are passed on to the next stage, the last stage keeps them
+        df_stages.append(df_stage if is_last_stage else df_stage[is_match])
+        if is_last_stage:
+            break
+
+    columns = df_stages[0].columns
+    df_lis_matched = pd.concat([_to_layout(df_stage, columns) for df_stage in df_stages], ignore_index=True)
+    df_lis_matched = df_lis_matched.sort_values("cascade_row", kind="stable").drop(columns=["cascade_row"])
+    df_lis_matched["in_tecdoc"] = df_lis_matched["in_tecdoc"].fillna(False).astype(bool)
+    return df_lis_matched.reset_index(drop=True)
+
+
+def _to_layout(df_lis_matched: pd.DataFrame, columns: pd.Index) -> pd.DataFrame:
+    """The matched records in the given columns, e.g. fuzzy matches in those of the exact matching
+
+    The exact matching joins on the key columns, so it has them once without suffix. Other methods have the values of
+    both sides: the LIS values ({col}_lis) are taken for these. Columns that only a method has (e.g. the ids and score
+    of fuzzymatcher) are dropped.
+    """
+    renames = {f"{col}_lis": col for col in columns if col not in df_lis_matched.columns}
+    return df_lis_matched.rename(columns=renames).reindex(columns=columns)
+
+
 def cut_strings(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+    df = utils.copy_input(df)
     for col, n_characters in N_CHARACTERS_TO_KEEP.items():
         df[col] = df[col].str[:n_characters]
     return df
 
 
-def match_exactly(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
-    df_lis_matched = match_on_required_columns(df_lis, df_tecdoc)
-    df_lis_matched = keep_records_start_year_close(df_lis_matched)
+def match_exactly(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    tecdoc_index: TecDocIndex = None,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> pd.DataFrame:
+    """Left joins TecDoc to LIS on MATCHING_MERGE_EXACT, with the predicates of keep_valid_matches in the join"""
+    df_lis_matched = match_on_required_columns(df_lis, df_tecdoc, tecdoc_index, year_tolerance=year_tolerance)
+    df_lis_matched["in_tecdoc"] = df_lis_matched["in_tecdoc"].replace(to_replace=[None], value=False)
+    return df_lis_matched
+
+
+def keep_valid_matches(df_lis_matched: pd.DataFrame, year_tolerance: int = c.YEAR_TOLERANCE) -> pd.DataFrame:
+    """Drops the matches with model years too far apart or another axle configuration, marks the records without"""
+    df_lis_matched = keep_records_start_year_close(df_lis_matched, year_tolerance)
     df_lis_matched = keep_records_with_matching_axle_config(df_lis_matched)
     df_lis_matched["in_tecdoc"] = df_lis_matched["in_tecdoc"].replace(to_replace=[None], value=False)
     return df_lis_matched
 
 
-def match_on_required_columns(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
-    # Handling wildcards for Mercedes in LIS. Assumes TecDoc does NOT have any wildcards
-    df_lis_loop = df_lis.copy(deep=True)
-    df_tecdoc = df_tecdoc.copy(deep=True)
+def match_on_required_columns(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    tecdoc_index: TecDocIndex = None,
+    year_tolerance: int = None,
+) -> pd.DataFrame:
+    """Left joins TecDoc to LIS on MATCHING_MERGE_EXACT, by looking up every LIS record in a TecDocIndex
 
-    df_lis_loop["component_code_clean"] = df_lis_loop["component_code"].copy(deep=True)
-    df_tecdoc["component_code_clean"] = df_tecdoc["component_code"].copy(deep=True)
+    LIS engine codes may end with wildcards (Mercedes, e.g. 457.9xx), every trailing 'x' matches any single
+    character. Assumes TecDoc does NOT have any wildcards. The result has the columns of pd.merge with suffixes
+    _lis and _tecdoc. The records without wildcards come first, then the others by their number of wildcards.
 
-    df_matched_list = []
-    while df_lis_loop.shape[0] != 0:
-        row_ends_with_wildcard = df_lis_loop["component_code_clean"].str[-1] == "x"
-        df_lis_i = df_lis_loop[~row_ends_with_wildcard]
+    Args:
+        df_lis: clean LIS records
+        df_tecdoc: clean TecDoc records
+        tecdoc_index: index built from df_tecdoc (e.g. loaded from the TecDoc reference). Built here if None
+        year_tolerance: if given, the join only generates the matches that keep_valid_matches would keep with this
+                        tolerance (see TecDocIndex.probe). The result is the same, without the rejected matches
+    """
+    if tecdoc_index is None:
+        tecdoc_index = TecDocIndex.build(df_tecdoc)
+    lis_rows, tecdoc_rows = tecdoc_index.probe(df_lis, year_tolerance=year_tolerance)
+    key_columns = [col for col in MATCHING_MERGE_EXACT if col in df_lis.columns]
+    return join_rows(df_lis, df_tecdoc, lis_rows, tecdoc_rows, key_columns)
 
-        df_lis_matched = pd.merge(
-            left=df_lis_i,
-            right=df_tecdoc,
-            how="left",
-            on=MATCHING_MERGE_EXACT,
-            suffixes=("_lis", "_tecdoc")
-        )
-        df_matched_list.append(df_lis_matched)
 
-        df_lis_loop = df_lis_loop.drop(index=df_lis_i.index)
-        df_lis_loop["component_code_clean"] = df_lis_loop["component_code_clean"].str[:-1]
-        df_tecdoc["component_code_clean"] = df_tecdoc["component_code_clean"].str[:-1]
-    df_lis_matched = pd.concat(df_matched_list)
-    df_lis_matched = df_lis_matched.drop(columns=["component_code_clean"])
-    return df_lis_matched
+def join_rows(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    lis_rows: np.ndarray,
+    tecdoc_rows: np.ndarray,
+    key_columns: List[str],
+) -> pd.DataFrame:
+    """Puts the TecDoc record at position tecdoc_rows[i] next to the LIS record at position lis_rows[i]
+
+    A TecDoc row of -1 means no match (missing values). The key columns are kept from LIS only, the other columns
+    that are in both get suffixes _lis and _tecdoc, like pd.merge.
+    """
+    df_left = df_lis.take(lis_rows).reset_index(drop=True)
+    df_right = df_tecdoc.drop(columns=key_columns).reset_index(drop=True)
+    df_right = df_right.reindex(tecdoc_rows).reset_index(drop=True)
+    overlapping_columns = df_left.columns.intersection(df_right.columns)
+    df_left = df_left.rename(columns={col: f"{col}_lis" for col in overlapping_columns})
+    df_right = df_right.rename(columns={col: f"{col}_tecdoc" for col in overlapping_columns})
+    return pd.concat([df_left, df_right], axis=1)
 
 
-def keep_records_start_year_close(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy(deep=True)
+def keep_records_start_year_close(df: pd.DataFrame, year_tolerance: int = c.YEAR_TOLERANCE) -> pd.DataFrame:
+    df = utils.copy_input(df)
     diff_in_years = df[f"model_year_start_lis"] - df[f"model_year_start_tecdoc"]
-    ix_keep = (diff_in_years.abs() <= 2) | (diff_in_years.isnull())
+    ix_keep = (diff_in_years.abs() <= year_tolerance) | (diff_in_years.isnull())
     logging.info(f"Dropping {len(df) - ix_keep.sum()} rows because model years to far apart")
     return df[ix_keep]
 
@@ -96,16 +217,135 @@ def keep_records_with_matching_axle_config(df: pd.DataFrame) -> pd.DataFrame:
     return df[ix_keep]
 
 
-def match_fuzzy(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
-    df_lis_matched = fuzzymatcher.fuzzy_left_join(
-        df_left=df_lis,
-        df_right=df_tecdoc,
-        left_on=MATCHING_MERGE_FUZZY,
-        right_on=MATCHING_MERGE_FUZZY,
-        left_id_col="type_id",
-        right_id_col="N-Type No."
-    )
+def match_fuzzy(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """Fuzzy left joins TecDoc to LIS on MATCHING_MERGE_FUZZY, per block of make and category
+
+    A match across makes or categories is never valid, so every block of LIS records is only matched against the
+    TecDoc records of the same block, in a pool of worker processes if workers > 1. LIS records of blocks
+    without TecDoc records have no match. The records keep the order of df_lis, whatever the number of workers.
+    """
+    df_lis = df_lis.assign(lis_row=np.arange(len(df_lis)))
+    blocks = get_fuzzy_blocks(df_lis, df_tecdoc)
+    logging.info(f"Fuzzy matching {len(blocks)} blocks of make and category with {workers} worker(s)...")
+    if workers > 1 and len(blocks) > 1:
+        # Largest blocks first, so that no worker ends with a large block while the others are idle
+        order = sorted(range(len(blocks)), key=lambda i: -len(blocks[i][1]) * len(blocks[i][2]))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {i: executor.submit(_match_fuzzy_block, *blocks[i][1:]) for i in order}
+            results = [futures[i].result() for i in range(len(blocks))]
+    else:
+        results = [_match_fuzzy_block(df_lis_block, df_tecdoc_block) for _, df_lis_block, df_tecdoc_block in blocks]
+    for (key, df_lis_block, df_tecdoc_block), (_, seconds) in zip(blocks, results):
+        logging.info(
+            f"Block {key}: {len(df_lis_block)} LIS x {len(df_tecdoc_block)} TecDoc records matched in {seconds:.2f}s"
+        )
+
+    df_lis_matched = pd.concat([df_block for df_block, _ in results])
+    df_lis_matched = df_lis_matched.sort_values("lis_row", kind="stable").drop(columns=["lis_row"])
     df_lis_matched.columns = [x.replace("left", "lis").replace("right", "tecdoc") for x in df_lis_matched.columns]
     df_lis_matched = df_lis_matched.reindex(sorted(df_lis_matched.columns), axis=1)
     df_lis_matched = keep_records_with_matching_axle_config(df_lis_matched)
     return df_lis_matched
+
+
+def get_fuzzy_blocks(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> List[Tuple[tuple, pd.DataFrame, pd.DataFrame]]:
+    """Splits LIS and TecDoc into blocks of the same make and category. Returns the key, LIS and TecDoc per block"""
+    tecdoc_blocks = {
+        _get_block_key(key): df_block
+        for key, df_block in df_tecdoc.groupby(FUZZY_BLOCK_COLUMNS, dropna=False, sort=False, observed=True)
+    }
+    df_tecdoc_empty = df_tecdoc.iloc[:0]
+    return [
+        (_get_block_key(key), df_lis_block, tecdoc_blocks.get(_get_block_key(key), df_tecdoc_empty))
+        for key, df_lis_block in df_lis.groupby(FUZZY_BLOCK_COLUMNS, dropna=False, sort=True, observed=True)
+    ]
+
+
+def _get_block_key(key: tuple) -> tuple:
+    # Missing values become None, so that blocks with missing values have equal keys (NaN != NaN)
+    return tuple(None if pd.isnull(value) else value for value in key)
+
+
+def _match_fuzzy_block(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> Tuple[pd.DataFrame, float]:
+    """Fuzzy left joins a block, returns the result with fuzzymatcher's columns and the time it took"""
+    # fuzzymatcher (and its sqlite/fuzzywuzzy machinery) is slow to import and only needed here
+    import fuzzymatcher
+
+    start = time.perf_counter()
+    if len(df_tecdoc) == 0:
+        df_lis_matched = _left_join_without_matches(df_lis, df_tecdoc)
+    else:
+        df_lis_matched = fuzzymatcher.fuzzy_left_join(
+            df_left=df_lis,
+            df_right=df_tecdoc,
+            left_on=MATCHING_MERGE_FUZZY,
+            right_on=MATCHING_MERGE_FUZZY,
+            left_id_col="type_id",
+            right_id_col="N-Type No."
+        )
+    return df_lis_matched, time.perf_counter() - start
+
+
+def _left_join_without_matches(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame) -> pd.DataFrame:
+    """The columns of fuzzymatcher.fuzzy_left_join for LIS records without any TecDoc record to match"""
+    overlapping_columns = df_lis.columns.intersection(df_tecdoc.columns)
+    df_left = df_lis.rename(columns={col: f"{col}_left" for col in overlapping_columns}).reset_index(drop=True)
+    df_left["__id_left"] = df_lis["type_id"].to_numpy()
+    df_right = df_tecdoc.rename(columns={col: f"{col}_right" for col in overlapping_columns})
+    df_right = df_right.reset_index(drop=True).reindex(np.arange(len(df_lis)))
+    df_right["__id_right"] = np.nan
+    df_lis_matched = pd.concat([df_left, df_right], axis=1)
+    df_lis_matched.insert(0, "best_match_score", np.nan)
+    return df_lis_matched
+
+
+def match_ngram(
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    top_k: int = c.NGRAM_TOP_K,
+    threshold: float = c.NGRAM_THRESHOLD,
+    year_tolerance: int = c.YEAR_TOLERANCE,
+) -> pd.DataFrame:
+    """Left joins the top_k most similar TecDoc records to every LIS record, per block of make and category
+
+    The records are compared as TF-IDF vectors of the character n-grams of their MATCHING_MERGE_FUZZY fields (see
+    oly_matching.ngram), fitted on TecDoc. The cosine similarity of a match is in best_match_score, matches below
+    threshold are dropped. Like the exact matching, the matches are then filtered on the model years and the axle
+    configuration. The records keep the order of df_lis, the matches of a record are ordered by similarity.
+    """
+    tecdoc_texts = ngram.get_texts(df_tecdoc, MATCHING_MERGE_FUZZY)
+    lis_texts = ngram.get_texts(df_lis, MATCHING_MERGE_FUZZY)
+    vocabulary, idf = ngram.fit_vocabulary(tecdoc_texts)
+
+    blocks = get_fuzzy_blocks(
+        df_lis.assign(lis_row=np.arange(len(df_lis))),
+        df_tecdoc.assign(tecdoc_row=np.arange(len(df_tecdoc))),
+    )
+    logging.info(f"Matching {len(blocks)} blocks of make and category on {len(vocabulary)} character n-grams...")
+    lis_rows, tecdoc_rows, scores = [], [], []
+    for _, df_lis_block, df_tecdoc_block in blocks:
+        block_lis_rows = df_lis_block["lis_row"].to_numpy()
+        block_tecdoc_rows = df_tecdoc_block["tecdoc_row"].to_numpy()
+        lis_matrix = ngram.vectorize(lis_texts.iloc[block_lis_rows], vocabulary, idf)
+        tecdoc_matrix = ngram.vectorize(tecdoc_texts.iloc[block_tecdoc_rows], vocabulary, idf)
+        candidate_lis_rows, candidate_tecdoc_rows, candidate_scores = ngram.get_top_k_candidates(
+            lis_matrix, ngram.transpose(tecdoc_matrix, len(block_tecdoc_rows)), top_k, threshold
+        )
+        lis_rows.append(block_lis_rows[candidate_lis_rows])
+        tecdoc_rows.append(block_tecdoc_rows[candidate_tecdoc_rows])
+        scores.append(candidate_scores)
+    lis_rows = np.concatenate(lis_rows + [np.array([], dtype=np.int64)])
+    tecdoc_rows = np.concatenate(tecdoc_rows + [np.array([], dtype=np.int64)])
+    scores = np.concatenate(scores + [np.array([], dtype=float)])
+
+    # Records without candidates are kept (left join), the order within a record is the order of its candidates
+    rows_without_match = np.setdiff1d(np.arange(len(df_lis)), lis_rows)
+    lis_rows = np.concatenate([lis_rows, rows_without_match])
+    tecdoc_rows = np.concatenate([tecdoc_rows, np.full(len(rows_without_match), -1)])
+    scores = np.concatenate([scores, np.full(len(rows_without_match), np.nan)])
+    order = np.argsort(lis_rows, kind="stable")
+    logging.info(f"Found {len(lis_rows) - len(rows_without_match)} candidates with a similarity >= {threshold}")
+
+    df_lis_matched = join_rows(df_lis, df_tecdoc, lis_rows[order], tecdoc_rows[order], key_columns=[])
+    df_lis_matched.insert(0, "best_match_score", scores[order])
+    return keep_valid_matches(df_lis_matched, year_tolerance)
@@ -0,0 +1,166 @@
+import collections
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+NGRAM_SIZE = 3
+# Upper bound on the scores (and on the n-gram products) computed at once, bounds the memory of a block of rows
+MAX_SCORES_PER_ROW_BLOCK = 2 ** 22
+
+
+class SparseRows(NamedTuple):
+    """Sparse matrix in compressed sparse row format: the values of row i are at indptr[i]:indptr[i + 1]"""
+    indptr: np.ndarray
+    indices: np.ndarray
+    values: np.ndarray
+    n_columns: int
+
+
+def get_texts(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """The values of the columns of every record, separated by spaces (missing values are left out)"""
+    texts = df[columns[0]].fillna("").astype(str)
+    for col in columns[1:]:
+        texts = texts + " " + df[col].fillna("").astype(str)
+    return texts.str.strip()
+
+
+def get_ngrams(text: str) -> collections.Counter:
+    """Counts the character n-grams of a text, padded with a space on both sides"""
+    padded = f" {text} "
+    return collections.Counter(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+
+def fit_vocabulary(texts: pd.Series) -> Tuple[Dict[str, int], np.ndarray]:
+    """Numbers the n-grams of the texts, returns them with their inverse document frequency (smoothed, like sklearn)"""
+    text_ids, distinct_texts = pd.factorize(texts)
+    text_counts = np.bincount(text_ids[text_ids >= 0], minlength=len(distinct_texts))
+    document_frequency = collections.Counter()
+    for text, count in zip(distinct_texts, text_counts):
+        for ngram in get_ngrams(text):
+            document_frequency[ngram] += count
+    vocabulary = {ngram: i for i, ngram in enumerate(document_frequency)}
+    frequencies = np.array(list(document_frequency.values()), dtype=float)
+    idf = np.log((1 + len(texts)) / (1 + frequencies)) + 1
+    return vocabulary, idf
+
+
+def vectorize(texts: pd.Series, vocabulary: Dict[str, int], idf: np.ndarray) -> SparseRows:
+    """TF-IDF vectors of the texts with unit length, n-grams that are not in the vocabulary are left out
+
+    Every distinct text is vectorized once.
+    """
+    text_ids, distinct_texts = pd.factorize(texts)
+    distinct_rows = []
+    for text in distinct_texts:
+        counts = {vocabulary[ngram]: count for ngram, count in get_ngrams(text).items() if ngram in vocabulary}
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=float, count=len(counts)) * idf[indices]
+        norm = np.sqrt((values ** 2).sum())
+        distinct_rows.append((indices, values / norm if norm > 0 else values))
+    empty_row = (np.array([], dtype=np.int64), np.array([], dtype=float))
+    rows = [distinct_rows[text_id] if text_id >= 0 else empty_row for text_id in text_ids]
+    lengths = np.array([len(indices) for indices, _ in rows], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    if len(rows) == 0:
+        return SparseRows(indptr, np.array([], dtype=np.int64), np.array([], dtype=float), len(vocabulary))
+    indices = np.concatenate([indices for indices, _ in rows])
+    values = np.concatenate([values for _, values in rows])
+    return SparseRows(indptr, indices, values, len(vocabulary))
+
+
+def transpose(matrix: SparseRows, n_rows: int) -> SparseRows:
+    """The transposed matrix, so the rows that have a value in every column"""
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    order = np.argsort(matrix.indices, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(matrix.indices, minlength=matrix.n_columns))])
+    return SparseRows(indptr, rows[order], matrix.values[order], n_rows)
+
+
+def get_top_k_candidates(
+    lis_matrix: SparseRows,
+    tecdoc_matrix_transposed: SparseRows,
+    top_k: int,
+    threshold: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The top_k TecDoc rows with the highest cosine similarity (at least threshold) for every LIS row
+
+    Of TecDoc rows with the same similarity, the first ones are kept, so a LIS row has at most top_k candidates.
+
+    The similarities are computed for blocks of LIS rows at a time, as a sparse product with the (transposed)
+    TecDoc matrix, so that the dense scores of a block stay below MAX_SCORES_PER_ROW_BLOCK. Returns the LIS rows,
+    TecDoc rows and similarities of the candidates, ordered by LIS row and then by decreasing similarity (by TecDoc
+    row for equal similarities).
+    """
+    n_tecdoc = tecdoc_matrix_transposed.n_columns
+    n_lis = len(lis_matrix.indptr) - 1
+    if n_tecdoc == 0 or n_lis == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=float)
+    # The work for a LIS row: its row of scores, and a product for every TecDoc row that shares one of its n-grams
+    column_sizes = np.diff(tecdoc_matrix_transposed.indptr)
+    n_products = np.add.reduceat(
+        np.append(column_sizes[lis_matrix.indices], 0), np.minimum(lis_matrix.indptr[:-1], len(lis_matrix.indices))
+    ) * (np.diff(lis_matrix.indptr) > 0)
+
+    candidates = []
+    for start, end in _get_row_blocks(n_tecdoc + n_products, MAX_SCORES_PER_ROW_BLOCK):
+        scores = _multiply_rows(lis_matrix, tecdoc_matrix_transposed, start, end)
+        candidates.append(_get_best_scores(scores, top_k, threshold, start))
+    lis_rows, tecdoc_rows, similarities = zip(*candidates)
+    return np.concatenate(lis_rows), np.concatenate(tecdoc_rows), np.concatenate(similarities)
+
+
+def _get_row_blocks(costs: np.ndarray, max_cost: int) -> Iterator[Tuple[int, int]]:
+    """Consecutive blocks of rows with a total cost of at most max_cost (or a single row)"""
+    cumulative_costs = np.cumsum(costs)
+    start = 0
+    while start < len(costs):
+        offset = cumulative_costs[start - 1] if start > 0 else 0
+        end = max(int(np.searchsorted(cumulative_costs, offset + max_cost, side="right")), start + 1)
+        yield start, end
+        start = end
+
+
+def _multiply_rows(lis_matrix: SparseRows, tecdoc_matrix_transposed: SparseRows, start: int, end: int) -> np.ndarray:
+    """Dense cosine similarities of the LIS rows start:end with every TecDoc row"""
+    n_tecdoc = tecdoc_matrix_transposed.n_columns
+    first, last = lis_matrix.indptr[start], lis_matrix.indptr[end]
+    rows = np.repeat(np.arange(end - start), np.diff(lis_matrix.indptr[start:end + 1]))
+    ngrams = lis_matrix.indices[first:last]
+    values = lis_matrix.values[first:last]
+
+    # Every n-gram of a LIS row meets every TecDoc row that has it
+    posting_starts = tecdoc_matrix_transposed.indptr[ngrams]
+    posting_sizes = tecdoc_matrix_transposed.indptr[ngrams + 1] - posting_starts
+    n_products = int(posting_sizes.sum())
+    offsets = np.arange(n_products) - np.repeat(np.cumsum(posting_sizes) - posting_sizes, posting_sizes)
+    postings = np.repeat(posting_starts, posting_sizes) + offsets
+    tecdoc_rows = tecdoc_matrix_transposed.indices[postings]
+    products = np.repeat(values, posting_sizes) * tecdoc_matrix_transposed.values[postings]
+    scores = np.bincount(
+        np.repeat(rows, posting_sizes) * n_tecdoc + tecdoc_rows,
+        weights=products,
+        minlength=(end - start) * n_tecdoc,
+    )
+    return scores.reshape(end - start, n_tecdoc)
+
+
+def _get_best_scores(
+    scores: np.ndarray,
+    top_k: int,
+    threshold: float,
+    first_row: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The candidates of a block of rows: the top_k scores of every row, the first TecDoc rows of equal scores"""
+    n_rows, n_tecdoc = scores.shape
+    k = min(top_k, n_tecdoc)
+    kth_scores = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+    minimum_scores = np.maximum(kth_scores, threshold)
+    rows, tecdoc_rows = np.nonzero((scores >= minimum_scores[:, np.newaxis]) & (scores > 0))
+    similarities = scores[rows, tecdoc_rows]
+    order = np.lexsort((tecdoc_rows, -similarities, rows))
+    rows, tecdoc_rows, similarities = rows[order], tecdoc_rows[order], similarities[order]
+    # The scores tied with the k-th one pass the minimum too, only the first k of every row are kept
+    row_starts = np.searchsorted(rows, rows, side="left")
+    keep = np.arange(len(rows)) - row_starts < k
+    return rows[keep] + first_row, tecdoc_rows[keep], similarities[keep]
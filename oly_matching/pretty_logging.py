@@ -1,5 +1,6 @@
 import logging
 import sys
+from typing import TextIO
 
 LOGGING_FORMAT = (
     "%(asctime)s | %(levelname)-8s | Process: %(process)d | %(name)s:%("
@@ -7,15 +8,16 @@ LOGGING_FORMAT = (
 )
 
 
-def configure_logger(level: int) -> None:
+def configure_logger(level: int, stream: TextIO = sys.stdout) -> None:
     """
     Define logs level and formats.
 
     Args:
         verbose: logging level
+        stream: where to write the logs
     """
     logging.basicConfig(
-        stream=sys.stdout,
+        stream=stream,
         format=LOGGING_FORMAT,
         level=level,
     )
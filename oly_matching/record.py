@@ -0,0 +1,227 @@
+import itertools
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import constants as c
+from oly_matching import clean, extract, main, match
+from oly_matching.index import AXLE_COLUMN, CODE_COLUMN, GROUP_COLUMNS, YEAR_COLUMN, TecDocIndex
+
+# The columns of a clean LIS record that the exact matching looks at
+MATCH_COLUMNS = GROUP_COLUMNS + [CODE_COLUMN, AXLE_COLUMN, YEAR_COLUMN]
+
+AXLE_CONFIG_PATTERN = extract.compile_combined_pattern(extract.EXTRACTIONS_LIS["type"][0])
+
+# Like clean.BRANDS, on a single clean make
+BRANDS = {
+    "man": lambda make: make == "man",
+    "mercedes": lambda make: "mercedes" in make,
+}
+
+
+def _clean_whitespace(value: str) -> str:
+    return re.sub(r"\s+", " ", value).strip()
+
+
+def _lower_and_clean_whitespace(value: Optional[str]) -> Optional[str]:
+    return None if value is None else _clean_whitespace(value.lower())
+
+
+def _remove_euro_code(value: str) -> str:
+    return _clean_whitespace(re.sub(c.EURO_CODE_REGEX, "", value))
+
+
+def _remove_brackets(value: str) -> str:
+    return re.sub(clean.BRACKETS_REGEX, "", value)
+
+
+def _strip_all_special_characters(value: str) -> str:
+    return re.sub(r"\s+", "", re.sub(clean.SPECIAL_CHARACTERS_REGEX, "", value))
+
+
+def _split(value: str, delimiter: str) -> List[str]:
+    """Like utils.explode_column"""
+    return [re.sub(r"\s+", " ", part).lstrip() for part in value.split(delimiter)]
+
+
+def _extract(regex: str, value: str) -> Optional[str]:
+    """Like Series.str.extract with one group"""
+    found = re.search(regex, value)
+    return found.group(1) if found else None
+
+
+def _remove_vehicle_type_mercedes(model: str) -> str:
+    return re.sub("|".join(c.VEHICLE_TYPES_LIS), "", model)
+
+
+def _clean_type_man(model: str, type_: str) -> str:
+    if model.startswith("tg") and re.search(clean.MAN_TG_TYPE_REGEX, type_):
+        return _extract(f"({clean.MAN_TG_TYPE_REGEX})", type_)
+    return type_
+
+
+# brand -> LIS cleaning step -> rule, the rules of clean.BRAND_RULES for the values of a single record
+BRAND_RULES: Dict[str, Dict[str, Callable]] = {
+    "mercedes": {
+        "model_lis": _remove_vehicle_type_mercedes,
+        "engine_code": lambda code: _extract(extract.MERCEDES_ENGINE_CODE_REGEX, code),
+    },
+    "man": {
+        "type_lis": _clean_type_man,
+        "engine_code": lambda code: _extract(extract.MAN_ENGINE_CODE_REGEX, code),
+    },
+}
+
+
+def _get_brand(make: Optional[str]) -> str:
+    if make is not None:
+        for brand, is_brand in BRANDS.items():
+            if is_brand(make):
+                return brand
+    return clean.OTHER_BRAND
+
+
+def _get_rule(brand: str, step: str) -> Optional[Callable]:
+    return BRAND_RULES.get(brand, {}).get(step)
+
+
+def clean_lis_record(record: dict) -> List[dict]:
+    """Extracts and cleans a single raw LIS record like main.prepare_lis, with plain string operations
+
+    The pandas pipeline has a fixed cost of many milliseconds per call, which dominates the lookup of a few records.
+    This runs the same steps on the values of one record instead. Returns the clean variants of the record with the
+    MATCH_COLUMNS and its type_id, none if the record is not an engine record or misses data needed to match.
+
+    Args:
+        record: a raw LIS record that passes load.check_lis_record
+    """
+    if record.get("component_group", "Engines") not in ("Engines", None):
+        return []
+    raw_type = record["type"]
+    axle_configs = extract.find_all(extract.scan(raw_type, AXLE_CONFIG_PATTERN)["axle"])
+    axle_configs = [_lower_and_clean_whitespace(axle_config) for axle_config in axle_configs] or [None]
+
+    category = record.get("category")
+    category = _lower_and_clean_whitespace(clean.clean_category_value_lis(category) if category is not None else None)
+    make = _lower_and_clean_whitespace(record.get("make"))
+    if make is None:
+        return []
+    make = _strip_all_special_characters(_remove_brackets(make))
+    brand = _get_brand(make)
+
+    engine_codes = _clean_engine_code(_lower_and_clean_whitespace(record.get("component_code")), brand)
+    models = _clean_model(_lower_and_clean_whitespace(record["model"]), brand)
+    type_ = _lower_and_clean_whitespace(raw_type)
+    model_types = [(model, clean_type) for model in models for clean_type in _clean_type(model, type_, brand)]
+
+    year = record.get("model_year_start")
+    return [
+        {
+            "type_id": record.get("type_id"),
+            "make": make,
+            "model": model,
+            "type": clean_type,
+            "category": category,
+            "component_code": engine_code,
+            "axle_configuration": axle_config,
+            "model_year_start": np.nan if year is None else float(year),
+        }
+        for (model, clean_type), engine_code, axle_config in itertools.product(model_types, engine_codes, axle_configs)
+        if engine_code is not None
+    ]
+
+
+def _clean_engine_code(engine_code: Optional[str], brand: str) -> List[Optional[str]]:
+    """Like clean.clean_engine_code, missing engine codes stay missing"""
+    if engine_code is None:
+        return [None]
+    engine_codes = _split(_remove_euro_code(engine_code), ",")
+    rule = _get_rule(brand, "engine_code")
+    if rule is not None:
+        engine_codes = [rule(code) for code in engine_codes]
+    return [None if code is None else _strip_all_special_characters(code) for code in engine_codes]
+
+
+def _clean_model(model: str, brand: str) -> List[str]:
+    """Like clean.clean_model_column_lis"""
+    rule = _get_rule(brand, "model_lis")
+    if rule is not None:
+        model = rule(model)
+    model = _clean_whitespace(_remove_euro_code(model))
+    if model == "tgl /4":
+        model = "tgl"
+    model = _remove_brackets(model)
+    return [part for comma_part in _split(model, ",") for part in _split(comma_part, "/")]
+
+
+def _clean_type(model: str, type_: str, brand: str) -> List[str]:
+    """Like clean.clean_type_column_lis, for one clean model"""
+    type_ = type_.replace(f"{model} ", "")
+    type_ = _remove_brackets(_remove_euro_code(type_))
+    type_ = _clean_whitespace(re.sub(c.AXLE_CONFIG_REGEX, "", type_))
+    types = _expand_type(re.sub(r"\.\./", "", type_))
+    rule = _get_rule(brand, "type_lis")
+    if rule is not None:
+        types = [rule(model, expanded_type) for expanded_type in types]
+    return [_strip_all_special_characters(expanded_type) for expanded_type in types]
+
+
+def _expand_type(type_: str) -> List[str]:
+    """Like clean.expand_type_column_lis"""
+    if "," in type_:
+        base_types = (_extract(f"({clean.BASE_TYPES_REGEX})", type_) or "").split(", ")
+        stripped_type = _clean_whitespace(re.sub(clean.BASE_TYPES_REGEX, "", type_))
+        sub_type = _extract(clean.SUB_TYPE_REGEX, stripped_type) or ""
+        return [f"{base_type} {sub_type}" for base_type in base_types]
+    if re.search(clean.SLASH_SEPARATED_TYPE_REGEX, type_):
+        words = re.split(r"\s+", type_, maxsplit=2)
+        subtypes = words[1] if len(words) > 1 else ""
+        return [f"{words[0]} {subtype}" for subtype in subtypes.split("/")]
+    return [type_]
+
+
+class RecordMatcher:
+    """Matches raw LIS records one by one against clean TecDoc records, without the pandas pipeline
+
+    Everything that does not depend on the records is done once: for cut_strings the TecDoc records are cut and
+    indexed here. A call cleans the records with clean_lis_record and looks their variants up in the index, the
+    links are the same as main.match_lis_records returns.
+    """
+
+    def __init__(
+        self,
+        df_tecdoc: pd.DataFrame,
+        tecdoc_index: TecDocIndex = None,
+        how: str = "exact",
+        year_tolerance: int = c.YEAR_TOLERANCE,
+    ):
+        main.check_record_matching_method(how)
+        self.how = how
+        self.year_tolerance = year_tolerance
+        if how == "cut_strings":
+            df_tecdoc = match.cut_strings(df_tecdoc)
+            tecdoc_index = None
+        self.tecdoc_index = tecdoc_index if tecdoc_index is not None else TecDocIndex.build(df_tecdoc)
+        self.n_types = df_tecdoc["N-Type No."].to_numpy()
+
+    def match(self, records: Iterable[dict]) -> List[Tuple[object, int]]:
+        """Returns the distinct links (type_id, N-Type No.) of raw LIS records, by record and N-type
+
+        Args:
+            records: raw LIS records that pass load.check_lis_record
+        """
+        rows = [row for record in records for row in clean_lis_record(record)]
+        columns = {col: [row[col] for row in rows] for col in ["type_id"] + MATCH_COLUMNS}
+        if self.how == "cut_strings":
+            for col, n_characters in match.N_CHARACTERS_TO_KEEP.items():
+                columns[col] = [value[:n_characters] for value in columns[col]]
+        lis_rows, tecdoc_rows = self.tecdoc_index.probe(pd.DataFrame(columns), year_tolerance=self.year_tolerance)
+        is_match = tecdoc_rows >= 0
+        # Few links per call, plain python is faster than pandas here
+        row_links = sorted(zip(lis_rows[is_match].tolist(), self.n_types[tecdoc_rows[is_match]].tolist()))
+        links = (
+            (columns["type_id"][row], int(n_type)) for row, n_type in row_links if not pd.isna(n_type)
+        )
+        return list(dict.fromkeys(links))
@@ -0,0 +1,77 @@
+import datetime
+import json
+import logging
+from pathlib import Path
+from typing import Tuple
+
+import pandas as pd
+
+from oly_matching.index import TecDocIndex
+
+# Increase when the format of the reference or the TecDoc cleaning changes, so that old references are rejected
+REFERENCE_SCHEMA_VERSION = 3
+
+CLEAN_FILE_NAME = "tecdoc_clean.parquet"
+ORIGINAL_FILE_NAME = "tecdoc_original.parquet"
+METADATA_FILE_NAME = "metadata.json"
+INDEX_FOLDER_NAME = "index"
+
+
+def save_reference(
+    df_tecdoc: pd.DataFrame,
+    df_tecdoc_original: pd.DataFrame,
+    reference_folder: str,
+    source_hash: str,
+) -> None:
+    """Saves the cleaned TecDoc records, together with the original records they came from
+
+    The folder contains the two frames as parquet files, the TecDocIndex of the clean records (see load_index),
+    and a metadata file with the schema version and the content hash of the TecDoc file the reference was built from.
+    """
+    folder = Path(reference_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    df_tecdoc.to_parquet(folder / CLEAN_FILE_NAME, index=False)
+    df_tecdoc_original.to_parquet(folder / ORIGINAL_FILE_NAME)
+    TecDocIndex.build(df_tecdoc).save(folder / INDEX_FOLDER_NAME)
+    metadata = {
+        "schema_version": REFERENCE_SCHEMA_VERSION,
+        "source_hash": source_hash,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "n_records": len(df_tecdoc),
+        "n_records_original": len(df_tecdoc_original),
+    }
+    with open(folder / METADATA_FILE_NAME, "w") as f:
+        json.dump(metadata, f, indent=4)
+    logging.info(f"Saved TecDoc reference with {len(df_tecdoc)} records to {folder}")
+
+
+def load_reference(reference_folder: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Loads a reference saved with save_reference. Returns the clean and the original TecDoc records"""
+    folder = Path(reference_folder)
+    metadata = load_metadata(reference_folder)
+    if metadata["schema_version"] != REFERENCE_SCHEMA_VERSION:
+        raise ValueError(
+            f"TecDoc reference in {folder} has schema version {metadata['schema_version']}, "
+            f"but version {REFERENCE_SCHEMA_VERSION} is required. Please rebuild the reference."
+        )
+    df_tecdoc = pd.read_parquet(folder / CLEAN_FILE_NAME)
+    df_tecdoc_original = pd.read_parquet(folder / ORIGINAL_FILE_NAME)
+    logging.info(
+        f"Loaded TecDoc reference from {folder} (source hash {metadata['source_hash'][:16]}, "
+        f"created at {metadata['created_at']}). Shape: {df_tecdoc.shape}"
+    )
+    return df_tecdoc, df_tecdoc_original
+
+
+def load_index(reference_folder: str) -> TecDocIndex:
+    """Memory-maps the TecDocIndex of the clean records of a reference loaded with load_reference"""
+    return TecDocIndex.load(Path(reference_folder) / INDEX_FOLDER_NAME)
+
+
+def reference_exists(reference_folder: str) -> bool:
+    return (Path(reference_folder) / METADATA_FILE_NAME).exists()
+
+
+def load_metadata(reference_folder: str) -> dict:
+    with open(Path(reference_folder) / METADATA_FILE_NAME) as f:
+        return json.load(f)
@@ -0,0 +1,98 @@
+import datetime
+import json
+import logging
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import constants as c
+
+SINGLE_WORKBOOK_NAME = "results"
+
+
+def save_results(
+    results: Dict[str, Union[pd.DataFrame, pd.Series]],
+    output_folder: str,
+    output_format: str = "xlsx",
+    single_workbook: bool = False,
+) -> None:
+    """Saves every result under its name in the output folder
+
+    Tables are saved in output_format. The metrics (a Series) are saved as xlsx, or as json if the
+    output format is not xlsx.
+
+    Args:
+        results: name of the result -> table (DataFrame) or metrics (Series)
+        output_folder: where to store the output files
+        output_format: 'xlsx', 'csv' or 'parquet'
+        single_workbook: save all results as sheets of a single xlsx workbook instead, ignores output_format
+    """
+    if output_format not in c.OUTPUT_FORMATS:
+        raise ValueError(f"output_format = {output_format} is not supported! Choose from {c.OUTPUT_FORMATS}")
+    if single_workbook:
+        output_path = f"{output_folder}/{SINGLE_WORKBOOK_NAME}.xlsx"
+        write_excel(results, output_path)
+        logging.info(f"Saved {', '.join(results)} as sheets of {output_path}.")
+        return
+
+    for name, result in results.items():
+        output_path = save_result(result, output_folder, name, output_format)
+        logging.info(f"Saved {name} to {output_path}.")
+
+
+def save_result(result: Union[pd.DataFrame, pd.Series], output_folder: str, name: str, output_format: str) -> str:
+    """Saves a single result, returns the path it was saved to"""
+    if isinstance(result, pd.Series) and output_format != "xlsx":
+        output_path = f"{output_folder}/{name}.json"
+        with open(output_path, "w") as f:
+            json.dump({key: _to_python_value(value) for key, value in result.items()}, f, indent=4)
+        return output_path
+
+    output_path = f"{output_folder}/{name}.{output_format}"
+    if output_format == "xlsx":
+        write_excel({name: result}, output_path)
+    elif output_format == "csv":
+        result.to_csv(output_path, index=False)
+    else:
+        result.to_parquet(output_path, index=False)
+    return output_path
+
+
+def write_excel(sheets: Dict[str, Union[pd.DataFrame, pd.Series]], path: str) -> None:
+    """Writes every frame to its own sheet, streaming the rows with the write-only openpyxl workbook
+
+    Unlike DataFrame.to_excel, the rows are written one by one instead of building all cells in memory first.
+    Frames are written without index, Series with their index as first column (like Series.to_excel).
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for name, df in sheets.items():
+        worksheet = workbook.create_sheet(title=name)
+        if isinstance(df, pd.Series):
+            worksheet.append([None, df.name])
+            rows = df.items()
+        else:
+            worksheet.append(list(df.columns))
+            rows = df.itertuples(index=False, name=None)
+        for row in rows:
+            worksheet.append([_to_python_value(value) for value in row])
+    workbook.save(path)
+
+
+def _to_python_value(value: object) -> object:
+    """Converts a value to a python type, the same way pandas does before writing it to excel"""
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, (str, datetime.date, datetime.datetime, datetime.time, datetime.timedelta)):
+        return value
+    return str(value)
@@ -0,0 +1,207 @@
+import collections
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from oly_matching import constants as c
+from oly_matching import load, main
+from oly_matching.index import TecDocIndex
+from oly_matching.record import RecordMatcher
+
+LOOKUP_PATH = "/lookup"
+HEALTH_PATH = "/health"
+
+# The fields of a raw LIS record that the matching depends on, type_id only identifies the record
+RECORD_FIELDS = [col for col in c.LIS_LOAD_COLUMNS if col != "type_id"]
+
+
+class LookupService:
+    """Matches raw LIS records against clean TecDoc records that are loaded once
+
+    The records are cleaned and matched one by one by a RecordMatcher, which is built once (for cut_strings, the cut
+    TecDoc records and their index too). The N-types of every distinct record are kept in a least recently used
+    cache of cache_size records.
+    """
+
+    def __init__(
+        self,
+        df_tecdoc: pd.DataFrame,
+        tecdoc_index: TecDocIndex,
+        how: str = "exact",
+        cache_size: int = 10000,
+        year_tolerance: int = c.YEAR_TOLERANCE,
+    ):
+        self.matcher = RecordMatcher(df_tecdoc, tecdoc_index, how=how, year_tolerance=year_tolerance)
+        self.df_tecdoc = df_tecdoc
+        self.how = how
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def lookup(self, records: List[dict]) -> List[dict]:
+        """Returns the N-types of every raw LIS record, in the order of the records
+
+        An invalid record (see load.check_lis_record) gets an error instead, and is not matched with the others.
+        """
+        keys, errors = [], {}
+        for position, record in enumerate(records):
+            try:
+                keys.append(_get_record_key(record))
+            except ValueError as e:
+                keys.append(None)
+                errors[position] = str(e)
+        missing_keys = list(dict.fromkeys(key for key in keys if key is not None and key not in self._cache))
+        if missing_keys:
+            self._add_to_cache(missing_keys, self._match(missing_keys))
+
+        results = []
+        for position, (record, key) in enumerate(zip(records, keys)):
+            type_id = record.get("type_id") if isinstance(record, dict) else None
+            if key is None:
+                results.append({"type_id": type_id, "error": errors[position]})
+                continue
+            self._cache.move_to_end(key)
+            results.append({"type_id": type_id, "n_types": self._cache[key]})
+        self._evict()
+        return results
+
+    def warm(self, df_lis: pd.DataFrame) -> None:
+        """Looks up loaded LIS records in one batch, so that lookups of these records are served from the cache"""
+        records = json.loads(df_lis.to_json(orient="records"))
+        self.lookup(records)
+        logging.info(f"Cached the N-types of {len(self._cache)} distinct LIS records")
+
+    def _match(self, keys: List[str]) -> Dict[int, List[int]]:
+        """Matches the distinct records, returns the N-types per position in keys"""
+        records = [dict(zip(RECORD_FIELDS, json.loads(key)), type_id=position) for position, key in enumerate(keys)]
+        n_types = collections.defaultdict(list)
+        for position, n_type in self.matcher.match(records):
+            n_types[position].append(n_type)
+        return dict(n_types)
+
+    def _add_to_cache(self, keys: List[str], n_types: Dict[int, List[int]]) -> None:
+        for position, key in enumerate(keys):
+            self._cache[key] = n_types.get(position, [])
+
+    def _evict(self) -> None:
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+def _get_record_key(record: dict) -> str:
+    """The fields of a record that the matching depends on, as a hashable string. Raises a ValueError if invalid"""
+    load.check_lis_record(record)
+    return json.dumps([record.get(field) for field in RECORD_FIELDS])
+
+
+def parse_lookup_request(body: bytes) -> Tuple[List[dict], bool]:
+    """Returns the records of a lookup request, and whether it was a batch
+
+    A request is a single record (a json object), or a batch: a list of records or {"records": [...]}.
+    """
+    content = json.loads(body)
+    if isinstance(content, dict) and "records" in content:
+        content = content["records"]
+    if isinstance(content, list):
+        return content, True
+    return [content], False
+
+
+def make_handler(service: LookupService) -> type:
+    class LookupHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != HEALTH_PATH:
+                self._respond(404, {"error": f"Unknown path {self.path}"})
+                return
+            self._respond(200, {"status": "ok", "n_tecdoc_records": len(service.df_tecdoc), "how": service.how})
+
+        def do_POST(self) -> None:
+            if self.path != LOOKUP_PATH:
+                self._respond(404, {"error": f"Unknown path {self.path}"})
+                return
+            start = time.perf_counter()
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                records, is_batch = parse_lookup_request(body)
+            except ValueError as e:  # invalid Content-Length or json
+                self._respond(400, {"error": str(e)})
+                return
+            try:
+                # Invalid records get an error in their result, anything raised here is our failure
+                results = service.lookup(records)
+            except Exception as e:
+                logging.exception(f"Lookup of {self.path} failed")
+                self._respond(500, {"error": f"Lookup failed: {e!r}"})
+                return
+            if not is_batch and "error" in results[0]:
+                self._respond(400, results[0])
+                return
+            self._respond(200, {"results": results} if is_batch else results[0])
+            logging.debug(f"Looked up {len(records)} records in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        def _respond(self, status: int, content: dict) -> None:
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            logging.debug(format % args)
+
+    return LookupHandler
+
+
+def serve(
+    reference_folder: str,
+    tecdoc_path: str,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    how: str = "exact",
+    year_tolerance: int = c.YEAR_TOLERANCE,
+    cache_size: int = 10000,
+    input_format: str = "auto",
+    workers: int = 1,
+    warm_lis_path: str = None,
+) -> None:
+    """Loads the TecDoc reference once (built first if missing) and serves lookups of raw LIS records over HTTP
+
+    POST /lookup with a raw LIS record (the columns of the LIS file) returns its N-types, after the same
+    extraction, cleaning and matching as 'olyslager match', including the year and axle configuration filters.
+    POST a list of records (or {"records": [...]}) to look up a batch. GET /health checks the service. An invalid
+    record gets a 400 response naming its missing or invalid fields, or an error in its result in a batch.
+
+    Args:
+        reference_folder: folder of the TecDoc reference (see main.build_reference)
+        tecdoc_path: TecDoc file to build the reference from if it is missing
+        host: address to listen on
+        port: port to listen on
+        how: 'exact' or 'cut_strings'
+        year_tolerance: the model years of a match are at most this many years apart
+        cache_size: number of distinct records whose N-types are cached
+        input_format: format of the TecDoc and LIS files (see main.build_reference)
+        workers: clean TecDoc in a pool of this many processes when building the reference
+        warm_lis_path: if given, the records of this LIS file are matched at startup and cached
+    """
+    df_tecdoc, tecdoc_index = main.load_or_build_reference(
+        reference_folder,
+        tecdoc_path,
+        cache_folder=None,
+        input_format=input_format,
+        workers=workers,
+    )
+    service = LookupService(df_tecdoc, tecdoc_index, how=how, cache_size=cache_size, year_tolerance=year_tolerance)
+    if warm_lis_path is not None:
+        service.warm(load.load_lis(warm_lis_path, cache_folder=None, input_format=input_format))
+    server = HTTPServer((host, port), make_handler(service))
+    logging.info(f"Serving lookups on http://{host}:{server.server_port}{LOOKUP_PATH} (matching method: {how})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
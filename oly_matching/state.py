@@ -0,0 +1,128 @@
+import datetime
+import json
+import logging
+from pathlib import Path
+from typing import NamedTuple, Tuple
+
+import pandas as pd
+
+# Increase when the format of the state or the cleaning changes, so that an old state is not used
+STATE_SCHEMA_VERSION = 1
+
+LIS_CLEAN_FILE_NAME = "lis_clean.parquet"
+TECDOC_CLEAN_FILE_NAME = "tecdoc_clean.parquet"
+LIS_HASHES_FILE_NAME = "lis_hashes.parquet"
+TECDOC_HASHES_FILE_NAME = "tecdoc_hashes.parquet"
+LINKS_FILE_NAME = "links.parquet"
+METADATA_FILE_NAME = "metadata.json"
+
+# The records are compared per LIS type and per N-type
+LIS_ID_COLUMN = "type_id"
+TECDOC_ID_COLUMN = "N-Type No."
+# Every link only depends on the LIS and TecDoc records it links, which is what incremental matching relies on
+INCREMENTAL_MATCHING_METHODS = ("exact", "cut_strings")
+
+
+class MatchingState(NamedTuple):
+    """What a run leaves for the next incremental run: the clean records, their hashes and the links"""
+    df_lis: pd.DataFrame
+    df_tecdoc: pd.DataFrame
+    lis_hashes: pd.Series
+    tecdoc_hashes: pd.Series
+    df_links: pd.DataFrame
+
+
+def hash_records(df: pd.DataFrame, id_col: str) -> pd.Series:
+    """A hash of the records of every id (e.g. all rows of a type_id), which changes if any of them changes
+
+    The row hashes are summed, so the order of the rows does not matter.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return row_hashes.groupby(df[id_col].to_numpy()).sum().rename("hash")
+
+
+def get_changed_ids(old_hashes: pd.Series, new_hashes: pd.Series) -> Tuple[pd.Index, pd.Index]:
+    """The ids that are new or whose records changed, and the ids that were deleted"""
+    old_hashes_aligned = old_hashes.reindex(new_hashes.index)
+    changed_ids = new_hashes.index[old_hashes_aligned.isnull() | (old_hashes_aligned != new_hashes)]
+    deleted_ids = old_hashes.index.difference(new_hashes.index)
+    return changed_ids, deleted_ids
+
+
+def keep_unchanged_links(
+    df_links: pd.DataFrame,
+    lis_ids: pd.Index,
+    tecdoc_ids: pd.Index,
+) -> pd.DataFrame:
+    """Drops the links that touch any of the (changed or deleted) LIS or TecDoc ids"""
+    is_unchanged = ~df_links[LIS_ID_COLUMN].isin(lis_ids) & ~df_links[TECDOC_ID_COLUMN].isin(tecdoc_ids)
+    return df_links[is_unchanged]
+
+
+def state_matches(state_folder: str, how: str, year_tolerance: int) -> bool:
+    """Whether the folder has a state of the current schema, saved by a run with the same matching settings"""
+    path = Path(state_folder) / METADATA_FILE_NAME
+    if not path.exists():
+        return False
+    with open(path) as f:
+        metadata = json.load(f)
+    return (
+        metadata["schema_version"] == STATE_SCHEMA_VERSION
+        and metadata["matching_method"] == how
+        and metadata["year_tolerance"] == year_tolerance
+    )
+
+
+def save_records(
+    state_folder: str,
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    lis_hashes: pd.Series,
+    tecdoc_hashes: pd.Series,
+) -> None:
+    """Saves the clean records of a run and the hashes of their original records, as parquet files
+
+    Removes the metadata of the previous state first, the state is only complete after save_links.
+    """
+    folder = Path(state_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    metadata_path = folder / METADATA_FILE_NAME
+    if metadata_path.exists():
+        metadata_path.unlink()
+    df_lis.to_parquet(folder / LIS_CLEAN_FILE_NAME, index=False)
+    df_tecdoc.to_parquet(folder / TECDOC_CLEAN_FILE_NAME, index=False)
+    lis_hashes.to_frame().to_parquet(folder / LIS_HASHES_FILE_NAME)
+    tecdoc_hashes.to_frame().to_parquet(folder / TECDOC_HASHES_FILE_NAME)
+
+
+def save_links(state_folder: str, df_links: pd.DataFrame, how: str, year_tolerance: int) -> None:
+    """Saves the links of a run and the metadata of the state, after save_records"""
+    folder = Path(state_folder)
+    df_links.to_parquet(folder / LINKS_FILE_NAME, index=False)
+    metadata = {
+        "schema_version": STATE_SCHEMA_VERSION,
+        "matching_method": how,
+        "year_tolerance": year_tolerance,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "n_links": len(df_links),
+    }
+    with open(folder / METADATA_FILE_NAME, "w") as f:
+        json.dump(metadata, f, indent=4)
+    logging.info(f"Saved the state of this run with {len(df_links)} links to {folder}")
+
+
+def load_state(state_folder: str) -> MatchingState:
+    """Loads a state saved with save_records and save_links"""
+    folder = Path(state_folder)
+    state = MatchingState(
+        df_lis=pd.read_parquet(folder / LIS_CLEAN_FILE_NAME),
+        df_tecdoc=pd.read_parquet(folder / TECDOC_CLEAN_FILE_NAME),
+        lis_hashes=pd.read_parquet(folder / LIS_HASHES_FILE_NAME)["hash"],
+        tecdoc_hashes=pd.read_parquet(folder / TECDOC_HASHES_FILE_NAME)["hash"],
+        df_links=pd.read_parquet(folder / LINKS_FILE_NAME),
+    )
+    logging.info(
+        f"Loaded the state of the previous run from {folder}: {len(state.lis_hashes)} LIS types, "
+        f"{len(state.tecdoc_hashes)} N-types, {len(state.df_links)} links"
+    )
+    return state
@@ -1,5 +1,32 @@
-import pandas as pd
+import contextlib
+import functools
 import logging
+import sys
+import time
+from typing import Callable, Dict, Iterator, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Result of an element-wise function: a Series, or a frame with one row per value
+PerValueResult = Union[pd.Series, pd.DataFrame]
+
+# In the copy-free pipeline mode, the stages own their input frame and modify it instead of copying it first
+_PIPELINE_MODE = {"copy_inputs": True}
+
+# Counts how many values were cleaned by per_unique_value, and how many distinct values that took
+_UNIQUE_VALUE_STATS = {"depth": 0, "n_values": 0, "n_unique_values": 0}
+
+# Fan-out of every variant table joined by join_variants, see pop_fan_out_report
+_FAN_OUT = []
+FAN_OUT_COLUMNS = [
+    "table", "column", "n_row_ids", "n_variants", "max_variants_per_row_id", "n_rows_before", "n_rows_after"
+]
 
 
 def explode_column(df: pd.DataFrame, col: str, delimiter: str = ",") -> pd.DataFrame:
@@ -14,3 +41,192 @@ def explode_column(df: pd.DataFrame, col: str, delimiter: str = ",") -> pd.DataF
     )
     logging.info(f"Added {len(df) - n_records} records with {col}, now df has {len(df)} records")
     return df
+
+
+def join_variants(df: pd.DataFrame, variants: Dict[str, pd.Series], table: str) -> pd.DataFrame:
+    """Cross joins narrow variant tables into the frame, on the row id (the index)
+
+    A variant table holds the values of one multi-valued column: a Series with one row per variant, indexed by
+    the row id of the record it belongs to (like Series.explode returns). Cleaning variant tables instead of
+    exploding the columns in the frame keeps all other columns from being repeated for every variant.
+    The variants of a row end up next to each other, in the order of the variant table.
+
+    Args:
+        df: the frame without the variant columns, indexed by row id (rows may share a row id)
+        variants: column -> variant table, joined in this order
+        table: name of the frame in the fan-out report (see pop_fan_out_report)
+    """
+    for col, variant_series in variants.items():
+        n_rows = len(df)
+        variants_per_row_id = variant_series.index.value_counts()
+        df = df.join(variant_series.rename(col), how="left")
+        _FAN_OUT.append({
+            "table": table,
+            "column": col,
+            "n_row_ids": len(variants_per_row_id),
+            "n_variants": len(variant_series),
+            "max_variants_per_row_id": variants_per_row_id.max() if len(variants_per_row_id) > 0 else 0,
+            "n_rows_before": n_rows,
+            "n_rows_after": len(df),
+        })
+        logging.info(f"Joined {len(variant_series)} variants of {col} into {table}: {n_rows} -> {len(df)} records")
+    return df
+
+
+def pop_fan_out_report() -> pd.DataFrame:
+    """Returns the fan-out of the variant tables joined since the last call (one row per join), and resets it"""
+    report = pd.DataFrame(_FAN_OUT, columns=FAN_OUT_COLUMNS)
+    _FAN_OUT.clear()
+    return report
+
+
+def per_unique_value(function: Callable[..., PerValueResult]) -> Callable[..., PerValueResult]:
+    """Decorator for element-wise Series -> Series functions, which then run once per distinct value
+
+    The function may also return a frame, with one row per value.
+
+    The string columns we clean have few distinct values compared to the number of rows, so this makes the
+    cleaning cost scale with the distinct values. Decorated functions calling each other only deduplicate once.
+    """
+    @functools.wraps(function)
+    def wrapper(series: pd.Series, *args, **kwargs) -> PerValueResult:
+        if _UNIQUE_VALUE_STATS["depth"] > 0:
+            return function(series, *args, **kwargs)
+        _UNIQUE_VALUE_STATS["depth"] += 1
+        try:
+            return apply_per_unique_value(series, lambda x: function(x, *args, **kwargs))
+        finally:
+            _UNIQUE_VALUE_STATS["depth"] -= 1
+    return wrapper
+
+
+def apply_per_unique_value(series: pd.Series, function: Callable[[pd.Series], PerValueResult]) -> PerValueResult:
+    """Applies an element-wise function to the distinct values of the series, and maps the results back"""
+    codes, uniques = pd.factorize(series)
+    unique_series = pd.Series(uniques, dtype=series.dtype, name=series.name)
+
+    # Missing values get code -1, we give them the position of one (original) missing value instead
+    is_missing = codes == -1
+    if is_missing.any():
+        unique_series = pd.concat([unique_series, series[is_missing].iloc[:1]], ignore_index=True)
+        codes = np.where(is_missing, len(unique_series) - 1, codes)
+
+    clean_series = function(unique_series).take(codes)
+    clean_series.index = series.index
+
+    _UNIQUE_VALUE_STATS["n_values"] += len(series)
+    _UNIQUE_VALUE_STATS["n_unique_values"] += len(unique_series)
+    return clean_series
+
+
+def log_unique_value_stats() -> None:
+    """Logs the dedup ratio achieved by per_unique_value since the last call, and resets the counts"""
+    n_values = _UNIQUE_VALUE_STATS["n_values"]
+    n_unique_values = _UNIQUE_VALUE_STATS["n_unique_values"]
+    if n_unique_values > 0:
+        logging.info(
+            f"Cleaned {n_values} values by cleaning {n_unique_values} distinct values "
+            f"(dedup ratio {n_values / n_unique_values:.1f})"
+        )
+    _UNIQUE_VALUE_STATS["n_values"] = 0
+    _UNIQUE_VALUE_STATS["n_unique_values"] = 0
+
+
+def copy_input(df: pd.DataFrame) -> pd.DataFrame:
+    """Defensive copy of the input of a pipeline stage, skipped in the copy-free mode (see copy_free_pipeline)"""
+    if _PIPELINE_MODE["copy_inputs"]:
+        return df.copy(deep=True)
+    return df
+
+
+@contextlib.contextmanager
+def copy_free_pipeline(enabled: bool = True) -> Iterator[None]:
+    """Within this context, the stages in clean, extract and match may modify the frames passed to them
+
+    Only use this when the caller does not use a frame anymore after passing it to a stage.
+    """
+    copy_inputs = _PIPELINE_MODE["copy_inputs"]
+    _PIPELINE_MODE["copy_inputs"] = not enabled
+    try:
+        yield
+    finally:
+        _PIPELINE_MODE["copy_inputs"] = copy_inputs
+
+
+@contextlib.contextmanager
+def quiet_pipeline_logs() -> Iterator[None]:
+    """Within this context, only warnings and errors are logged
+
+    The pipeline logs every step, which is too much when it runs for every lookup.
+    """
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    root_logger.setLevel(max(level, logging.WARNING))
+    try:
+        yield
+    finally:
+        root_logger.setLevel(level)
+
+
+@contextlib.contextmanager
+def log_peak_memory(stage: str) -> Iterator[None]:
+    """Logs the duration and the peak resident memory (RSS) of the process during the stage
+
+    On Linux the peak is reset at the start of the stage. Elsewhere, the peak since the start of the process is
+    logged instead. The peak of the parent process leaves out the worker processes of a pool (loading, cleaning and
+    fuzzy matching with workers), so the peak of the largest worker process is logged too if workers finished during
+    the stage. The operating system only keeps the largest peak of all finished workers, so if an earlier worker
+    was larger, that peak is logged as an upper bound.
+    """
+    is_reset = _reset_peak_rss()
+    children_usage_before = _get_children_usage()
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    peak_rss = _get_peak_rss()
+    if peak_rss is None:
+        logging.info(f"Stage '{stage}' took {seconds:.1f}s")
+        return
+    since = "during stage" if is_reset else "since start"
+    message = f"Stage '{stage}' took {seconds:.1f}s, peak RSS {since}: {peak_rss / 1024 ** 2:.0f} MB (parent process)"
+    children_usage = _get_children_usage()
+    if children_usage is not None and children_usage != children_usage_before:
+        children_peak_rss = _to_bytes(children_usage.ru_maxrss)
+        bound = "" if children_usage.ru_maxrss > children_usage_before.ru_maxrss else "at most "
+        message += f", largest worker process: {bound}{children_peak_rss / 1024 ** 2:.0f} MB"
+    logging.info(message)
+
+
+def _reset_peak_rss() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _get_peak_rss() -> Union[int, None]:
+    """Peak RSS in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    return _to_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _get_children_usage() -> Union["resource.struct_rusage", None]:
+    """Resource usage of all child processes that finished so far, ru_maxrss is that of the largest one"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _to_bytes(max_rss: int) -> int:
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
@@ -0,0 +1,132 @@
+import random
+from pathlib import Path
+from typing import Tuple
+
+import pandas as pd
+import pytest
+
+from oly_matching import constants as c
+from oly_matching import load, main
+from oly_matching.index import TecDocIndex
+
+MAKES = ["Mercedes-Benz", "MAN", "DAF (EU)", "Scania"]
+MODELS = {
+    "Mercedes-Benz": ["Actros MP2 / MP3", "Atego, Axor", "Arocs Euro 6"],
+    "MAN": ["TGX", "TGS", "F 2000 Evolution"],
+    "DAF (EU)": ["XF 105", "CF 85"],
+    "Scania": ["R-series", "P/G/R"],
+}
+TYPES = {
+    "Mercedes-Benz": ["{model} 1840 LS 4x2", "1844, 1846 LS 4x2", "2040/2640 6x4"],
+    "MAN": ["{model} 18.440 4x2 BLS", "18.400, 18.440 FLS", "26.480 6x2-2 LL"],
+    "DAF (EU)": ["{model} FT 4x2", "FAR 6x2"],
+    "Scania": ["R 420 LA 4x2", "P 230, P 280"],
+}
+ENGINE_CODES = {
+    "Mercedes-Benz": ["OM 501.920", "541.9xx", "OM 906.9xx, OM 926.9XX"],
+    "MAN": ["D 2066 LF 31 Euro 5", "D2676LF05", "D 2868 LF 02"],
+    "DAF (EU)": ["MX-300", "PR 228 S2"],
+    "Scania": ["DC12 14", "DC9 17"],
+}
+LIS_CATEGORIES = ["Trucks and Buses (> 7.5t) - EU", "Trucks and Buses (> 7.5t) (USA)"]
+TECDOC_CATEGORIES = ["TecDoc CV", "TecDoc Bus", "TecDoc Tractor"]
+
+
+def make_raw_lis(n_records: int, seed: int = 0) -> pd.DataFrame:
+    """Raw LIS records like the export, two records (e.g. an engine and a gearbox) per type_id"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(n_records):
+        make = rng.choice(MAKES)
+        model = rng.choice(MODELS[make])
+        year = rng.randint(2000, 2015)
+        records.append({
+            "type_id": 100000 + i // 2,
+            "make": make,
+            "model": model,
+            "type": rng.choice(TYPES[make]).format(model=model),
+            "category": rng.choice(LIS_CATEGORIES),
+            "model_year_start": year if rng.random() > 0.1 else None,
+            "model_year_end": year + rng.randint(0, 8),
+            "component_code": rng.choice(ENGINE_CODES[make]) if rng.random() > 0.05 else None,
+            "component_group": "Engines" if rng.random() > 0.2 else "Transmission",
+        })
+    return pd.DataFrame(records)
+
+
+def make_raw_tecdoc(n_records: int, seed: int = 0) -> pd.DataFrame:
+    """Raw TecDoc records like the export, with the engine codes and models spelled the TecDoc way"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(n_records):
+        make = rng.choice(MAKES)
+        model = rng.choice(MODELS[make])
+        year = rng.randint(2000, 2015)
+        records.append({
+            "N-Type No.": 5000 + i,
+            "Manufacturer": make.upper() if rng.random() < 0.3 else make,
+            "Model Series": model,
+            "Type": rng.choice(TYPES[make]).format(model=model).replace("4x2 ", ""),
+            "LnkTargetType": rng.choice(TECDOC_CATEGORIES),
+            "Model Year from": pd.Timestamp(year, rng.randint(1, 12), 1),
+            "Model Year to": pd.Timestamp(year + 5, 1, 1) if rng.random() > 0.2 else pd.NaT,
+            "Engine Codes": rng.choice(ENGINE_CODES[make]).replace("x", "0").replace("X", "1"),
+            "Axle Configuration": rng.choice(["4x2", "6x2", "6x4"]),
+        })
+    return pd.DataFrame(records)
+
+
+@pytest.fixture
+def raw_exports() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return make_raw_lis(600), make_raw_tecdoc(600)
+
+
+@pytest.fixture(scope="session")
+def clean_records() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """The generated exports, loaded and cleaned like 'olyslager match' does. Don't modify them"""
+    df_lis, _ = main.prepare_lis(load.apply_dtypes(make_raw_lis(600), c.LIS_DTYPES))
+    df_tecdoc, _ = main.prepare_tecdoc(load.apply_dtypes(make_raw_tecdoc(600), c.TECDOC_DTYPES))
+    return df_lis, df_tecdoc
+
+
+@pytest.fixture(scope="session")
+def reference(clean_records) -> Tuple[pd.DataFrame, TecDocIndex]:
+    """The clean generated TecDoc records and their index, like a loaded TecDoc reference"""
+    df_tecdoc = clean_records[1]
+    return df_tecdoc, TecDocIndex.build(df_tecdoc)
+
+
+def run(
+    folder: Path,
+    df_lis: pd.DataFrame,
+    df_tecdoc: pd.DataFrame,
+    output_name: str,
+    matching_method: str = "exact",
+    input_format: str = "parquet",
+    **kwargs,
+) -> Path:
+    """Runs the matching on the exports saved as input_format (parquet, csv or xlsx), returns the results folder"""
+    paths = {"lis": folder / f"lis.{input_format}", "tecdoc": folder / f"tecdoc.{input_format}"}
+    for name, df in (("lis", df_lis), ("tecdoc", df_tecdoc)):
+        if input_format == "parquet":
+            df.to_parquet(paths[name], index=False)
+        elif input_format == "csv":
+            df.to_csv(paths[name], index=False)
+        else:
+            df.to_excel(paths[name], index=False)
+    output_folder = folder / output_name
+    output_folder.mkdir()
+    main.main(
+        lis_path=str(paths["lis"]),
+        tecdoc_path=str(paths["tecdoc"]),
+        output_folder=str(output_folder),
+        matching_method=matching_method,
+        output_format="csv",
+        **kwargs,
+    )
+    return output_folder
+
+
+def read_results(output_folder: Path) -> dict:
+    """The text of every result file, except the fan-out report (which an incremental run does not create)"""
+    return {path.name: path.read_text() for path in sorted(output_folder.iterdir()) if path.name != "fan_out.csv"}
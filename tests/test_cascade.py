@@ -0,0 +1,61 @@
+from typing import Set
+
+import numpy as np
+import pandas as pd
+
+from oly_matching import match, utils
+from tests.conftest import read_results, run
+
+
+def _matched_records(df_lis_matched: pd.DataFrame) -> Set[int]:
+    return set(df_lis_matched.loc[df_lis_matched["in_tecdoc"].astype(bool), "record"])
+
+
+def test_cascade_stages_only_match_the_records_left_by_the_previous_ones(clean_records):
+    df_lis, df_tecdoc = clean_records
+    df_lis = df_lis.assign(record=np.arange(len(df_lis)))
+
+    df_matched = match.match_cascade(df_lis, df_tecdoc)
+
+    stage_records = {
+        stage: set(df_matched.loc[df_matched["match_stage"] == stage, "record"]) for stage in match.CASCADE_STAGES
+    }
+    exact_records = _matched_records(match.match_exactly(df_lis, df_tecdoc))
+    df_lis_left = df_lis[~df_lis["record"].isin(exact_records)]
+    cut_records = _matched_records(
+        match.match_exactly(match.cut_strings(df_lis_left.copy()), match.cut_strings(df_tecdoc.copy()))
+    )
+    assert exact_records and stage_records["exact"] == exact_records
+    assert cut_records and stage_records["cut_strings"] == cut_records
+    assert stage_records["fuzzy"] and stage_records["fuzzy"].isdisjoint(exact_records | cut_records)
+    # In the order of df_lis and in the columns of the exact matching
+    assert df_matched["record"].is_monotonic_increasing
+    assert not df_matched.loc[df_matched["match_stage"].isnull(), "in_tecdoc"].any()
+    assert list(df_matched.columns) == list(match.match_exactly(df_lis, df_tecdoc).columns) + ["match_stage"]
+
+
+def test_cascade_does_not_modify_its_input_in_the_copy_free_mode(clean_records):
+    df_lis, df_tecdoc = clean_records
+    df_expected = match.match_cascade(df_lis, df_tecdoc)
+
+    df_lis_copy, df_tecdoc_copy = df_lis.copy(), df_tecdoc.copy()
+    with utils.copy_free_pipeline():
+        df_matched = match.match_cascade(df_lis_copy, df_tecdoc_copy)
+
+    pd.testing.assert_frame_equal(df_matched, df_expected)
+    pd.testing.assert_frame_equal(df_tecdoc_copy, df_tecdoc)
+
+
+def test_cascade_links_have_the_stage_that_found_them(tmp_path, raw_exports):
+    cascade_folder = run(tmp_path, *raw_exports, "cascade", matching_method="cascade")
+    exact_folder = run(tmp_path, *raw_exports, "exact", matching_method="exact")
+    copy_free_folder = run(tmp_path, *raw_exports, "copy_free", matching_method="cascade", copy_free=True)
+
+    df_links = pd.read_csv(cascade_folder / "links_with_original_data.csv")
+    df_exact_links = pd.read_csv(exact_folder / "links_with_original_data.csv")
+    assert set(df_links["match_stage"]) == set(match.CASCADE_STAGES)
+    is_exact = df_links["match_stage"] == "exact"
+    pd.testing.assert_frame_equal(
+        df_links.loc[is_exact, df_exact_links.columns].reset_index(drop=True), df_exact_links
+    )
+    assert read_results(copy_free_folder) == read_results(cascade_folder)
@@ -0,0 +1,126 @@
+import pandas as pd
+import pytest
+
+from oly_matching import constants as c
+from oly_matching import clean, load, main, utils
+from tests.conftest import make_raw_lis, make_raw_tecdoc, read_results, run
+
+RECORD = {
+    "type_id": 1,
+    "make": "Mercedes-Benz",
+    "model": "Actros",
+    "type": "Actros 1844, 1846 LS 4x2 6x2",
+    "category": "Trucks and Buses (> 7.5t) - EU",
+    "component_code": "OM 501.920, OM 502.920",
+    "model_year_start": 2005,
+}
+
+
+def test_clean_lis_joins_every_type_with_every_engine_code_and_axle_configuration():
+    utils.pop_fan_out_report()
+
+    df_lis, _ = main.prepare_lis(load.load_lis_records([RECORD]))
+
+    variants = list(zip(df_lis["type"], df_lis["component_code"], df_lis["axle_configuration"]))
+    assert variants == [
+        (clean_type, engine_code, axle_config)
+        for clean_type in ("1844ls", "1846ls")
+        for engine_code in ("501920", "502920")
+        for axle_config in ("4x2", "6x2")
+    ]
+    df_fan_out = utils.pop_fan_out_report()
+    assert df_fan_out[["column", "n_rows_before", "n_rows_after"]].to_dict("list") == {
+        "column": ["component_code", "axle_configuration"], "n_rows_before": [2, 4], "n_rows_after": [4, 8]
+    }
+
+
+def test_match_reports_the_fan_out_of_the_variant_tables(tmp_path, raw_exports):
+    df_fan_out = pd.read_csv(run(tmp_path, *raw_exports, "exact") / "fan_out.csv")
+
+    assert sorted(zip(df_fan_out["table"], df_fan_out["column"])) == [
+        ("LIS", "axle_configuration"), ("LIS", "component_code"), ("TecDoc", "component_code")
+    ]
+    assert (df_fan_out["n_rows_after"] >= df_fan_out["n_rows_before"]).all()
+
+
+def test_get_brand_gives_the_first_matching_brand():
+    make = pd.Series(["man", "MAN", "mercedes benz", "mercedesman", "daf", None], index=[5, 4, 3, 2, 1, 0])
+
+    assert clean.get_brand(make).tolist() == ["man", "man", "mercedes", "mercedes", "other", "other"]
+
+
+def test_apply_per_brand_runs_the_function_once_per_brand():
+    df = pd.DataFrame({"make": ["daf", "man", "mercedes", "man", None]}, index=[10, 11, 12, 13, 14])
+    calls = []
+
+    def function(df_brand: pd.DataFrame, brand: str) -> pd.DataFrame:
+        calls.append((brand, df_brand.index.tolist()))
+        return df_brand.assign(brand=brand)
+
+    df = clean.apply_per_brand(df, function)
+
+    assert calls == [("man", [11, 13]), ("mercedes", [12]), ("other", [10, 14])]
+    # Reassembled in the order of BRANDS, then the other records
+    assert df["brand"].tolist() == ["man", "man", "mercedes", "other", "other"]
+
+
+def test_brand_rules_run_in_the_order_they_were_registered(monkeypatch):
+    monkeypatch.setattr(clean, "BRAND_RULES", {})
+
+    @clean.brand_rule("man", "model_lis")
+    def append_1(df: pd.DataFrame) -> pd.DataFrame:
+        return df.assign(model=df["model"] + "1")
+
+    @clean.brand_rule("man", "model_lis")
+    def append_2(df: pd.DataFrame) -> pd.DataFrame:
+        return df.assign(model=df["model"] + "2")
+
+    df = pd.DataFrame({"model": ["tgx"]})
+
+    assert clean.apply_brand_rules(df, "man", "model_lis")["model"].tolist() == ["tgx12"]
+    assert clean.apply_brand_rules(df, "man", "type_lis") is df
+    assert clean.apply_brand_rules(df, "mercedes", "model_lis") is df
+
+
+def test_per_brand_steps_give_the_same_result_for_the_whole_frame_and_per_brand():
+    df = pd.DataFrame({
+        "make": ["mercedes benz", "man", "daf", "man"],
+        "component_code": ["om 501.920, om 906.9xx", "d 2066 lf 31 euro 5", "mx 300", "d2676lf05"],
+    })
+
+    df_whole = clean.clean_engine_code(df)
+    df_per_brand = pd.concat([
+        clean.clean_engine_code(df.take(positions), brand)
+        for brand, positions in [("man", [1, 3]), ("mercedes", [0]), ("other", [2])]
+    ])
+
+    pd.testing.assert_frame_equal(df_whole, df_per_brand)
+    assert df_whole["component_code"].tolist() == ["d2066lf31", "d2676lf05", "501920", "9069xx", "mx300"]
+
+
+def test_make_partitions_keep_the_records_of_a_make_together():
+    df = pd.DataFrame({"make": ["a"] * 5 + ["b"] * 3 + ["c"] * 3 + ["d"] + [None] * 2})
+
+    partitions = clean._get_make_partitions(df, n_partitions=3)
+
+    assert len(partitions) == 3
+    assert sorted(position for partition in partitions for position in partition.index) == list(range(len(df)))
+    makes = [set(partition["make"].fillna("missing")) for partition in partitions]
+    assert all(makes[i].isdisjoint(makes[j]) for i in range(3) for j in range(i + 1, 3))
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_cleaning_in_a_pool_gives_the_same_records(workers):
+    df_lis = load.apply_dtypes(make_raw_lis(300), c.LIS_DTYPES)
+    df_tecdoc = load.apply_dtypes(make_raw_tecdoc(300), c.TECDOC_DTYPES)
+
+    pd.testing.assert_frame_equal(main.prepare_lis(df_lis, workers=workers)[0], main.prepare_lis(df_lis)[0])
+    pd.testing.assert_frame_equal(main.prepare_tecdoc(df_tecdoc, workers=workers)[0], main.prepare_tecdoc(df_tecdoc)[0])
+
+
+def test_match_with_workers_gives_the_same_results(tmp_path, raw_exports):
+    df_lis, df_tecdoc = raw_exports
+
+    results = read_results(run(tmp_path, df_lis, df_tecdoc, "default"))
+
+    assert read_results(run(tmp_path, df_lis, df_tecdoc, "workers", workers=2)) == results
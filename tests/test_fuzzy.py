@@ -0,0 +1,56 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from oly_matching import match
+from tests.conftest import read_results, run
+
+
+def _get_block(df: pd.DataFrame) -> List[Tuple[object, object]]:
+    return [match._get_block_key(key) for key in zip(df["make"], df["category"])]
+
+
+def test_fuzzy_blocks_hold_the_records_of_one_make_and_category(clean_records):
+    df_lis, df_tecdoc = clean_records
+    df_lis = df_lis.assign(category=df_lis["category"].where(np.arange(len(df_lis)) % 7 != 0, None))
+
+    blocks = match.get_fuzzy_blocks(df_lis, df_tecdoc)
+
+    assert sorted(position for _, df_lis_block, _ in blocks for position in df_lis_block.index) == list(df_lis.index)
+    for key, df_lis_block, df_tecdoc_block in blocks:
+        assert set(_get_block(df_lis_block)) == {key}
+        assert set(_get_block(df_tecdoc_block)) <= {key}
+        assert len(df_tecdoc_block) == _get_block(df_tecdoc).count(key)
+    assert any(len(df_tecdoc_block) == 0 for _, _, df_tecdoc_block in blocks)
+
+
+@pytest.fixture(scope="module")
+def fuzzy_matched(clean_records) -> pd.DataFrame:
+    df_lis, df_tecdoc = clean_records
+    return match.match_fuzzy(df_lis.assign(record=np.arange(len(df_lis))), df_tecdoc)
+
+
+def test_match_fuzzy_only_matches_within_a_block(clean_records, fuzzy_matched):
+    _, df_tecdoc = clean_records
+    df_matches = fuzzy_matched[fuzzy_matched["N-Type No."].notnull()]
+
+    df_tecdoc_matched = df_tecdoc.drop_duplicates("N-Type No.").set_index("N-Type No.").loc[df_matches["N-Type No."]]
+    assert len(df_matches) > 0
+    assert _get_block(df_matches.rename(columns=lambda col: col.replace("_lis", ""))) == _get_block(df_tecdoc_matched)
+    assert fuzzy_matched["record"].is_monotonic_increasing
+
+
+def test_match_fuzzy_with_workers_gives_the_same_matches(clean_records, fuzzy_matched):
+    df_lis, df_tecdoc = clean_records
+
+    df_matched = match.match_fuzzy(df_lis.assign(record=np.arange(len(df_lis))), df_tecdoc, workers=2)
+
+    pd.testing.assert_frame_equal(df_matched, fuzzy_matched)
+
+
+def test_fuzzy_match_run_with_workers_gives_the_same_results(tmp_path, raw_exports):
+    results = read_results(run(tmp_path, *raw_exports, "default", matching_method="fuzzy"))
+
+    assert read_results(run(tmp_path, *raw_exports, "workers", matching_method="fuzzy", workers=2)) == results
@@ -0,0 +1,98 @@
+import random
+from typing import Tuple
+
+import pandas as pd
+import pytest
+
+from oly_matching import constants as c
+from oly_matching import state
+from tests.conftest import make_raw_lis, make_raw_tecdoc, read_results, run
+
+
+def change_exports(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, seed: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """The next weekly export: some LIS types and N-types are deleted, changed or added"""
+    rng = random.Random(seed)
+    type_ids = sorted(df_lis["type_id"].unique())
+    deleted, changed, years_changed = (set(rng.sample(type_ids, 15)) for _ in range(3))
+    df_lis = df_lis[~df_lis["type_id"].isin(deleted)].copy()
+    is_changed = df_lis["type_id"].isin(changed)
+    new_codes = [rng.choice(["D2676LF05", "DC9 17", "MX-300"]) for _ in range(is_changed.sum())]
+    df_lis.loc[is_changed, "component_code"] = new_codes
+    is_year_changed = df_lis["type_id"].isin(years_changed) & df_lis["model_year_start"].notnull()
+    df_lis.loc[is_year_changed, "model_year_start"] += 3
+    df_lis_new = make_raw_lis(40, seed=seed).assign(type_id=lambda df: df["type_id"] + 10 ** 6)
+
+    n_types = sorted(df_tecdoc["N-Type No."])
+    deleted, changed = (set(rng.sample(n_types, 30)) for _ in range(2))
+    df_tecdoc = df_tecdoc[~df_tecdoc["N-Type No."].isin(deleted)].copy()
+    is_changed = df_tecdoc["N-Type No."].isin(changed)
+    df_tecdoc.loc[is_changed, "Axle Configuration"] = "4x2"
+    df_tecdoc_new = make_raw_tecdoc(40, seed=seed).assign(**{"N-Type No.": lambda df: df["N-Type No."] + 10 ** 6})
+    # Shuffled, the order of the records does not matter
+    df_lis = pd.concat([df_lis, df_lis_new]).sample(frac=1, random_state=seed)
+    df_tecdoc = pd.concat([df_tecdoc, df_tecdoc_new]).sample(frac=1, random_state=seed)
+    return df_lis, df_tecdoc
+
+
+@pytest.mark.parametrize("matching_method", ["exact", "cut_strings"])
+def test_incremental_run_matches_full_run(tmp_path, raw_exports, matching_method):
+    df_lis, df_tecdoc = raw_exports
+    state_folder = str(tmp_path / "state")
+    run(tmp_path, df_lis, df_tecdoc, "first", matching_method=matching_method, state_folder=state_folder)
+
+    df_lis_next, df_tecdoc_next = change_exports(df_lis, df_tecdoc)
+    incremental_folder = run(
+        tmp_path,
+        df_lis_next,
+        df_tecdoc_next,
+        "incremental",
+        matching_method=matching_method,
+        state_folder=state_folder,
+        incremental=True,
+    )
+    full_folder = run(tmp_path, df_lis_next, df_tecdoc_next, "full", matching_method=matching_method)
+
+    assert read_results(incremental_folder) == read_results(full_folder)
+    assert not (incremental_folder / "fan_out.csv").exists()
+    # The state now belongs to the second run, a next incremental run without changes gives the same results
+    repeated_folder = run(
+        tmp_path,
+        df_lis_next,
+        df_tecdoc_next,
+        "repeated",
+        matching_method=matching_method,
+        state_folder=state_folder,
+        incremental=True,
+    )
+    assert read_results(repeated_folder) == read_results(full_folder)
+
+
+def test_incremental_run_without_state_does_a_full_run(tmp_path, raw_exports):
+    df_lis, df_tecdoc = raw_exports
+    state_folder = tmp_path / "state"
+    incremental_folder = run(
+        tmp_path, df_lis, df_tecdoc, "incremental", state_folder=str(state_folder), incremental=True
+    )
+    full_folder = run(tmp_path, df_lis, df_tecdoc, "full")
+
+    assert read_results(incremental_folder) == read_results(full_folder)
+    assert state.state_matches(str(state_folder), "exact", c.YEAR_TOLERANCE)
+    assert not state.state_matches(str(state_folder), "cut_strings", c.YEAR_TOLERANCE)
+
+
+def test_incremental_run_rejects_fuzzy_matching(tmp_path, raw_exports):
+    with pytest.raises(ValueError, match="Incremental matching supports"):
+        run(tmp_path, *raw_exports, "fuzzy", matching_method="fuzzy", state_folder=str(tmp_path), incremental=True)
+
+
+def test_get_changed_ids():
+    df_old = pd.DataFrame({"type_id": [1, 1, 2, 3], "model": ["a", "b", "c", "d"]})
+    # type_id 1 has its rows in another order, 2 changed, 3 deleted and 4 added
+    df_new = pd.DataFrame({"type_id": [1, 1, 2, 4], "model": ["b", "a", "x", "e"]})
+
+    changed_ids, deleted_ids = state.get_changed_ids(
+        state.hash_records(df_old, "type_id"), state.hash_records(df_new, "type_id")
+    )
+
+    assert sorted(changed_ids) == [2, 4]
+    assert list(deleted_ids) == [3]
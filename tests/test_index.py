@@ -0,0 +1,204 @@
+from typing import List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from oly_matching import match
+from oly_matching.index import TecDocIndex, count_wildcards
+
+KEY_COLUMNS = ["make", "model", "type", "category"]
+
+
+def make_clean_frames(n_tecdoc: int, seed: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Clean records with few distinct values, missing values in every column and wildcards in LIS engine codes"""
+    rng = np.random.default_rng(seed)
+
+    def column(values: List[str], n: int, fraction_missing: float) -> pd.Series:
+        series = pd.Series(rng.choice(values, n), dtype=object)
+        series[rng.random(n) < fraction_missing] = None
+        return series
+
+    df_tecdoc = pd.DataFrame({
+        "make": column(["a", "b"], n_tecdoc, 0.02),
+        "model": column(["m1", "m2"], n_tecdoc, 0.05),
+        "type": column(["t"], n_tecdoc, 0.05),
+        "category": column(["c"], n_tecdoc, 0),
+        "component_code": column(["123456", "123457", "124000", "999"], n_tecdoc, 0.05),
+        "axle_configuration": column(["4x2", "6x2", "6x4"], n_tecdoc, 0.2),
+    })
+    years = np.where(rng.random(n_tecdoc) < 0.2, None, rng.integers(1995, 2010, n_tecdoc))
+    df_tecdoc["model_year_start"] = pd.array(years, dtype="Int64")
+    df_tecdoc["N-Type No."] = np.arange(n_tecdoc)
+    df_tecdoc["in_tecdoc"] = True
+
+    n_lis = n_tecdoc // 2
+    df_lis = pd.DataFrame({
+        "make": column(["a", "b", "z"], n_lis, 0.02),
+        "model": column(["m1", "m2"], n_lis, 0.05),
+        "type": column(["t"], n_lis, 0.05),
+        "category": column(["c"], n_lis, 0),
+        "component_code": column(
+            ["123456", "123457", "124000", "1234xx", "12xxxx", "x", "999", "nope"], n_lis, 0.05
+        ),
+        "axle_configuration": column(["4x2", "6x2", "8x8"], n_lis, 0.4),
+    })
+    years = np.where(rng.random(n_lis) < 0.3, None, rng.integers(1990, 2015, n_lis))
+    df_lis["model_year_start"] = pd.array(years, dtype="Int16")
+    df_lis["type_id"] = np.arange(n_lis)
+    df_lis["component_code_clean"] = df_lis["component_code"]
+    df_tecdoc["component_code_clean"] = df_tecdoc["component_code"]
+    return df_lis, df_tecdoc
+
+
+def _equal(lis_value: object, tecdoc_value: object) -> bool:
+    # Like pd.merge, missing values match each other
+    if pd.isnull(lis_value) or pd.isnull(tecdoc_value):
+        return pd.isnull(lis_value) and pd.isnull(tecdoc_value)
+    return lis_value == tecdoc_value
+
+
+def _engine_codes_match(lis_code: object, tecdoc_code: object) -> bool:
+    """Every trailing 'x' of the LIS engine code matches any single character, the last one of the TecDoc code"""
+    if pd.isnull(lis_code) or pd.isnull(tecdoc_code) or not lis_code.endswith("x"):
+        return _equal(lis_code, tecdoc_code)
+    prefix = lis_code.rstrip("x")
+    return tecdoc_code[:-(len(lis_code) - len(prefix))] == prefix
+
+
+def _is_valid(lis: dict, tecdoc: dict, year_tolerance: int) -> bool:
+    """The predicates of match.keep_valid_matches"""
+    years_close = (
+        pd.isnull(lis["model_year_start"])
+        or pd.isnull(tecdoc["model_year_start"])
+        or abs(lis["model_year_start"] - tecdoc["model_year_start"]) <= year_tolerance
+    )
+    axle_matches = pd.isnull(lis["axle_configuration"]) or _equal(
+        lis["axle_configuration"], tecdoc["axle_configuration"]
+    )
+    return years_close and axle_matches
+
+
+def join_then_filter(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, year_tolerance: int = None) -> Set[tuple]:
+    """The (LIS row, TecDoc row) pairs of a left join on the keys, record by record, filtered if year_tolerance
+
+    A LIS record without a match has TecDoc row -1. After filtering, it is only kept if its axle configuration is
+    missing, like match.keep_valid_matches keeps the records without a match after a left join.
+    """
+    tecdoc_records = df_tecdoc.to_dict("records")
+    pairs = set()
+    for i, lis in enumerate(df_lis.to_dict("records")):
+        matches = [
+            j for j, tecdoc in enumerate(tecdoc_records)
+            if all(_equal(lis[col], tecdoc[col]) for col in KEY_COLUMNS)
+            and _engine_codes_match(lis["component_code_clean"], tecdoc["component_code_clean"])
+        ]
+        if year_tolerance is None or not matches:
+            if year_tolerance is None or pd.isnull(lis["axle_configuration"]):
+                pairs.update((i, j) for j in matches or [-1])
+            continue
+        pairs.update((i, j) for j in matches if _is_valid(lis, tecdoc_records[j], year_tolerance))
+    return pairs
+
+
+def probe_pairs(df_lis: pd.DataFrame, df_tecdoc: pd.DataFrame, year_tolerance: int = None) -> Set[tuple]:
+    lis_rows, tecdoc_rows = TecDocIndex.build(df_tecdoc).probe(df_lis, year_tolerance=year_tolerance)
+    pairs = list(zip(lis_rows.tolist(), tecdoc_rows.tolist()))
+    assert len(pairs) == len(set(pairs))
+    return set(pairs)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_probe_is_a_left_join(seed):
+    df_lis, df_tecdoc = make_clean_frames(120, seed)
+
+    assert probe_pairs(df_lis, df_tecdoc) == join_then_filter(df_lis, df_tecdoc)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("year_tolerance", [0, 2, 5])
+def test_probe_with_year_tolerance_is_join_then_filter(seed, year_tolerance):
+    df_lis, df_tecdoc = make_clean_frames(120, seed)
+
+    assert probe_pairs(df_lis, df_tecdoc, year_tolerance) == join_then_filter(df_lis, df_tecdoc, year_tolerance)
+
+
+def test_probe_with_year_tolerance_without_years_or_axle_configurations():
+    df_lis, df_tecdoc = make_clean_frames(120, seed=10)
+    df_tecdoc["model_year_start"] = pd.array([None] * len(df_tecdoc), dtype="Int64")
+    df_lis["axle_configuration"] = None
+
+    assert probe_pairs(df_lis, df_tecdoc, 2) == join_then_filter(df_lis, df_tecdoc, 2)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("year_tolerance", [0, 2, 5])
+def test_match_exactly_is_join_then_filter(seed, year_tolerance):
+    df_lis, df_tecdoc = make_clean_frames(400, seed)
+
+    df_expected = match.keep_valid_matches(match.match_on_required_columns(df_lis, df_tecdoc), year_tolerance)
+    df_matched = match.match_exactly(df_lis, df_tecdoc, year_tolerance=year_tolerance)
+
+    pd.testing.assert_frame_equal(df_matched, df_expected.reset_index(drop=True))
+
+
+def test_saved_index_probes_like_the_built_one(tmp_path):
+    df_lis, df_tecdoc = make_clean_frames(120, seed=0)
+    tecdoc_index = TecDocIndex.build(df_tecdoc)
+    tecdoc_index.save(tmp_path / "index")
+
+    lis_rows, tecdoc_rows = TecDocIndex.load(tmp_path / "index").probe(df_lis)
+
+    expected_lis_rows, expected_tecdoc_rows = tecdoc_index.probe(df_lis)
+    np.testing.assert_array_equal(lis_rows, expected_lis_rows)
+    np.testing.assert_array_equal(tecdoc_rows, expected_tecdoc_rows)
+
+
+def test_match_exactly_is_a_merge_on_the_keys():
+    df_lis, df_tecdoc = make_clean_frames(400, seed=0)
+
+    df_matched = match.match_on_required_columns(df_lis, df_tecdoc)
+
+    pairs = set(zip(df_matched["type_id"], df_matched["N-Type No."].fillna(-1).astype(int)))
+    assert pairs == join_then_filter(df_lis, df_tecdoc)
+
+
+def test_match_exactly_without_tecdoc_records():
+    df_lis, df_tecdoc = make_clean_frames(100, seed=0)
+    df_tecdoc = df_tecdoc.iloc[:0]
+
+    df_expected = match.keep_valid_matches(match.match_on_required_columns(df_lis, df_tecdoc))
+    df_matched = match.match_exactly(df_lis, df_tecdoc)
+
+    pd.testing.assert_frame_equal(df_matched, df_expected.reset_index(drop=True), check_dtype=False)
+
+
+def _frame_of_engine_codes(engine_codes: List[str]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "make": "a",
+        "model": "m",
+        "type": "t",
+        "category": "c",
+        "component_code": pd.Series(engine_codes, dtype=object),
+        "axle_configuration": None,
+        "model_year_start": pd.array([None] * len(engine_codes), dtype="Int16"),
+    })
+
+
+def test_count_wildcards():
+    engine_codes = pd.Series(["4579xx", "x", "12x3", "xxx", None, ""], dtype=object)
+
+    assert count_wildcards(engine_codes).tolist() == [2, 1, 0, 3, 0, 0]
+
+
+def test_trailing_wildcards_match_any_characters():
+    df_tecdoc = _frame_of_engine_codes(["457900", "45790", "457911", "458000", "4579000", "45791x"])
+    df_lis = _frame_of_engine_codes(["xxxxxx", "4579xx", "457900", "45x", "4579x"])
+
+    lis_rows, tecdoc_rows = TecDocIndex.build(df_tecdoc).probe(df_lis)
+
+    # Without wildcards first, then by number of wildcards, the matches of a record in TecDoc order. Like the loop
+    # that cut the last character of both codes per wildcard, only wildcards also match the shorter codes
+    assert list(zip(lis_rows.tolist(), tecdoc_rows.tolist())) == [
+        (2, 0), (3, -1), (4, 1), (1, 0), (1, 2), (1, 5), (0, 0), (0, 1), (0, 2), (0, 3), (0, 5)
+    ]
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from oly_matching import load
+from tests.conftest import make_raw_lis
+
+
+@pytest.mark.parametrize("input_format", ["csv", "xlsx"])
+@pytest.mark.parametrize("chunksize", [1, 7, 1000])
+def test_streamed_lis_is_the_engine_records_of_the_lis(tmp_path, input_format, chunksize):
+    path = tmp_path / f"lis.{input_format}"
+    df_raw = make_raw_lis(100)
+    if input_format == "csv":
+        df_raw.to_csv(path, index=False)
+    else:
+        df_raw.to_excel(path, index=False)
+    df_lis = load.load_lis(str(path))
+    df_expected = df_lis[df_lis["component_group"] == "Engines"].reset_index(drop=True)
+
+    df_streamed = load.load_lis(str(path), chunksize=chunksize)
+
+    # The categories of the streamed records only hold the values of the engine records
+    pd.testing.assert_frame_equal(df_streamed, df_expected, check_categorical=False)
+    assert df_streamed.dtypes.astype(str).tolist() == df_expected.dtypes.astype(str).tolist()
@@ -0,0 +1,69 @@
+import io
+import json
+from typing import List, Tuple
+
+import pandas as pd
+import pytest
+
+from oly_matching import load, lookup, main
+from oly_matching.index import TecDocIndex
+from oly_matching.record import RecordMatcher
+from tests.conftest import make_raw_lis
+
+BAD_LINES = ['{"type_id": 1}', "not json", "[1, 2]", '{"type_id": 2, "model": 5, "type": "FH 4x2"}']
+
+
+@pytest.fixture
+def records() -> List[dict]:
+    return json.loads(make_raw_lis(60).to_json(orient="records"))
+
+
+def run_lookup(lines: List[str], reference: Tuple[pd.DataFrame, TecDocIndex], how: str = "exact") -> List[dict]:
+    output = io.StringIO()
+    df_tecdoc, tecdoc_index = reference
+    lookup.lookup_stream(lines, output, df_tecdoc, tecdoc_index, how=how, batch_size=6)
+    text = output.getvalue()
+    # One link per line, every line ends with a newline
+    assert text.endswith("\n") and "\n\n" not in text and not text.startswith("\n")
+    return [json.loads(line) for line in text.splitlines()]
+
+
+@pytest.mark.parametrize("how", ["exact", "cut_strings"])
+def test_lookup_writes_the_links_of_match_lis_records(reference, records, how):
+    df_tecdoc, tecdoc_index = reference
+    df_expected = main.match_lis_records(load.load_lis_records(records), df_tecdoc, how, tecdoc_index)
+
+    links = run_lookup([json.dumps(record) for record in records], reference, how)
+
+    assert [set(link) for link in links] == [{"type_id", "n_type"}] * len(links)
+    assert {(link["type_id"], link["n_type"]) for link in links} == set(df_expected.itertuples(index=False, name=None))
+
+
+def test_lookup_skips_invalid_lines(reference, records):
+    lines = [json.dumps(record) for record in records]
+    bad_lines = lines[:10] + BAD_LINES + lines[10:30] + BAD_LINES + lines[30:]
+
+    links = run_lookup(lines, reference)
+
+    assert links
+    assert run_lookup(bad_lines, reference) == links
+
+
+def test_lookup_skips_a_failing_batch(reference, records, monkeypatch):
+    lines = [json.dumps(record) for record in records]
+    links = run_lookup(lines, reference)
+    match = RecordMatcher.match
+    n_calls = []
+
+    def fail_once(self, batch):
+        n_calls.append(1)
+        if len(n_calls) == 2:
+            raise RuntimeError("broken")
+        return match(self, batch)
+
+    monkeypatch.setattr(RecordMatcher, "match", fail_once)
+    # Batches of 6 records, the records of a type_id are never split over two batches
+    failed_type_ids = {record["type_id"] for record in records[6:12]}
+    assert any(link["type_id"] in failed_type_ids for link in links)
+
+    assert run_lookup(lines, reference) == [link for link in links if link["type_id"] not in failed_type_ids]
@@ -0,0 +1,21 @@
+import pytest
+
+from tests.conftest import read_results, run
+
+
+@pytest.mark.parametrize("matching_method", ["exact", "cut_strings", "fuzzy", "fuzzy_ngram"])
+def test_copy_free_run_gives_the_same_results(tmp_path, raw_exports, matching_method):
+    results = read_results(run(tmp_path, *raw_exports, "default", matching_method=matching_method))
+
+    copy_free_folder = run(tmp_path, *raw_exports, "copy_free", matching_method=matching_method, copy_free=True)
+
+    assert read_results(copy_free_folder) == results
+
+
+@pytest.mark.parametrize("input_format", ["csv", "xlsx"])
+def test_run_with_lis_chunks_gives_the_same_results(tmp_path, raw_exports, input_format):
+    results = read_results(run(tmp_path, *raw_exports, "default", input_format=input_format))
+
+    chunks_folder = run(tmp_path, *raw_exports, "chunks", input_format=input_format, lis_chunksize=7)
+
+    assert read_results(chunks_folder) == results
@@ -0,0 +1,102 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from oly_matching import match, ngram
+
+# Many equal texts, so that many TecDoc rows have the same similarity
+TECDOC_TEXTS = ["actros 1840 om501", "actros 1844 om501", "atego 1218 om906", "tgx 18440 d2066", "xf 105 mx300"] * 8
+LIS_TEXTS = ["actros 1840 om501", "actros 184 om50", "tgx 18 d2066", "xf 85 pr228", "", "atego"]
+
+
+def _dense(matrix: ngram.SparseRows) -> np.ndarray:
+    n_rows = len(matrix.indptr) - 1
+    dense = np.zeros((n_rows, matrix.n_columns))
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    np.add.at(dense, (rows, matrix.indices), matrix.values)
+    return dense
+
+
+def get_candidates(lis_texts: List[str], tecdoc_texts: List[str], top_k: int, threshold: float) -> List[tuple]:
+    vocabulary, idf = ngram.fit_vocabulary(pd.Series(tecdoc_texts))
+    lis_matrix = ngram.vectorize(pd.Series(lis_texts), vocabulary, idf)
+    tecdoc_matrix = ngram.vectorize(pd.Series(tecdoc_texts), vocabulary, idf)
+    lis_rows, tecdoc_rows, scores = ngram.get_top_k_candidates(
+        lis_matrix, ngram.transpose(tecdoc_matrix, len(tecdoc_texts)), top_k, threshold
+    )
+    return list(zip(lis_rows.tolist(), tecdoc_rows.tolist(), np.round(scores, 10).tolist()))
+
+
+def brute_force_candidates(lis_texts: List[str], tecdoc_texts: List[str], top_k: int, threshold: float) -> List[tuple]:
+    """The top_k scores of the dense product of every LIS row, the first TecDoc rows of equal scores"""
+    vocabulary, idf = ngram.fit_vocabulary(pd.Series(tecdoc_texts))
+    scores = _dense(ngram.vectorize(pd.Series(lis_texts), vocabulary, idf)) @ _dense(
+        ngram.vectorize(pd.Series(tecdoc_texts), vocabulary, idf)
+    ).T
+    scores = np.round(scores, 10)
+    candidates = []
+    for lis_row, row_scores in enumerate(scores):
+        ranked = sorted(range(len(row_scores)), key=lambda tecdoc_row: (-row_scores[tecdoc_row], tecdoc_row))
+        candidates += [
+            (lis_row, tecdoc_row, row_scores[tecdoc_row])
+            for tecdoc_row in ranked[:top_k]
+            if row_scores[tecdoc_row] >= threshold and row_scores[tecdoc_row] > 0
+        ]
+    return candidates
+
+
+def test_vectors_have_unit_length():
+    vocabulary, idf = ngram.fit_vocabulary(pd.Series(TECDOC_TEXTS))
+    dense = _dense(ngram.vectorize(pd.Series(LIS_TEXTS + TECDOC_TEXTS), vocabulary, idf))
+
+    lengths = np.sqrt((dense ** 2).sum(axis=1))
+    # The empty text has no n-grams in the vocabulary
+    np.testing.assert_allclose(lengths, [1, 1, 1, 1, 0, 1] + [1] * len(TECDOC_TEXTS))
+
+
+@pytest.mark.parametrize("top_k", [1, 3, 5, 100])
+@pytest.mark.parametrize("threshold", [0, 0.5])
+def test_top_k_candidates_are_those_of_the_dense_product(top_k, threshold):
+    candidates = get_candidates(LIS_TEXTS, TECDOC_TEXTS, top_k, threshold)
+
+    assert candidates == brute_force_candidates(LIS_TEXTS, TECDOC_TEXTS, top_k, threshold)
+
+
+def test_top_k_bounds_the_candidates_of_tied_rows():
+    candidates = get_candidates(["actros 1840 om501"], TECDOC_TEXTS, top_k=5, threshold=0)
+
+    # 8 TecDoc rows have the same text, the first 5 are kept
+    assert [tecdoc_row for _, tecdoc_row, _ in candidates] == [0, 5, 10, 15, 20]
+
+
+def test_top_k_candidates_do_not_depend_on_the_row_blocks(monkeypatch):
+    candidates = get_candidates(LIS_TEXTS, TECDOC_TEXTS, 5, 0)
+
+    monkeypatch.setattr(ngram, "MAX_SCORES_PER_ROW_BLOCK", 50)
+
+    assert get_candidates(LIS_TEXTS, TECDOC_TEXTS, 5, 0) == candidates
+
+
+def _get_block(df: pd.DataFrame) -> List[Tuple[object, object]]:
+    return list(zip(df["make"], df["category"]))
+
+
+@pytest.mark.parametrize("top_k", [1, 5])
+def test_match_ngram_keeps_at_most_top_k_matches_of_the_same_block(clean_records, top_k):
+    df_lis, df_tecdoc = clean_records
+    df_lis = df_lis.assign(record=np.arange(len(df_lis)))
+
+    df_matched = match.match_ngram(df_lis, df_tecdoc, top_k=top_k, threshold=0.5)
+
+    is_match = df_matched["in_tecdoc"].astype(bool)
+    df_matches = df_matched[is_match]
+    assert is_match.any()
+    assert df_matches.groupby("record").size().max() <= top_k
+    assert (df_matches["best_match_score"] >= 0.5).all()
+    df_tecdoc_matched = df_tecdoc.drop_duplicates("N-Type No.").set_index("N-Type No.").loc[df_matches["N-Type No."]]
+    assert _get_block(df_matches.rename(columns=lambda col: col.replace("_lis", ""))) == _get_block(
+        df_tecdoc_matched
+    )
+    assert df_matched["record"].is_monotonic_increasing
@@ -0,0 +1,71 @@
+import json
+from typing import List
+
+import pandas as pd
+import pytest
+
+from oly_matching import clean, load, main, record
+from tests.conftest import make_raw_lis
+
+# Records that take the less common paths of the cleaning
+TRICKY_RECORDS = [
+    {"make": "MAN (D)", "model": "TGL /4", "type": "TGL 8.180 4x2 BB", "component_code": "D0834 LFL 40, D0834 LFL 41"},
+    {"make": "MAN", "model": "TGS, TGX", "type": "26.440, 26.480 6x4 / 6x2", "component_code": "d2066 lf 31, , d 2676"},
+    {"make": "Mercedes-Benz", "model": "Actros construction/tractor", "type": "Actros 1840, 1844 LS 4x2 Euro 5",
+     "component_code": "OM 501 LA (457.9xx)", "model_year_start": 2008.0},
+    {"make": "Mercedes-Benz", "model": "Actros", "type": "2541 L/LL 6x2", "component_code": None,
+     "category": "Trucks and Buses (> 7.5t) NL"},
+    {"make": "DAF", "model": "XF", "type": "XF 105.460 ../ 4x2", "component_code": "MX 340",
+     "category": "Agricultural Equipment"},
+    {"make": "DAF", "model": "XF", "type": "", "component_code": ""},
+    {"make": "DAF", "model": "XF", "type": "xf", "component_code": "mx", "component_group": "Axles"},
+    {"make": None, "model": "XF", "type": "xf", "component_code": "mx"},
+    {"make": "  mercedes  ", "model": "  ", "type": "   ", "component_code": " , "},
+]
+
+
+@pytest.fixture(scope="module")
+def records() -> List[dict]:
+    records = json.loads(make_raw_lis(600).to_json(orient="records")) + TRICKY_RECORDS
+    return [dict(lis_record, type_id=type_id) for type_id, lis_record in enumerate(records)]
+
+
+def _sorted_rows(df: pd.DataFrame) -> List[tuple]:
+    df = df[["type_id"] + record.MATCH_COLUMNS].astype(object)
+    return sorted(map(tuple, df.where(df.notnull(), None).to_numpy().tolist()), key=repr)
+
+
+def test_clean_lis_record_is_prepare_lis(records):
+    df_expected, _ = main.prepare_lis(load.load_lis_records(records))
+
+    df_rows = pd.DataFrame([row for lis_record in records for row in record.clean_lis_record(lis_record)])
+
+    assert len(df_rows) > 0
+    assert _sorted_rows(df_rows) == _sorted_rows(df_expected.astype({"model_year_start": float}))
+
+
+@pytest.mark.parametrize("how", ["exact", "cut_strings"])
+def test_record_matcher_links_are_those_of_match_lis_records(reference, records, how):
+    df_tecdoc, tecdoc_index = reference
+    df_expected = main.match_lis_records(load.load_lis_records(records), df_tecdoc, how, tecdoc_index)
+
+    links = record.RecordMatcher(df_tecdoc, tecdoc_index, how=how).match(records)
+
+    assert len(links) > 0
+    assert len(set(links)) == len(links)
+    assert links == sorted(links)
+    assert set(links) == set(df_expected.itertuples(index=False, name=None))
+
+
+def test_record_matcher_rejects_other_matching_methods(reference):
+    with pytest.raises(ValueError, match="fuzzy"):
+        record.RecordMatcher(*reference, how="fuzzy")
+
+
+def test_brand_rules_are_those_of_clean():
+    lis_steps = {step for rules in record.BRAND_RULES.values() for step in rules}
+
+    assert list(record.BRANDS) == list(clean.BRANDS)
+    assert {(brand, step) for brand, rules in record.BRAND_RULES.items() for step in rules} == {
+        (brand, step) for brand, rules in clean.BRAND_RULES.items() for step in rules if step in lis_steps
+    }
@@ -0,0 +1,87 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+from typing import List, Tuple
+
+import pytest
+
+from oly_matching import serve
+from tests.conftest import make_raw_lis
+
+
+@pytest.fixture
+def records() -> List[dict]:
+    return json.loads(make_raw_lis(60).to_json(orient="records"))
+
+
+@pytest.fixture
+def server(reference):
+    service = serve.LookupService(*reference)
+    server = HTTPServer(("127.0.0.1", 0), serve.make_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, service
+    server.shutdown()
+    server.server_close()
+
+
+def post(server: HTTPServer, content: object) -> Tuple[int, dict]:
+    body = content if isinstance(content, bytes) else json.dumps(content).encode()
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_port}{serve.LOOKUP_PATH}",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_serve_matches_like_a_batch_lookup(server, records):
+    results = [post(server[0], lis_record) for lis_record in records]
+
+    assert all(status == 200 for status, _ in results)
+    assert [content for _, content in results] == server[1].lookup(records)
+    assert any(content["n_types"] for _, content in results)
+
+
+def test_serve_rejects_a_record_without_model_and_type(server):
+    status, content = post(server[0], {"type_id": 1})
+
+    assert status == 400
+    assert "model" in content["error"] and "type" in content["error"]
+
+
+def test_serve_rejects_a_request_that_is_not_json(server):
+    status, content = post(server[0], b"{not json")
+
+    assert status == 400
+    assert "error" in content
+
+
+def test_serve_matches_the_valid_records_of_a_batch(server, records):
+    status, content = post(server[0], records[:3] + [{"type_id": 1, "model": ["TGX"]}] + records[3:6])
+
+    assert status == 200
+    results = content["results"]
+    assert [result["type_id"] for result in results] == [record["type_id"] for record in records[:3]] + [1] + [
+        record["type_id"] for record in records[3:6]
+    ]
+    assert "error" in results[3] and "model" in results[3]["error"]
+    assert all("n_types" in result for position, result in enumerate(results) if position != 3)
+
+
+@pytest.mark.parametrize("error", [RuntimeError, TypeError])
+def test_serve_returns_a_server_error_if_matching_fails(server, records, monkeypatch, error):
+    def fail(keys):
+        raise error("broken")
+
+    monkeypatch.setattr(server[1], "_match", fail)
+    status, content = post(server[0], records[0])
+
+    assert status == 500
+    assert "broken" in content["error"]
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from oly_matching import utils
+
+
+def test_join_variants_cross_joins_the_variants_of_every_row_id():
+    utils.pop_fan_out_report()
+    df = pd.DataFrame({"type": ["a", "b", "c"]}, index=[0, 0, 1])
+    engine_codes = pd.Series(["e1", "e2", "e3"], index=[0, 0, 1])
+    axle_configs = pd.Series(["4x2", "6x2"], index=[0, 1])
+
+    df = utils.join_variants(df, {"component_code": engine_codes, "axle_configuration": axle_configs}, "LIS")
+
+    # The variants of a row next to each other, in the order of the variant table
+    assert df.index.tolist() == [0, 0, 0, 0, 1]
+    assert list(zip(df["type"], df["component_code"], df["axle_configuration"])) == [
+        ("a", "e1", "4x2"), ("a", "e2", "4x2"), ("b", "e1", "4x2"), ("b", "e2", "4x2"), ("c", "e3", "6x2")
+    ]
+    df_fan_out = utils.pop_fan_out_report()
+    assert df_fan_out.to_dict("records") == [
+        {"table": "LIS", "column": "component_code", "n_row_ids": 2, "n_variants": 3, "max_variants_per_row_id": 2,
+         "n_rows_before": 3, "n_rows_after": 5},
+        {"table": "LIS", "column": "axle_configuration", "n_row_ids": 2, "n_variants": 2,
+         "max_variants_per_row_id": 1, "n_rows_before": 5, "n_rows_after": 5},
+    ]
+    assert utils.pop_fan_out_report().empty
+
+
+def test_join_variants_keeps_rows_without_variants():
+    df = pd.DataFrame({"type": ["a", "b"]}, index=[0, 1])
+
+    df = utils.join_variants(df, {"component_code": pd.Series(["e1"], index=[1])}, "LIS")
+
+    assert df["type"].tolist() == ["a", "b"]
+    assert df["component_code"].isnull().tolist() == [True, False]
+    utils.pop_fan_out_report()
+
+
+def test_copy_input_copies_outside_the_copy_free_mode():
+    df = pd.DataFrame({"a": [1, 2]})
+
+    assert utils.copy_input(df) is not df
+    with utils.copy_free_pipeline():
+        assert utils.copy_input(df) is df
+        with utils.copy_free_pipeline(enabled=False):
+            assert utils.copy_input(df) is not df
+        assert utils.copy_input(df) is df
+    assert utils.copy_input(df) is not df
+
+
+def test_copy_free_mode_ends_when_the_pipeline_fails():
+    df = pd.DataFrame({"a": [1, 2]})
+
+    with pytest.raises(RuntimeError):
+        with utils.copy_free_pipeline():
+            raise RuntimeError("broken")
+
+    assert utils.copy_input(df) is not df